@@ -10,6 +10,9 @@ source venv/bin/activate
 # Define functions array
 FUNCTIONS=("split_file" "process_chunk" "merge_results" "recipe_processor" "archive_creator")
 
+# Packages the Python Lambda runtime already ships
+RUNTIME_PROVIDED="boto3|botocore|s3transfer|jmespath|urllib3|python-dateutil|six"
+
 # Create build directory
 mkdir -p build
 
@@ -20,20 +23,28 @@ for func in "${FUNCTIONS[@]}"; do
     # Create function directory
     mkdir -p "build/$func"
     
-    # Install dependencies from function-specific requirements if exists
+    # Install dependencies from function-specific requirements if exists.
+    # The Lambda runtime already provides the AWS SDK, so it is left out
+    # of the zip; requirements.txt still pins it for local runs and tests.
+    requirements="requirements.txt"
     if [ -f "$func/requirements.txt" ]; then
-        pip install -r "$func/requirements.txt" --target "build/$func/"
-    else
-        pip install -r requirements.txt --target "build/$func/"
+        requirements="$func/requirements.txt"
+    fi
+    grep -viE "^($RUNTIME_PROVIDED)([<>=~! ;\[]|$)" "$requirements" > "build/$func/requirements.txt" || true
+    if [ -s "build/$func/requirements.txt" ]; then
+        pip install -r "build/$func/requirements.txt" --target "build/$func/" --no-compile
     fi
+    rm "build/$func/requirements.txt"
     
     # Copy source code
     if [ -f "$func/src/index.py" ]; then
         cp "$func/src/index.py" "build/$func/"
+        # Only the shared modules this handler imports
+        cp $(python3 package_files.py "$func/src/index.py") "build/$func/"
         
         # Create zip file
         cd "build/$func"
-        zip -r "../../$func.zip" ./*
+        zip -r -9 "../../$func.zip" ./* -x "*__pycache__*"
         cd ../..
         echo "✅ Built $func.zip"
     else
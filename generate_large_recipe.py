@@ -1,49 +1,187 @@
+"""
+Generate recipe test files of a given size, reproducibly from a seed.
+
+Records are written to disk one at a time, so memory stays at about one
+record however large the file.  The same seed and options give the same
+bytes.  Shapes match what arrives in production:
+
+    object        {"name": ..., "variations": [record, ...], ...}
+    array         [record, ...]
+    ndjson        one record per line
+    concatenated  records back to back with no separator
+
+--non-ascii puts multi-byte UTF-8 text in that fraction of records, so
+characters straddle chunk boundaries.  --malformed adds a broken region
+(a truncated record, stray brackets or invalid UTF-8) after that fraction
+of records; their byte offsets are listed with --stats.  Files are padded
+with whitespace to exactly --size bytes unless one record is larger.
+
+Usage:
+    python generate_large_recipe.py --size 2GB --seed 7 -o large_recipe.json
+    python generate_large_recipe.py --size 500MB --shape ndjson --non-ascii 0.2 --malformed 0.001 --stats stats.json
+"""
+import argparse
 import json
 import random
+import re
+
+SHAPES = ['object', 'array', 'ndjson', 'concatenated']
+
+DEFAULT_RECORD_SIZE = 150 * 1024
+
+WORDS = ['flour', 'butter', 'sugar', 'salt', 'whisk', 'fold', 'simmer', 'bake', 'until', 'golden',
+         'gently', 'minutes', 'heat', 'pan', 'stir', 'cool', 'serve', 'fresh', 'chopped', 'with']
+NON_ASCII_WORDS = ['crème', 'brûlée', 'jalapeño', 'façon', 'Müsli', 'smørrebrød', 'блины', 'σουβλάκι',
+                   '寿司', '麻婆豆腐', '김치', 'ผัดไทย', '🍲', '🌶️', '👩‍🍳', 'é']
+
+# (opening, separator, closing) around the records of each shape
+_FRAMING = {
+    'object': (b'{"name": "Large Test Recipe", "variations": [', b', ',
+               b'], "detailed_instructions": [], "nutritional_info": [], "reviews": [], "images": []}'),
+    'array': (b'[', b', ', b']'),
+    'ndjson': (b'', b'\n', b'\n'),
+    'concatenated': (b'', b'', b''),
+}
+
+_SIZE = re.compile(r'(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?', re.IGNORECASE)
+
+def parse_size(text):
+    """Bytes in a size such as 5000, 64KB, 1.5GB or 2GiB (units are binary)"""
+    match = _SIZE.fullmatch(text.strip())
+    if not match:
+        raise ValueError(f"Invalid size '{text}'")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit.upper() or ' '))
+
+def _corpus(words, length=256 * 1024):
+    text = ' '.join(random.Random(0).choices(words, k=length // 4))
+    return text[:length]
+
+# Text fields are slices of these, which is much faster than picking words
+_ASCII_TEXT = _corpus(WORDS)
+_NON_ASCII_TEXT = _corpus(NON_ASCII_WORDS + WORDS)
+
+def make_text(rng, length, non_ascii):
+    corpus = _NON_ASCII_TEXT if non_ascii else _ASCII_TEXT
+    while len(corpus) <= length:
+        corpus += corpus
+    start = rng.randrange(len(corpus) - length)
+    return corpus[start:start + length]
 
-def generate_large_recipe():
+def make_variation(rng, number, record_size=DEFAULT_RECORD_SIZE, non_ascii=False):
+    """One recipe variation of roughly record_size bytes"""
+    # Two ingredients for every instruction, each carrying a text block
+    items = max(3, min(75, record_size // 400))
+    text_size = max(8, record_size // items - 90)
+    ingredients = items * 2 // 3
+    return {
+        'id': number,
+        'ingredients': [
+            {
+                'item': f'ingredient_{j}',
+                'amount': round(rng.uniform(1, 1000), 2),
+                'unit': rng.choice(['grams', 'ml', 'cups', 'pieces']),
+                'notes': make_text(rng, rng.randint(text_size // 2, text_size * 3 // 2), non_ascii)
+            } for j in range(ingredients)
+        ],
+        'instructions': [
+            {
+                'step': k,
+                'description': make_text(rng, rng.randint(text_size // 2, text_size * 3 // 2), non_ascii),
+                'timing': rng.randint(1, 120),
+                'temperature': rng.randint(0, 500)
+            } for k in range(items - ingredients)
+        ]
+    }
+
+def make_malformed(rng, number, record_size):
+    """Bytes that are not valid JSON, of one of the kinds seen in bad uploads"""
+    kind = rng.choice(['truncated', 'brackets', 'bytes'])
+    if kind == 'truncated':
+        data = json.dumps(make_variation(rng, number, record_size // 4)).encode('utf-8')
+        return data[:rng.randint(1, len(data) - 1)]
+    if kind == 'brackets':
+        return ''.join(rng.choices('{}[]:,"', k=rng.randint(1, 16))).encode('utf-8')
+    # A lone lead byte, a continuation byte with no lead, and invalid bytes
+    return bytes(rng.choices([0xc3, 0x80, 0xbf, 0xfe, 0xff, 0x00], k=rng.randint(1, 8)))
+
+def write_recipe_file(path, size, shape='object', seed=0, record_size=DEFAULT_RECORD_SIZE,
+                      non_ascii=0.0, malformed=0.0):
+    """Write a file of size bytes in shape; returns what was written.
+
+    The result holds the file's size, the number of (valid) records and the
+    [offset, length] of each malformed region.
+    """
+    opening, separator, closing = _FRAMING[shape]
+    rng = random.Random(seed)
+    records = 0
+    regions = []
+
+    with open(path, 'wb', buffering=1024 * 1024) as f:
+        f.write(opening)
+        written = len(opening)
+        while True:
+            data = json.dumps(
+                make_variation(rng, records, record_size, rng.random() < non_ascii),
+                ensure_ascii=False
+            ).encode('utf-8')
+            if records:
+                data = separator + data
+            if records and written + len(data) + len(closing) > size:
+                break
+            f.write(data)
+            written += len(data)
+            records += 1
+
+            if malformed and rng.random() < malformed:
+                region = make_malformed(rng, records, record_size)
+                if written + len(separator) + len(region) + len(closing) <= size:
+                    f.write(separator + region)
+                    regions.append([written + len(separator), len(region)])
+                    written += len(separator) + len(region)
+
+        # Whitespace is allowed between any two JSON tokens
+        padding = max(0, size - written - len(closing))
+        f.write(b' ' * padding + closing)
+        written += padding + len(closing)
+
+    return {'size': written, 'records': records, 'malformed': regions}
+
+def generate_large_recipe(num_variations=10000, seed=0, record_size=DEFAULT_RECORD_SIZE):
+    """A whole recipe in memory, for callers that want a few variations as a dict"""
+    rng = random.Random(seed)
     recipe = {
         "name": "Large Test Recipe",
-        "variations": [],
+        "variations": [make_variation(rng, i, record_size) for i in range(num_variations)],
         "detailed_instructions": [],
         "nutritional_info": [],
         "reviews": [],
         "images": []
     }
+    return recipe
 
-    # Generate large amount of data
-    for i in range(10000):  # Reduced from 500000 to 10000
-        variation = {
-            "id": i,
-            "ingredients": [
-                {
-                    "item": f"ingredient_{j}",
-                    "amount": random.uniform(1, 1000),
-                    "unit": "grams",
-                    "notes": "x" * 2000  # Large text blocks
-                } for j in range(50)  # Reduced from 100 to 50
-            ],
-            "instructions": [
-                {
-                    "step": k,
-                    "description": "y" * 2000,  # Reduced from 4000 to 2000
-                    "timing": random.randint(1, 120),
-                    "temperature": random.randint(0, 500)
-                } for k in range(25)  # Reduced from 50 to 25
-            ]
-        }
-        recipe["variations"].append(variation)
-
-        # Print progress
-        if i % 1000 == 0:
-            print(f"Generated {i} variations...")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='large_recipe.json')
+    parser.add_argument('--size', type=parse_size, default=parse_size('1.5GB'), help='file size, e.g. 500MB or 2GB')
+    parser.add_argument('--shape', choices=SHAPES, default='object')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record-size', type=parse_size, default=DEFAULT_RECORD_SIZE,
+                        help='approximate size of each record')
+    parser.add_argument('--non-ascii', type=float, default=0.0, help='fraction of records with non-ASCII text')
+    parser.add_argument('--malformed', type=float, default=0.0,
+                        help='fraction of records followed by a malformed region')
+    parser.add_argument('--stats', help='write the record count and malformed regions to this JSON file')
+    args = parser.parse_args()
 
-    return recipe
+    print(f"Writing {args.size} bytes of {args.shape} records to {args.output} (seed {args.seed})")
+    stats = write_recipe_file(args.output, args.size, args.shape, args.seed, args.record_size,
+                              args.non_ascii, args.malformed)
+    print(f"Wrote {stats['records']} records and {len(stats['malformed'])} malformed regions")
+
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump({**stats, 'options': vars(args)}, f, indent=2)
 
 if __name__ == "__main__":
-    print("Starting to generate large recipe...")
-    recipe = generate_large_recipe()
-    print("Writing to file...")
-    with open('large_recipe.json', 'w') as f:
-        json.dump(recipe, f)
-    print("Done!")
+    main()
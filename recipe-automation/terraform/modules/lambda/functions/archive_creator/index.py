@@ -1,7 +1,7 @@
 import json
 import os
-import boto3
 from datetime import datetime
+from aws_clients import get_client
 
 def lambda_handler(event, context):
     """
@@ -14,7 +14,7 @@ def lambda_handler(event, context):
     Returns:
         dict: Archive creation result
     """
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     
     try:
         recipe_bucket = os.environ['RECIPE_BUCKET']
@@ -1,10 +1,10 @@
-import boto3
 import os
-import zipfile
 import io
 import json
+from aws_clients import get_client
+from zip_stream import DEFAULT_CODEC, ZipStreamWriter, parse_codec
 
-s3 = boto3.client('s3')
+s3 = get_client('s3')
 RECIPE_BUCKET = os.environ['RECIPE_BUCKET']
 ARCHIVE_BUCKET = os.environ['ARCHIVE_BUCKET']
 
@@ -24,11 +24,14 @@ def handler(event, context):
             files_to_archive = event.get('files', [])
             archive_name = event.get('archive_name', 'recipe_archive.zip')
         
+        # Direct invocations can pick the codec, e.g. "compression": "lzma:9"
+        compress_type, level = parse_codec(event.get('compression', DEFAULT_CODEC))
+        
         print(f"Creating archive {archive_name} with files: {files_to_archive}")
         
         # Create in-memory zip file
         zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        with ZipStreamWriter(zip_buffer, compress_type, level) as zip_file:
             for file_key in files_to_archive:
                 print(f"Processing file: {file_key}")
                 # Download file from recipes bucket
@@ -1,9 +1,9 @@
 import json
-import boto3
 from datetime import datetime
+from aws_clients import get_client
 
 def lambda_handler(event, context):
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     try:
         # Get bucket and key from event
         bucket = event['Records'][0]['s3']['bucket']['name']
@@ -0,0 +1,92 @@
+"""
+Compare the ZIP codecs on recipe data produced by generate_large_recipe.py:
+compression throughput (MB/s of input), ratio, and decompression
+throughput for the codecs zipfile can read.
+
+Usage (from the functions directory):
+    python benchmarks/bench_codecs.py --variations 200
+    python benchmarks/bench_codecs.py --codecs deflate:1 deflate:6 lzma:6 --json codecs.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTIONS_DIR, '..', '..', '..', '..', '..'))
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'shared'))
+sys.path.insert(0, REPO_ROOT)
+
+from zip_stream import ZIP_ZSTANDARD, ZipStreamWriter, parse_codec
+
+CODECS = ['stored', 'deflate:1', 'deflate:6', 'deflate:9', 'bzip2:9', 'lzma:6', 'zstd:3', 'zstd:19']
+
+def load_data(args):
+    if args.input:
+        with open(args.input, 'rb') as f:
+            return f.read()
+    from generate_large_recipe import generate_large_recipe
+    recipe = generate_large_recipe(args.variations)
+    # JSON Lines, the way chunk data reaches the merge
+    return b''.join(json.dumps(v).encode('utf-8') + b'\n' for v in recipe['variations'])
+
+def compress(data, compress_type, level, write_size):
+    out = io.BytesIO()
+    with ZipStreamWriter(out, compress_type, level) as archive:
+        with archive.open('records.jsonl') as entry:
+            for i in range(0, len(data), write_size):
+                entry.write(data[i:i + write_size])
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='file to compress instead of generated recipes')
+    parser.add_argument('--variations', type=int, default=100)
+    parser.add_argument('--codecs', nargs='+', default=CODECS)
+    parser.add_argument('--write-mb', type=float, default=1, help='size of each write into the entry')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    data = load_data(args)
+    size_mb = len(data) / (1024 * 1024)
+    print(f"Compressing {size_mb:.1f} MB with {os.cpu_count()} CPUs")
+    print(f"{'codec':10} {'MB/s':>9} {'ratio':>8} {'size MB':>9} {'unzip MB/s':>11}")
+
+    results = {}
+    for codec in args.codecs:
+        try:
+            compress_type, level = parse_codec(codec)
+        except ValueError as e:
+            print(f"{codec:10} skipped: {e}")
+            continue
+
+        start = time.perf_counter()
+        archive = compress(data, compress_type, level, max(1, int(args.write_mb * 1024 * 1024)))
+        elapsed = time.perf_counter() - start
+
+        unzip_rate = None
+        if compress_type != ZIP_ZSTANDARD:
+            start = time.perf_counter()
+            assert zipfile.ZipFile(io.BytesIO(archive)).read('records.jsonl') == data
+            unzip_rate = size_mb / (time.perf_counter() - start)
+
+        result = results[codec] = {
+            'mb_per_s': round(size_mb / elapsed, 1),
+            'ratio': round(len(data) / len(archive), 2),
+            'compressed_bytes': len(archive),
+            'unzip_mb_per_s': unzip_rate and round(unzip_rate, 1),
+        }
+        unzip_text = f"{result['unzip_mb_per_s']:11.1f}" if unzip_rate else f"{'-':>11}"
+        print(f"{codec:10} {result['mb_per_s']:9.1f} {result['ratio']:8.2f} "
+              f"{len(archive) / (1024 * 1024):9.2f} {unzip_text}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'input_bytes': len(data), 'cpus': os.cpu_count(), 'codecs': results}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Measure the cold-start cost of each deployable handler.
+
+Every handler is laid out the way build.sh packages it (index.py next to the
+shared modules it imports) and started in fresh interpreters.  Each run
+reports the time to import index.py and the time to create the AWS clients
+the handler asks for; the package size is the size of the zipped layout
+without the runtime-provided SDK.  Medians across runs are printed, and
+--json writes them out so results can be compared between commits with
+--baseline.
+
+Usage (from the functions directory):
+    python benchmarks/bench_cold_start.py --runs 5
+    python benchmarks/bench_cold_start.py --json cold_start.json
+    python benchmarks/bench_cold_start.py --baseline cold_start.json --max-regression 20
+"""
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from package_files import shared_modules
+
+FUNCTIONS = ['split_file', 'process_chunk', 'merge_results', 'recipe_processor', 'archive_creator']
+
+# Runs inside the fresh interpreter, with the package directory as cwd
+PROBE = """
+import json, sys, time
+sys.path.insert(0, '.')
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+from aws_clients import get_client
+for service in sys.argv[1:]:
+    get_client(service)
+ready = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'client_init_ms': (ready - imported) * 1000}))
+"""
+
+def build_package(func, target):
+    handler = os.path.join(FUNCTIONS_DIR, func, 'src', 'index.py')
+    for path in [handler] + shared_modules(handler):
+        shutil.copy(path, target)
+    with open(handler, encoding='utf-8') as f:
+        services = sorted(set(re.findall(r"get_client\('(\w+)'\)", f.read())))
+
+    zipped = io.BytesIO()
+    with zipfile.ZipFile(zipped, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zip_file:
+        for name in sorted(os.listdir(target)):
+            zip_file.write(os.path.join(target, name), name)
+    return services, len(zipped.getvalue())
+
+def measure(func, runs):
+    with tempfile.TemporaryDirectory() as target:
+        services, package_bytes = build_package(func, target)
+        env = dict(os.environ)
+        env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        env.setdefault('ENVIRONMENT', 'bench')
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE] + services,
+                cwd=target, env=env, check=True, capture_output=True, text=True
+            ).stdout
+            sample = json.loads(output.strip().splitlines()[-1])
+            sample['process_ms'] = (time.perf_counter() - start) * 1000
+            samples.append(sample)
+
+    result = {'services': services, 'package_kb': round(package_bytes / 1024, 1)}
+    for metric in ('import_ms', 'client_init_ms', 'process_ms'):
+        result[metric] = round(statistics.median(s[metric] for s in samples), 1)
+    return result
+
+def compare(results, baseline, max_regression):
+    """Print changes against a baseline; returns True if nothing regressed"""
+    ok = True
+    for func, result in results.items():
+        before = baseline.get(func)
+        if not before:
+            continue
+        for metric in ('import_ms', 'client_init_ms', 'package_kb'):
+            if not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            flag = ''
+            if change > max_regression:
+                flag = '  REGRESSION'
+                ok = False
+            print(f"{func:18} {metric:15} {before[metric]:8.1f} -> {result[metric]:8.1f}  ({change:+.0f}%){flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler')
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help='percent increase over the baseline that fails the run')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'function':18} {'import ms':>10} {'clients ms':>11} {'process ms':>11} {'zip KB':>8}  services")
+    for func in args.functions:
+        result = results[func] = measure(func, args.runs)
+        print(f"{func:18} {result['import_ms']:10.1f} {result['client_init_ms']:11.1f} "
+              f"{result['process_ms']:11.1f} {result['package_kb']:8.1f}  {','.join(result['services'])}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare the columnar encoding, with and without compressed strings,
+against JSON for data produced by generate_large_recipe.py: encoded size,
+time to load every record, and time to load a single nested column.
+
+Usage (from the functions directory):
+    python benchmarks/bench_columnar.py --variations 400
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTIONS_DIR, '..', '..', '..', '..', '..'))
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'shared'))
+sys.path.insert(0, REPO_ROOT)
+
+from columnar import ColumnarFile, encode_records
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variations', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from generate_large_recipe import generate_large_recipe
+    records = generate_large_recipe(args.variations)['variations']
+
+    json_data = json.dumps(records).encode('utf-8')
+    json_time, json_records = best_of(lambda: json.loads(json_data), args.repeat)
+    print(f"JSON:   {len(json_data) / 1024 / 1024:8.2f} MB, load {json_time:.3f}s")
+
+    for compress in (False, True):
+        label = 'columnar+zlib' if compress else 'columnar'
+        encode_time, columnar_data = best_of(lambda: encode_records(records, compress), args.repeat)
+        columnar_time, columnar_records = best_of(lambda: ColumnarFile(columnar_data).records(), args.repeat)
+        amounts_time, amounts = best_of(lambda: ColumnarFile(columnar_data).column('ingredients.amount'), args.repeat)
+        print(f"{label}: {len(columnar_data) / 1024 / 1024:8.2f} MB "
+              f"({len(json_data) / len(columnar_data):.1f}x smaller), encode {encode_time:.3f}s, "
+              f"load {columnar_time:.3f}s ({json_time / columnar_time:.1f}x json.loads), "
+              f"identical: {json_records == columnar_records}")
+        print(f"    ingredients.amount ({len(amounts)} values) {amounts_time:.4f}s "
+              f"({json_time / amounts_time:.0f}x faster than loading the JSON)")
+
+if __name__ == '__main__':
+    main()
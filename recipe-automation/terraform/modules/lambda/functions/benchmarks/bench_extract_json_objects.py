@@ -0,0 +1,88 @@
+"""
+Compare the shared object scanner against the original
+raw_decode loop on data produced by generate_large_recipe.py.
+
+Usage (from the functions directory):
+    python benchmarks/bench_extract_json_objects.py --variations 400 --chunk-mb 50
+    python benchmarks/bench_extract_json_objects.py --input large_recipe.json --chunk-mb 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTIONS_DIR, '..', '..', '..', '..', '..'))
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'shared'))
+sys.path.insert(0, REPO_ROOT)
+
+from json_scan import extract_json_objects
+
+def legacy_extract_json_objects(text):
+    """The original extract_json_objects, kept as the baseline"""
+    objects = []
+    start = 0
+    while True:
+        try:
+            start = text.find('{', start)
+            if start == -1:
+                break
+
+            decoder = json.JSONDecoder()
+            obj, end = decoder.raw_decode(text[start:])
+            objects.append(obj)
+            start = start + end
+
+        except json.JSONDecodeError:
+            start += 1
+            continue
+
+    return objects
+
+def load_text(args):
+    if args.input:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            return f.read(args.chunk_mb * 1024 * 1024 if args.chunk_mb else -1)
+
+    from generate_large_recipe import generate_large_recipe
+    text = json.dumps(generate_large_recipe(args.variations))
+    if args.chunk_mb:
+        text = text[:args.chunk_mb * 1024 * 1024]
+    return text
+
+def timed(func, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='JSON file written by generate_large_recipe.py')
+    parser.add_argument('--variations', type=int, default=100,
+                        help='variations to generate when no --input is given')
+    parser.add_argument('--chunk-mb', type=int, default=0,
+                        help='only scan the first N MB, like a process_chunk range')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='only time the new scanner')
+    args = parser.parse_args()
+
+    text = load_text(args)
+    size_mb = len(text) / (1024 * 1024)
+    print(f"Scanning {size_mb:.1f} MB of text")
+
+    new_time, new_objects = timed(extract_json_objects, text, args.repeat)
+    print(f"extract_json_objects:        {new_time:8.3f}s  {size_mb / new_time:8.1f} MB/s  {len(new_objects)} objects")
+
+    if not args.skip_legacy:
+        old_time, old_objects = timed(legacy_extract_json_objects, text, args.repeat)
+        print(f"legacy_extract_json_objects: {old_time:8.3f}s  {size_mb / old_time:8.1f} MB/s  {len(old_objects)} objects")
+        print(f"Speedup: {old_time / new_time:.1f}x, identical output: {old_objects == new_objects}")
+
+if __name__ == '__main__':
+    main()
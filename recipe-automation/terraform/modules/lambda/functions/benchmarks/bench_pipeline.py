@@ -0,0 +1,156 @@
+"""
+Benchmark the whole pipeline end to end: split_file, the chunks and the
+merge, run by local_pipeline against a directory-backed S3 stand-in.
+
+Inputs of each --sizes and --shapes are written by generate_large_recipe.py,
+uploaded and processed --runs times.  For every stage the median wall time
+is reported with the input MB/s and records/s it works out to, and the peak
+RSS of the busiest process (what Lambda reports as Max Memory Used for that
+function).
+Uploads under split_file's direct-processing threshold only have a split
+stage.  --json writes the results, tagged with the commit and machine, and
+--baseline compares a run against such a file.
+
+Chunk planning follows the usual environment variables, e.g.
+MIN_CHUNK_BYTES or CHUNK_MEMORY_MB, which must be set for the whole run.
+
+Usage (from the functions directory):
+    python benchmarks/bench_pipeline.py --sizes 4 64 256 --workers 8
+    python benchmarks/bench_pipeline.py --shapes ndjson --json pipeline.json
+    python benchmarks/bench_pipeline.py --baseline pipeline.json --max-regression 15
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTIONS_DIR, '..', '..', '..', '..', '..'))
+sys.path.insert(0, FUNCTIONS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from generate_large_recipe import DEFAULT_RECORD_SIZE, SHAPES, parse_size, write_recipe_file
+from local_pipeline import LocalS3, run_pipeline
+
+MB = 1024 * 1024
+
+def measure(shape, size_mb, workers, runs, seed, record_size):
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as root:
+            source = os.path.join(root, 'input.json')
+            written = write_recipe_file(source, int(size_mb * MB), shape, seed, record_size)
+            input_bytes, records = written['size'], written['records']
+            LocalS3(root).upload_file(source, 'bench', 'uploads/bench.json')
+            os.remove(source)
+            samples.append(run_pipeline(root, 'bench', 'uploads/bench.json', workers, quiet=True))
+
+    result = {
+        'shape': shape,
+        'input_mb': round(input_bytes / MB, 2),
+        'records': records,
+        'chunks': samples[0]['chunks'],
+        'stages': {}
+    }
+    stages = list(samples[0]['stages']) + ['total']
+    for stage in stages:
+        if stage == 'total':
+            seconds = statistics.median(sum(s['seconds'] for s in sample['stages'].values()) for sample in samples)
+            peak = max(s['peak_rss'] for sample in samples for s in sample['stages'].values())
+        else:
+            seconds = statistics.median(sample['stages'][stage]['seconds'] for sample in samples)
+            peak = max(sample['stages'][stage]['peak_rss'] for sample in samples)
+        result['stages'][stage] = {
+            'seconds': round(seconds, 3),
+            'mb_per_s': round(input_bytes / MB / seconds, 1) if seconds else None,
+            'records_per_s': round(records / seconds) if seconds else None,
+            'peak_rss_mb': round(peak / MB, 1),
+        }
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=FUNCTIONS_DIR,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(cases, baseline, max_regression):
+    """Print changes against a baseline; returns True if nothing regressed"""
+    ok = True
+    for name, case in cases.items():
+        before = baseline.get('cases', {}).get(name)
+        if not before:
+            continue
+        for stage, measured in case['stages'].items():
+            previous = before['stages'].get(stage)
+            if not previous:
+                continue
+            for metric in ('seconds', 'peak_rss_mb'):
+                if not previous.get(metric):
+                    continue
+                change = (measured[metric] - previous[metric]) / previous[metric] * 100
+                flag = ''
+                if change > max_regression:
+                    flag = '  REGRESSION'
+                    ok = False
+                print(f"{name:20} {stage:8} {metric:12} {previous[metric]:9.2f} -> {measured[metric]:9.2f}  "
+                      f"({change:+.0f}%){flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[4, 32, 128], help='input sizes in MB')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record-size', type=parse_size, default=DEFAULT_RECORD_SIZE,
+                        help='approximate size of each generated record')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--runs', type=int, default=3, help='runs per input; times are medians')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help='percent increase in time or peak RSS over the baseline that fails the run')
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers on {os.cpu_count()} CPUs, {args.runs} runs per input")
+    print(f"{'input':20} {'chunks':>6} {'stage':8} {'seconds':>9} {'MB/s':>8} {'records/s':>10} {'peak MB':>8}")
+    cases = {}
+    for shape in args.shapes:
+        for size_mb in args.sizes:
+            name = f'{shape}-{size_mb:g}MB'
+            case = cases[name] = measure(shape, size_mb, args.workers, args.runs, args.seed, args.record_size)
+            for stage, measured in case['stages'].items():
+                print(f"{name:20} {case['chunks']:6} {stage:8} {measured['seconds']:9.3f} "
+                      f"{measured['mb_per_s'] or 0:8.1f} {measured['records_per_s'] or 0:10} "
+                      f"{measured['peak_rss_mb']:8.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'machine': {
+                    'cpus': os.cpu_count(),
+                    'platform': platform.platform(),
+                    'python': platform.python_version(),
+                },
+                'workers': args.workers,
+                'runs': args.runs,
+                'seed': args.seed,
+                'record_size': args.record_size,
+                'cases': cases,
+            }, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(cases, baseline, args.max_regression):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
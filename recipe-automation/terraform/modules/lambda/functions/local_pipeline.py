@@ -0,0 +1,451 @@
+"""
+Run the recipe pipeline on this machine, without S3 events or Step Functions.
+
+split_file, process_chunk and merge_results run unchanged against LocalS3,
+which keeps each bucket as a directory under a root.  The executor plays
+the state machine: it reads the chunk manifest split_file wrote, runs
+process_chunk for every chunk across a process pool, writes the results
+the way the distributed Map's ResultWriter does, then calls merge_results
+through plan, merge_group (also across the pool) and finalize.  Uploads
+small enough for split_file to process directly never reach the pool.
+
+Use it to reprocess backfills on a large machine, or to see how the
+pipeline scales with --workers.  The chunk planner sizes chunks for
+--workers slots unless MAP_MAX_CONCURRENCY is set.
+
+Usage (from the functions directory):
+    python local_pipeline.py big-recipe.json --root /data/s3 --workers 32
+    python local_pipeline.py --root /data/s3 --bucket recipes --key uploads/big-recipe.json
+    python local_pipeline.py big-recipe.json --output-format jsonl --compression deflate:1
+"""
+import argparse
+import contextlib
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'shared'))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from aws_clients import set_client
+
+LOCAL_STATE_MACHINE_ARN = 'arn:aws:states:local:000000000000:stateMachine:recipe-processor'
+
+# Where the distributed Map's ResultWriter puts chunk results
+MAP_RESULTS_PREFIX = 'processed/map-results'
+
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+class LocalS3:
+    """The S3 calls the handlers make, on files under root.
+
+    Objects live at root/<bucket>/<key>, with their metadata, content type
+    and ETag beside them under root/.metadata.  Writes go to a temporary
+    file that replaces the object, so processes sharing a root never see
+    half-written objects.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _metadata_path(self, bucket, key):
+        return os.path.join(self.root, '.metadata', bucket, *key.split('/')) + '.json'
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def _write(self, bucket, key, chunks):
+        """Write an object from an iterable of byte strings"""
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+        os.replace(temp_path, path)
+
+    def _save_info(self, bucket, key, etag, put_args):
+        info = {
+            'ETag': etag,
+            'ContentType': put_args.get('ContentType', 'binary/octet-stream'),
+            'Metadata': put_args.get('Metadata', {})
+        }
+        metadata_path = self._metadata_path(bucket, key)
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+        with open(metadata_path, 'w') as f:
+            json.dump(info, f)
+        return info
+
+    def _info(self, bucket, key):
+        try:
+            with open(self._metadata_path(bucket, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # An object copied in by hand; hash it once
+            with open(self.path(bucket, key), 'rb') as f:
+                etag = f'"{_md5_file(f)}"'
+            return self._save_info(bucket, key, etag, {})
+
+    def head_object(self, Bucket, Key, **kwargs):
+        stat = os.stat(self.path(Bucket, Key))
+        info = self._info(Bucket, Key)
+        return {
+            'ContentLength': stat.st_size,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            **info
+        }
+
+    def get_object(self, Bucket, Key, Range=None):
+        with open(self.path(Bucket, Key), 'rb') as f:
+            if Range:
+                start, end = (int(x) for x in Range.replace('bytes=', '').split('-'))
+                f.seek(start)
+                data = f.read(end - start + 1)
+            else:
+                data = f.read()
+        return {'Body': _Body(data), 'ContentLength': len(data)}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, (bytes, bytearray, memoryview)):
+            Body = Body.read()
+        self._write(Bucket, Key, [Body])
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        self._save_info(Bucket, Key, etag, kwargs)
+        return {'ETag': etag}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        """Copy a local file in as an object, like boto3's upload_file"""
+        md5 = hashlib.md5()
+
+        def blocks():
+            with open(Filename, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+                    md5.update(block)
+                    yield block
+
+        self._write(Bucket, Key, blocks())
+        self._save_info(Bucket, Key, f'"{md5.hexdigest()}"', ExtraArgs or {})
+
+    def delete_objects(self, Bucket, Delete):
+        deleted = []
+        for obj in Delete['Objects']:
+            for path in (self.path(Bucket, obj['Key']), self._metadata_path(Bucket, obj['Key'])):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            deleted.append({'Key': obj['Key']})
+        return {'Deleted': deleted}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        with open(os.path.join(self._upload_dir(upload_id), 'put_args.json'), 'w') as f:
+            json.dump(kwargs, f)
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def _write_part(self, upload_id, part_number, chunks):
+        md5 = hashlib.md5()
+        with open(os.path.join(self._upload_dir(upload_id), f'{part_number:05d}'), 'wb') as f:
+            for data in chunks:
+                md5.update(data)
+                f.write(data)
+        return f'"{md5.hexdigest()}"'
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if not isinstance(Body, (bytes, bytearray, memoryview)):
+            Body = Body.read()
+        return {'ETag': self._write_part(UploadId, PartNumber, [Body])}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None):
+        source = self.path(CopySource['Bucket'], CopySource['Key'])
+        size = os.path.getsize(source)
+        start, end = 0, size - 1
+        if CopySourceRange:
+            start, end = (int(x) for x in CopySourceRange.replace('bytes=', '').split('-'))
+
+        def blocks():
+            with open(source, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    block = f.read(min(COPY_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    yield block
+
+        etag = self._write_part(UploadId, PartNumber, blocks())
+        return {'CopyPartResult': {'ETag': etag}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload_dir = self._upload_dir(UploadId)
+        with open(os.path.join(upload_dir, 'put_args.json')) as f:
+            put_args = json.load(f)
+        parts = MultipartUpload['Parts']
+
+        def blocks():
+            for part in parts:
+                with open(os.path.join(upload_dir, f"{part['PartNumber']:05d}"), 'rb') as f:
+                    yield from iter(lambda: f.read(COPY_BLOCK_SIZE), b'')
+
+        # S3's multipart ETag: the MD5 of the parts' MD5s and the part count
+        part_md5s = b''.join(bytes.fromhex(part['ETag'].strip('"')) for part in parts)
+        etag = f'"{hashlib.md5(part_md5s).hexdigest()}-{len(parts)}"'
+        self._write(Bucket, Key, blocks())
+        self._save_info(Bucket, Key, etag, put_args)
+        shutil.rmtree(upload_dir)
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        shutil.rmtree(self._upload_dir(UploadId), ignore_errors=True)
+        return {}
+
+class _Body:
+    """The read() side of botocore's StreamingBody"""
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._position = 0
+
+    def read(self, amt=None):
+        end = len(self._data) if amt is None else self._position + amt
+        data = bytes(self._data[self._position:end])
+        self._position += len(data)
+        return data
+
+    def close(self):
+        pass
+
+def _md5_file(f):
+    md5 = hashlib.md5()
+    for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+        md5.update(block)
+    return md5.hexdigest()
+
+class LocalStepFunctions:
+    """Records start_execution calls instead of running a state machine"""
+
+    def __init__(self):
+        self.executions = []
+
+    def start_execution(self, stateMachineArn, input, name=None):
+        name = name or uuid.uuid4().hex
+        execution_arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        self.executions.append({'executionArn': execution_arn, 'input': json.loads(input)})
+        return {'executionArn': execution_arn, 'startDate': datetime.now(timezone.utc)}
+
+def handler(func):
+    """The lambda_handler of a function's src/index.py"""
+    return importlib.import_module(f'{func}.src.index').lambda_handler
+
+def _use_local_clients(root):
+    """Point the handlers' clients in this process at the stand-ins"""
+    s3_client = LocalS3(root)
+    sfn_client = LocalStepFunctions()
+    set_client('s3', s3_client)
+    set_client('stepfunctions', sfn_client)
+    return s3_client, sfn_client
+
+def _init_worker(root, quiet):
+    _use_local_clients(root)
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    handler('process_chunk')
+    handler('merge_results')
+
+def _ready(_):
+    return os.getpid()
+
+def reset_peak_rss():
+    """Start measuring this process's peak RSS afresh (Linux only)"""
+    with contextlib.suppress(OSError):
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+
+def peak_rss():
+    """Bytes of this process's peak RSS since reset_peak_rss, or since it started"""
+    with contextlib.suppress(OSError):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _invoke(func, event):
+    """Run a handler in a pool worker, round-tripping through JSON like Lambda.
+
+    Returns the output and the worker's peak RSS during the call, which is
+    what Lambda reports as Max Memory Used.
+    """
+    reset_peak_rss()
+    output = handler(func)(json.loads(json.dumps(event)), None)
+    return json.loads(json.dumps(output)), peak_rss()
+
+def _invoke_all(pool, func, events):
+    """Invoke func for every event across the pool; returns the outputs and the highest peak RSS"""
+    results = list(pool.map(_invoke, [func] * len(events), events))
+    return [output for output, _ in results], max((peak for _, peak in results), default=0)
+
+def write_map_results(s3_client, bucket, outputs):
+    """Save chunk results the way the distributed Map's ResultWriter does.
+
+    Returns the ResultSelector's output, which PlanMerge takes as items.
+    """
+    prefix = f'{MAP_RESULTS_PREFIX}/{uuid.uuid4()}'
+    result_key = f'{prefix}/SUCCEEDED_0.json'
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=result_key,
+        Body=json.dumps([{'Status': 'SUCCEEDED', 'Output': json.dumps(output)} for output in outputs])
+    )
+    manifest_key = f'{prefix}/manifest.json'
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=manifest_key,
+        Body=json.dumps({
+            'DestinationBucket': bucket,
+            'ResultFiles': {'SUCCEEDED': [{'Key': result_key, 'Size': 0}], 'FAILED': [], 'PENDING': []}
+        })
+    )
+    return {'bucket': bucket, 'map_results_key': manifest_key}
+
+def run_state_machine(s3_client, execution_input, pool):
+    """Run the workflow for an execution input.
+
+    Returns the merge result, the records the chunks found, and the
+    seconds and peak RSS of the process and merge stages.
+    """
+    stages = {}
+    manifest = execution_input['manifest']
+    response = s3_client.get_object(Bucket=manifest['bucket'], Key=manifest['key'])
+    chunks = json.loads(response['Body'].read())
+
+    # ProcessChunks
+    start = time.perf_counter()
+    outputs, peak = _invoke_all(pool, 'process_chunk', chunks)
+    items = write_map_results(s3_client, manifest['bucket'], outputs)
+    stages['process'] = {'seconds': time.perf_counter() - start, 'peak_rss': peak}
+    records = sum(output.get('objects_found', 0) for output in outputs)
+
+    # PlanMerge / MergeGroups until the plan is final, then MergeResults
+    start = time.perf_counter()
+    reset_peak_rss()
+    peak = 0
+    merge = handler('merge_results')
+    while True:
+        plan = merge({'action': 'plan', 'items': items}, None)
+        if plan['final']:
+            break
+        events = [{'action': 'merge_group', 'items': group} for group in plan['groups']]
+        items, group_peak = _invoke_all(pool, 'merge_results', events)
+        peak = max(peak, group_peak)
+    result = merge({'action': 'finalize', 'items': plan['items']}, None)
+    stages['merge'] = {'seconds': time.perf_counter() - start, 'peak_rss': max(peak, peak_rss())}
+    return result, records, stages
+
+def run_pipeline(root, bucket, key, workers=None, quiet=False):
+    """Process s3://bucket/key under root the way an upload would be.
+
+    Returns the output location, the chunk and record counts, and the
+    seconds and peak RSS (the highest of any process) of each stage: split,
+    process and merge, or only split for uploads it processes itself.
+    """
+    workers = workers or os.cpu_count()
+    # Read when the handlers' modules are imported
+    os.environ.setdefault('STEP_FUNCTION_ARN', LOCAL_STATE_MACHINE_ARN)
+    os.environ.setdefault('MAP_MAX_CONCURRENCY', str(workers))
+    os.environ.setdefault('ENVIRONMENT', 'local')
+
+    s3_client, sfn_client = _use_local_clients(root)
+    stdout = open(os.devnull, 'w') if quiet else sys.stdout
+    try:
+        with contextlib.redirect_stdout(stdout):
+            start = time.perf_counter()
+            reset_peak_rss()
+            event = {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]}
+            body = json.loads(handler('split_file')(event, None)['body'])
+            stages = {'split': {'seconds': time.perf_counter() - start, 'peak_rss': peak_rss()}}
+
+            if not sfn_client.executions:
+                # split_file processed the upload itself
+                return {'output': body['output'], 'chunks': body['chunks'],
+                        'records': body['objects_found'], 'stages': stages}
+
+            execution_input = sfn_client.executions[-1]['input']
+            # Fresh interpreters: forking would copy the state of the thread
+            # pools the shared modules run, locks and all
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(workers, context, _init_worker, (root, quiet)) as pool:
+                # Workers start on demand; start them all before timing
+                list(pool.map(_ready, range(workers)))
+                result, records, machine_stages = run_state_machine(s3_client, execution_input, pool)
+            stages.update(machine_stages)
+            return {'output': result['output'], 'chunks': execution_input['total_chunks'],
+                    'records': records, 'stages': stages}
+    finally:
+        if quiet:
+            stdout.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', help='local file to upload to --key and process')
+    parser.add_argument('--root', default='local-s3', help='directory holding the buckets')
+    parser.add_argument('--bucket', default='recipes')
+    parser.add_argument('--key', help='object to process (default uploads/<input file name>)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes running chunks and merge groups')
+    parser.add_argument('--output-format', help='x-amz-meta-output-format for the upload')
+    parser.add_argument('--merge-mode', help='x-amz-meta-merge-mode for the upload')
+    parser.add_argument('--compression', help='x-amz-meta-compression for the upload')
+    parser.add_argument('--record-index', help='x-amz-meta-record-index for the upload (true or false)')
+    parser.add_argument('--quiet', action='store_true', help="hide the handlers' logs")
+    parser.add_argument('--json', help='write the result to this file')
+    args = parser.parse_args()
+
+    if not args.input and not args.key:
+        parser.error('pass an input file or --key')
+    key = args.key or f'uploads/{os.path.basename(args.input)}'
+    # The bucket notification only fires for these keys, and the output
+    # keys are derived by replacing them
+    if not key.startswith('uploads/') or not key.endswith('.json'):
+        parser.error(f'{key} is not under uploads/ with a .json suffix')
+
+    if args.input:
+        metadata = {
+            name: value for name, value in (
+                ('output-format', args.output_format),
+                ('merge-mode', args.merge_mode),
+                ('compression', args.compression),
+                ('record-index', args.record_index),
+            ) if value
+        }
+        LocalS3(args.root).upload_file(args.input, args.bucket, key, ExtraArgs={'Metadata': metadata})
+
+    result = run_pipeline(args.root, args.bucket, key, args.workers, args.quiet)
+    output_path = LocalS3(args.root).path(*result['output'].replace('s3://', '').split('/', 1))
+    print(f"Processed {result['records']} records from {args.bucket}/{key} "
+          f"in {result['chunks']} chunks with {args.workers} workers")
+    for stage, measured in result['stages'].items():
+        print(f"  {stage:8} {measured['seconds']:8.2f}s  peak RSS {measured['peak_rss'] / (1024 * 1024):7.1f} MB")
+    print(f"Output: {output_path}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**result, 'workers': args.workers, 'output_path': output_path}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+List the shared modules a handler needs in its deployment zip.
+
+Follows every import of a shared module, including imports deferred into
+functions, so each zip carries only the shared code its handler can reach.
+
+Usage (from the functions directory):
+    python package_files.py process_chunk/src/index.py
+"""
+import ast
+import os
+import sys
+
+SHARED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared')
+
+def imported_modules(path):
+    """Top-level names of every module imported anywhere in a source file"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return names
+
+def shared_modules(handler_path, shared_dir=SHARED_DIR):
+    """Paths of the shared modules reachable from handler_path, sorted"""
+    found = set()
+    pending = [handler_path]
+    while pending:
+        for name in imported_modules(pending.pop()):
+            path = os.path.join(shared_dir, f'{name}.py')
+            if path not in found and os.path.exists(path):
+                found.add(path)
+                pending.append(path)
+    return sorted(found)
+
+if __name__ == '__main__':
+    for path in shared_modules(sys.argv[1]):
+        print(os.path.relpath(path))
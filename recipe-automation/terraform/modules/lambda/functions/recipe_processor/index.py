@@ -1,9 +1,14 @@
 import json
 import os
-import boto3
-import zipfile
 import io
 from datetime import datetime
+from aws_clients import get_client
+from chunk_planner import plan_chunk_size, sample_records_per_mb
+from json_scan import iter_stream_objects
+from zip_stream import DEFAULT_CODEC, ZipStreamWriter, parse_codec
+
+# Parsed records take several times their JSON size in memory
+PARSED_CHUNK_COPIES = int(os.environ.get('PARSED_CHUNK_COPIES', 8))
 
 def process_chunk(data, chunk_number):
     """Process a chunk of the recipe data"""
@@ -19,8 +24,7 @@ def lambda_handler(event, context):
     """
     Process recipe files in chunks and create multiple ZIP files.
     """
-    s3_client = boto3.client('s3')
-    CHUNK_SIZE = 100 * 1024 * 1024  # 100MB chunks
+    s3_client = get_client('s3')
     
     try:
         # Get bucket and key from event
@@ -31,6 +35,17 @@ def lambda_handler(event, context):
         response = s3_client.head_object(Bucket=bucket, Key=key)
         file_size = response['ContentLength']
         
+        # x-amz-meta-compression on the upload picks the ZIP codec
+        compress_type, level = parse_codec(response.get('Metadata', {}).get('compression', DEFAULT_CODEC))
+        
+        # Chunks are processed one after another, so their size is bounded
+        # by this function's memory rather than spread for concurrency
+        memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 1024))
+        records_per_mb = sample_records_per_mb(s3_client, bucket, key, file_size)
+        plan = plan_chunk_size(file_size, records_per_mb, concurrency=1, memory_mb=memory_mb,
+                               copies_in_memory=PARSED_CHUNK_COPIES)
+        CHUNK_SIZE = plan['chunk_size']
+        
         # Calculate number of chunks needed
         num_chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
         
@@ -47,14 +62,15 @@ def lambda_handler(event, context):
                 Key=key,
                 Range=f'bytes={start_byte}-{end_byte}'
             )
-            chunk_data = json.loads(response['Body'].read().decode('utf-8'))
+            # Parse on raw bytes so a range ending mid-character is harmless
+            chunk_data = list(iter_stream_objects(response['Body']))
             
             # Process chunk
             processed_chunk = process_chunk(chunk_data, i)
             
             # Create ZIP for this chunk
             zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            with ZipStreamWriter(zip_buffer, compress_type, level) as zip_file:
                 zip_file.writestr(
                     f'recipe_chunk_{i}.json',
                     json.dumps(processed_chunk)
@@ -1,11 +1,15 @@
 import json
-import boto3
 import os
 from datetime import datetime
+from aws_clients import get_client
+from chunk_planner import plan_chunk_size, sample_records_per_mb
+from json_scan import iter_stream_objects
+
+# Parsed records take several times their JSON size in memory
+PARSED_CHUNK_COPIES = int(os.environ.get('PARSED_CHUNK_COPIES', 8))
 
 def lambda_handler(event, context):
-    s3_client = boto3.client('s3')
-    CHUNK_SIZE = 100 * 1024 * 1024  # 100MB chunks
+    s3_client = get_client('s3')
     
     try:
         # Get bucket and key from event
@@ -16,6 +20,14 @@ def lambda_handler(event, context):
         response = s3_client.head_object(Bucket=bucket, Key=key)
         file_size = response['ContentLength']
         
+        # Chunks are processed one after another, so their size is bounded
+        # by this function's memory rather than spread for concurrency
+        memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 1024))
+        records_per_mb = sample_records_per_mb(s3_client, bucket, key, file_size)
+        plan = plan_chunk_size(file_size, records_per_mb, concurrency=1, memory_mb=memory_mb,
+                               copies_in_memory=PARSED_CHUNK_COPIES)
+        CHUNK_SIZE = plan['chunk_size']
+        
         # Calculate number of chunks needed
         num_chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
         
@@ -33,8 +45,8 @@ def lambda_handler(event, context):
                 Range=f'bytes={start_byte}-{end_byte}'
             )
             
-            # Process chunk
-            chunk_data = process_chunk(response['Body'].read().decode('utf-8'), i)
+            # Parse on raw bytes so a range ending mid-character is harmless
+            chunk_data = list(iter_stream_objects(response['Body']))
             
             # Upload processed chunk
             chunk_key = key.replace('uploads/', f'processed/chunks/').replace(
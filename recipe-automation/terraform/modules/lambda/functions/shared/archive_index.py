@@ -0,0 +1,198 @@
+"""
+Random-access index for merged archives.
+
+For uploads that ask for one (RECORD_INDEX, or x-amz-meta-record-index),
+merge_results adds an index.json entry to *_processed.zip that maps every
+record, by ordinal and by id, to (entry, byte offset, length) within the
+entry's uncompressed data:
+
+    {
+      "version": 1,
+      "id_field": "id",
+      "entries": [{"name", "compress_type", "data_offset", "compress_size",
+                   "file_size", "access_points"}, ...],
+      "records": [[entry number, offset, length, id], ...]
+    }
+
+A record's ordinal is its position in "records".  Entries are deflated in
+independent blocks, so access_points ([uncompressed offset, offset into the
+compressed data]) say where decompression can start.  ArchiveRecordReader
+uses them to fetch one record with a ranged GET of the blocks that hold it,
+without downloading the archive.
+"""
+import io
+import json
+import struct
+import zipfile
+import zlib
+from bisect import bisect_right
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+# Bytes fetched per GET while zipfile reads the central directory
+DIRECTORY_READ_SIZE = 256 * 1024
+
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_ZIP_BZIP2 = 12
+_ZIP_LZMA = 14
+_ZIP_ZSTANDARD = 93
+
+def build_index(entries, id_field):
+    """Index of the records in entries, in entry order.
+
+    entries are zip_stream records with their data offset filled in; those
+    carrying 'spans' ([offset, length, id] per record) are indexed.
+    """
+    index_entries = []
+    records = []
+    for entry in entries:
+        if not entry.get('spans'):
+            continue
+        number = len(index_entries)
+        index_entries.append({
+            'name': entry['name'],
+            'compress_type': entry['compress_type'],
+            'data_offset': entry['data_offset'],
+            'compress_size': entry['compress_size'],
+            'file_size': entry['file_size'],
+            'access_points': entry['access_points'],
+        })
+        records.extend([number, offset, length, record_id] for offset, length, record_id in entry['spans'])
+    return {
+        'version': INDEX_VERSION,
+        'id_field': id_field,
+        'entries': index_entries,
+        'records': records,
+    }
+
+class RangedObject(io.RawIOBase):
+    """Seekable, read-only view of an S3 object; every read is a ranged GET"""
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def read_range(self, start, end):
+        """Bytes start..end inclusive"""
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        data = self.read_range(self.position, end - 1)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def _decompress(method, data):
+    """Decompress a whole entry's data"""
+    if method == _ZIP_STORED:
+        return data
+    if method == _ZIP_DEFLATED:
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+    if method == _ZIP_BZIP2:
+        import bz2
+        return bz2.decompress(data)
+    if method == _ZIP_LZMA:
+        import lzma
+        props_size, = struct.unpack('<H', data[2:4])
+        props = data[4:4 + props_size]
+        filters = [lzma._decode_filter_properties(lzma.FILTER_LZMA1, props)]
+        return lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(data[4 + props_size:])
+    if method == _ZIP_ZSTANDARD:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported compression method {method}")
+
+class ArchiveRecordReader:
+    """Fetch single records from a merged archive in S3 with ranged GETs.
+
+    The index is read once, through the archive's central directory; pass
+    index= to reuse one that is already loaded.  Ids are matched as strings.
+    """
+
+    def __init__(self, s3_client, bucket, key, index=None):
+        self.source = RangedObject(s3_client, bucket, key)
+        self.index = index if index is not None else self._load_index()
+        if self.index.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported archive index version {self.index.get('version')}")
+        self._ordinals = None
+
+    def _load_index(self):
+        reader = io.BufferedReader(self.source, DIRECTORY_READ_SIZE)
+        with zipfile.ZipFile(reader) as archive:
+            try:
+                return json.loads(archive.read(INDEX_NAME))
+            except KeyError:
+                raise ValueError(f"{self.source.key} has no {INDEX_NAME}")
+
+    def __len__(self):
+        return len(self.index['records'])
+
+    def ordinal(self, record_id):
+        """Ordinal of the first record with this id"""
+        if self._ordinals is None:
+            self._ordinals = {}
+            for ordinal, record in enumerate(self.index['records']):
+                self._ordinals.setdefault(str(record[3]), ordinal)
+        try:
+            return self._ordinals[str(record_id)]
+        except KeyError:
+            raise KeyError(f"No record with {self.index['id_field']} {record_id}")
+
+    def read(self, ordinal):
+        """Raw JSON bytes of the record at ordinal"""
+        number, offset, length, _ = self.index['records'][ordinal]
+        entry = self.index['entries'][number]
+        start = entry['data_offset']
+
+        if entry['compress_type'] == _ZIP_STORED:
+            return self.source.read_range(start + offset, start + offset + length - 1)
+
+        points = entry['access_points'] or [[0, 0]]
+        if entry['compress_type'] != _ZIP_DEFLATED or len(points) == 1:
+            data = _decompress(entry['compress_type'],
+                               self.source.read_range(start, start + entry['compress_size'] - 1))
+            return data[offset:offset + length]
+
+        # Fetch from the block holding the start of the record up to the
+        # block after the one holding its end
+        first = bisect_right([point[0] for point in points], offset) - 1
+        last = bisect_right([point[0] for point in points], offset + length - 1)
+        block_start, compressed_start = points[first]
+        compressed_end = points[last][1] if last < len(points) else entry['compress_size']
+        compressed = self.source.read_range(start + compressed_start, start + compressed_end - 1)
+        data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+        return data[offset - block_start:offset - block_start + length]
+
+    def get(self, ordinal=None, record_id=None):
+        """The record at ordinal, or with record_id, parsed"""
+        if record_id is not None:
+            ordinal = self.ordinal(record_id)
+        if ordinal is None:
+            raise ValueError("Pass an ordinal or a record_id")
+        return json.loads(self.read(ordinal))
@@ -0,0 +1,45 @@
+"""
+AWS clients shared by every invocation in a Lambda container.
+
+Handlers call get_client() inside lambda_handler instead of boto3.client().
+The first call in a container builds the client; warm invocations reuse it
+together with its connection pool, so they skip client construction and
+TLS handshakes.  boto3 clients are thread-safe, so the download and upload
+workers in s3_io share the same pool.
+"""
+import os
+import boto3
+from botocore.config import Config
+
+# Enough connections for the ranged-download and multipart-upload workers
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 32))
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', 60))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', 10))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    tcp_keepalive=True,
+    # Adaptive mode also rate-limits the client after throttling errors,
+    # which matters when many chunk functions hit the same prefix
+    retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS}
+)
+
+_clients = {}
+
+def get_client(service_name):
+    """Return the container's client for service_name, creating it once"""
+    client = _clients.get(service_name)
+    if client is None:
+        client = _clients[service_name] = boto3.client(service_name, config=CLIENT_CONFIG)
+    return client
+
+def set_client(service_name, client):
+    """Use client for service_name in this process (local_pipeline's stand-ins)"""
+    _clients[service_name] = client
+
+def reset_clients():
+    """Forget the cached clients (used by tests)"""
+    _clients.clear()
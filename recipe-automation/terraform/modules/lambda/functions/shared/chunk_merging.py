@@ -0,0 +1,457 @@
+"""
+Merging of chunk results into the final output.
+
+merge_results runs these steps for the state machine, one-step or as a
+tree of parts; split_file runs merge_chunk_results directly for uploads
+small enough to process inline, so both write the same *_processed.zip.
+"""
+import io
+import json
+import os
+from archive_index import INDEX_NAME, build_index
+from record_formats import DEFAULT_MERGE_MODE, DEFAULT_OUTPUT_FORMAT, RECORD_ID_FIELD, file_extension, validate_merge_mode
+from result_cache import output_key, record
+from s3_io import MultipartUploadWriter, concatenate_objects, iter_prefetched
+from zip_stream import DEFAULT_CODEC, ZIP_DEFLATED, ZipStreamWriter, central_directory, data_offset, parse_codec
+
+# Chunk data files downloaded ahead of the one being written; each is held
+# in memory until its turn
+PREFETCH_CHUNKS = int(os.environ.get('PREFETCH_CHUNKS', 3))
+
+# Most chunk results (or intermediate parts) one merge step takes on; more
+# than this are merged in parallel groups first, level by level
+MERGE_FAN_IN = int(os.environ.get('MERGE_FAN_IN', 32))
+
+def format_size(size_bytes):
+    """Convert bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.2f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.2f} TB"
+
+def concatenate_chunks(s3_client, bucket, output_key, chunks):
+    """Join the chunk data files into output_key without downloading them"""
+    sources = []
+    for chunk in chunks:
+        try:
+            size = chunk.get('data_size')
+            if size is None:
+                size = s3_client.head_object(Bucket=bucket, Key=chunk['data_key'])['ContentLength']
+        except Exception as e:
+            print(f"Error adding chunk {chunk['chunk_number']}: {str(e)}")
+            continue
+        sources.append((chunk['data_key'], size))
+
+    return concatenate_objects(s3_client, bucket, sources, output_key)
+
+def merge_settings(first_item):
+    """Output location and per-execution settings carried by every item"""
+    bucket = first_item.get('bucket')
+    original_key = first_item.get('original_key')
+
+    if not bucket or not original_key:
+        raise ValueError("Could not determine output location from chunk results")
+
+    output_format = first_item.get('output_format', DEFAULT_OUTPUT_FORMAT)
+    file_extension(output_format)
+    compression = first_item.get('compression') or DEFAULT_CODEC
+    parse_codec(compression)
+    return {
+        'bucket': bucket,
+        'original_key': original_key,
+        'output_format': output_format,
+        'merge_mode': validate_merge_mode(first_item.get('merge_mode', DEFAULT_MERGE_MODE), output_format),
+        'compression': compression,
+        'record_index': bool(first_item.get('record_index')),
+        'cache_key': first_item.get('cache_key')
+    }
+
+def chunk_summaries(chunks):
+    return [
+        {
+            'chunk_number': chunk['chunk_number'],
+            'objects_found': chunk.get('objects_found', 0),
+            'byte_range': chunk.get('byte_range', {})
+        }
+        for chunk in sorted(chunks, key=lambda x: x['chunk_number'])
+    ]
+
+def build_summary(s3_client, settings, chunks, start_time):
+    """Processing summary; chunks are chunk_summaries() rows"""
+    bucket = settings['bucket']
+    original_key = settings['original_key']
+
+    # Get original file size
+    original_file = s3_client.head_object(Bucket=bucket, Key=original_key)
+    original_size = original_file['ContentLength']
+
+    return {
+        'original_file': {
+            'name': original_key.split('/')[-1],
+            'size': format_size(original_size),
+            'path': f's3://{bucket}/{original_key}'
+        },
+        'processing': {
+            'start_time': start_time.isoformat(),
+            'output_format': settings['output_format'],
+            'merge_mode': settings['merge_mode'],
+            'compression': settings['compression'],
+            'total_chunks': len(chunks),
+            'total_objects': sum(chunk['objects_found'] for chunk in chunks)
+        },
+        'chunks': chunks
+    }
+
+def record_output(s3_client, settings, summary, outputs):
+    """Note the outputs in the result cache, for later uploads of the same content"""
+    processing = summary['processing']
+    record(s3_client, settings, outputs, {
+        'chunks': processing['total_chunks'],
+        'objects_found': processing['total_objects']
+    })
+
+def item_order(item):
+    """Chunk results sort by chunk number, intermediate parts by their first chunk"""
+    return item.get('first_chunk', item.get('chunk_number'))
+
+def read_json(s3_client, bucket, key):
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return json.loads(response['Body'].read())
+
+def load_map_results(s3_client, bucket, manifest_key):
+    """Chunk results a distributed Map run wrote to S3.
+
+    The run's manifest lists result files; each holds the executions of
+    some items, with the function's return value as a JSON string in
+    'Output'.
+    """
+    manifest = read_json(s3_client, bucket, manifest_key)
+    result_files = manifest['ResultFiles'].get('SUCCEEDED', [])
+
+    def download(result_file):
+        return read_json(s3_client, bucket, result_file['Key'])
+
+    results = []
+    for _, executions in iter_prefetched(download, result_files, PREFETCH_CHUNKS):
+        results.extend(json.loads(execution['Output']) for execution in executions.result())
+    return results
+
+def load_items(s3_client, reference):
+    """Items kept in S3 instead of the state payload.
+
+    A reference is a Map run's result manifest ({'bucket', 'map_results_key'})
+    or a saved list of items ({'bucket', 'key'}, optionally sliced by
+    'start' and 'stop').
+    """
+    if 'map_results_key' in reference:
+        return load_map_results(s3_client, reference['bucket'], reference['map_results_key'])
+    items = read_json(s3_client, reference['bucket'], reference['key'])
+    return items[reference.get('start', 0):reference.get('stop', len(items))]
+
+def plan_merge(s3_client, items, fan_in, by_reference=False):
+    """Split items into groups of at most fan_in, or hand them to the final merge.
+
+    With by_reference, the sorted items are saved to S3 and the plan refers
+    to slices of them, so its size does not grow with the chunk count.
+    """
+    items = sorted(items, key=item_order)
+    fan_in = max(2, fan_in)
+
+    slices = [(i, min(i + fan_in, len(items))) for i in range(0, len(items), fan_in)]
+    # Concat merges are already a server-side copy, however many chunks
+    final = len(items) <= fan_in or merge_settings(items[0])['merge_mode'] == 'concat'
+    if final:
+        slices = [(0, len(items))]
+
+    if by_reference:
+        settings = merge_settings(items[0])
+        key = settings['original_key'].replace('uploads/', 'processed/manifests/').replace(
+            '.json', '_chunk_results.json')
+        s3_client.put_object(Bucket=settings['bucket'], Key=key, Body=json.dumps(items))
+        groups = [{'bucket': settings['bucket'], 'key': key, 'start': start, 'stop': stop}
+                  for start, stop in slices]
+    else:
+        groups = [items[start:stop] for start, stop in slices]
+
+    if final:
+        return {'final': True, 'items': groups[0]}
+    print(f"Merging {len(items)} items in {len(groups)} groups of up to {fan_in}")
+    return {'final': False, 'groups': groups}
+
+def indexed(settings, chunks):
+    """Whether the upload asked for the random-access index and the chunks noted record spans for it"""
+    return settings['record_index'] and any(chunk.get('spans_key') for chunk in chunks)
+
+def write_chunk_entries(s3_client, zip_file, bucket, chunks, extension, records_name=None, index=False):
+    """Add each chunk's data file to zip_file in chunk order.
+
+    With records_name, chunks are appended byte-for-byte into that one
+    entry; otherwise each chunk gets its own entry.  Returns the chunks
+    that were added, and with index the record spans of each entry by
+    name.
+    """
+    records_entry = None
+    spans = {}
+    if records_name:
+        records_entry = zip_file.open(records_name)
+        spans[records_name] = []
+
+    def download(chunk):
+        data_response = s3_client.get_object(
+            Bucket=bucket,
+            Key=chunk['data_key']
+        )
+        chunk_spans = []
+        if index and chunk.get('spans_key'):
+            spans_response = s3_client.get_object(Bucket=bucket, Key=chunk['spans_key'])
+            chunk_spans = json.loads(spans_response['Body'].read())
+        return data_response['Body'].read(), chunk_spans
+
+    # Add each chunk's data; later chunks download while this one
+    # is compressed, but entries are still written in order
+    added = []
+    chunks = sorted(chunks, key=lambda x: x['chunk_number'])
+    for chunk, chunk_download in iter_prefetched(download, chunks, PREFETCH_CHUNKS):
+        try:
+            # Get chunk data from S3
+            chunk_data, chunk_spans = chunk_download.result()
+        except Exception as e:
+            print(f"Error adding chunk {chunk['chunk_number']}: {str(e)}")
+            continue
+        added.append(chunk)
+
+        if records_entry is not None:
+            # Spans are relative to the chunk file, which starts here
+            base = records_entry.file_size
+            spans[records_name].extend([base + offset, length, record_id] for offset, length, record_id in chunk_spans)
+            records_entry.write(chunk_data)
+            continue
+
+        # Add to ZIP with chunk number in filename
+        filename = f'chunk_{chunk["chunk_number"]:03d}{extension}'
+        with zip_file.open(filename) as entry:
+            entry.write(chunk_data)
+        spans[filename] = chunk_spans
+
+    if records_entry is not None:
+        records_entry.close()
+    return added, spans
+
+def with_spans(records, spans):
+    """Attach each entry's record spans to its zip_stream record"""
+    for record in records:
+        if spans.get(record['name']):
+            record['spans'] = spans[record['name']]
+    return records
+
+def index_entry(records):
+    """index.json for entries laid out as in records"""
+    for record in records:
+        record['data_offset'] = data_offset(record)
+    return json.dumps(build_index(records, RECORD_ID_FIELD))
+
+def load_manifests(s3_client, bucket, parts):
+    """Yield (part, manifest) in order, downloading a few manifests ahead"""
+    def download(part):
+        response = s3_client.get_object(Bucket=bucket, Key=part['manifest_key'])
+        return json.loads(response['Body'].read())
+
+    for part, manifest_download in iter_prefetched(download, parts, PREFETCH_CHUNKS):
+        yield part, manifest_download.result()
+
+def join_manifests(s3_client, bucket, parts):
+    """Entry records and chunk rows of parts laid end to end"""
+    entries = []
+    chunks = []
+    offset = 0
+    for part, manifest in load_manifests(s3_client, bucket, parts):
+        for record in manifest['entries']:
+            record['header_offset'] += offset
+            entries.append(record)
+        chunks.extend(manifest['chunks'])
+        offset += part['part_size']
+    return entries, chunks, offset
+
+def delete_parts(s3_client, bucket, parts):
+    """Remove intermediate parts once they have been merged into the next level"""
+    keys = [key for part in parts for key in (part['part_key'], part['manifest_key'])]
+    for i in range(0, len(keys), 1000):
+        try:
+            s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
+            )
+        except Exception as e:
+            print(f"Error deleting intermediate parts: {str(e)}")
+
+def merge_group(s3_client, items):
+    """Merge one group of chunk results or parts into a larger part.
+
+    A part is a run of ZIP entries with no central directory, plus a
+    manifest of the entries' records and the chunks they hold.  Chunk
+    results are compressed into a part; parts are joined by S3 with
+    UploadPartCopy and their manifests combined.
+    """
+    items = sorted(items, key=item_order)
+    settings = merge_settings(items[0])
+    bucket = settings['bucket']
+    extension = file_extension(settings['output_format'])
+    first = item_order(items[0])
+    last = items[-1].get('last_chunk', items[-1].get('chunk_number'))
+    level = max(item.get('level', 0) for item in items) + 1
+    part_key = settings['original_key'].replace('uploads/', 'processed/parts/').replace(
+        '.json', f'_L{level}_{first:05d}-{last:05d}.zip')
+    manifest_key = part_key.replace('.zip', '.manifest.json')
+
+    if 'part_key' in items[0]:
+        print(f"Joining {len(items)} parts into {bucket}/{part_key}")
+        entries, chunks, _ = join_manifests(s3_client, bucket, items)
+        part_size = concatenate_objects(
+            s3_client, bucket, [(part['part_key'], part['part_size']) for part in items], part_key
+        )
+    else:
+        print(f"Compressing {len(items)} chunks into {bucket}/{part_key}")
+        compress_type, level_setting = parse_codec(settings['compression'])
+        # A JSON Lines entry cannot span independently compressed parts,
+        # so each group's records get an entry named after its first chunk
+        records_name = None
+        if settings['output_format'] == 'jsonl':
+            records_name = f'records_{first:03d}{extension}'
+        with MultipartUploadWriter(s3_client, bucket, part_key) as writer:
+            index = indexed(settings, items)
+            zip_file = ZipStreamWriter(writer, compress_type, level_setting, independent_blocks=index)
+            added, spans = write_chunk_entries(s3_client, zip_file, bucket, items, extension, records_name, index)
+            entries = with_spans(zip_file.close_part(), spans)
+        part_size = writer.bytes_written
+        chunks = chunk_summaries(added)
+
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=manifest_key,
+        Body=json.dumps({'entries': entries, 'chunks': chunks})
+    )
+    if 'part_key' in items[0]:
+        delete_parts(s3_client, bucket, items)
+
+    return dict(
+        settings,
+        part_key=part_key,
+        manifest_key=manifest_key,
+        part_size=part_size,
+        first_chunk=first,
+        last_chunk=last,
+        level=level
+    )
+
+def stitch_parts(s3_client, parts, start_time):
+    """Join the top-level parts into the final archive.
+
+    The parts are copied by S3; only the summary and index entries and
+    the central directory are written from memory, after the parts.  The
+    directory lists them in the same order as a one-step merge does.
+    """
+    parts = sorted(parts, key=item_order)
+    settings = merge_settings(parts[0])
+    bucket = settings['bucket']
+    compress_type, level = parse_codec(settings['compression'])
+    zip_key = output_key(settings['original_key'], '_processed.zip')
+    print(f"Stitching {len(parts)} parts into {bucket}/{zip_key}")
+
+    entries, chunks, parts_size = join_manifests(s3_client, bucket, parts)
+    summary = build_summary(s3_client, settings, chunks, start_time)
+
+    tail = io.BytesIO()
+    summary_zip = ZipStreamWriter(tail, compress_type, level)
+    summary_zip.writestr('summary.json', json.dumps(summary, indent=2))
+    if any(entry.get('spans') for entry in entries):
+        summary_zip.writestr(INDEX_NAME, index_entry(entries), compress_type=ZIP_DEFLATED, level=6)
+    tail_entries = summary_zip.close_part()
+    for record in tail_entries:
+        record['header_offset'] += parts_size
+    tail.write(central_directory(tail_entries[:1] + entries + tail_entries[1:], parts_size + tail.tell()))
+
+    output_size = concatenate_objects(
+        s3_client, bucket, [(part['part_key'], part['part_size']) for part in parts], zip_key,
+        tail=tail.getvalue(), ContentType='application/zip'
+    )
+    delete_parts(s3_client, bucket, parts)
+    print(f"Saved final ZIP ({format_size(output_size)})")
+    record_output(s3_client, settings, summary, [('_processed.zip', 'application/zip')])
+
+    return {
+        'statusCode': 200,
+        'message': 'Processing complete',
+        'output': f's3://{bucket}/{zip_key}'
+    }
+
+def merge_chunk_results(s3_client, chunks, start_time):
+    """Merge chunk results in one step: a ZIP archive, or a concatenated file"""
+    # Get first chunk for bucket/key info
+    settings = merge_settings(chunks[0])
+    bucket = settings['bucket']
+    original_key = settings['original_key']
+    output_format = settings['output_format']
+    extension = file_extension(output_format)
+    compress_type, level = parse_codec(settings['compression'])
+
+    # Processing summary
+    summary = build_summary(s3_client, settings, chunk_summaries(chunks), start_time)
+
+    if settings['merge_mode'] == 'concat':
+        # One JSON Lines file assembled from the chunk files by S3
+        # itself, with the summary written next to it
+        records_suffix = f'_processed{extension}'
+        summary_suffix = '_processed_summary.json'
+        records_key = output_key(original_key, records_suffix)
+        print(f"Concatenating chunk data into {bucket}/{records_key}")
+        chunks = sorted(chunks, key=lambda x: x['chunk_number'])
+        output_size = concatenate_chunks(s3_client, bucket, records_key, chunks)
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=output_key(original_key, summary_suffix),
+            Body=json.dumps(summary, indent=2)
+        )
+        print(f"Saved concatenated output ({format_size(output_size)})")
+        record_output(s3_client, settings, summary, [(records_suffix, None), (summary_suffix, None)])
+
+        return {
+            'statusCode': 200,
+            'message': 'Processing complete',
+            'output': f's3://{bucket}/{records_key}'
+        }
+
+    zip_key = output_key(original_key, '_processed.zip')
+    print(f"Streaming final ZIP to {bucket}/{zip_key}")
+
+    # The archive is written straight into a multipart upload.  Deflate
+    # entries are compressed in blocks across all vCPUs; each entry's
+    # sizes go in a ZIP64 data descriptor after its data, since the
+    # writer cannot seek.  Indexed archives compress the blocks
+    # independently so a reader can start at any of them.
+    index = indexed(settings, chunks)
+    with MultipartUploadWriter(s3_client, bucket, zip_key, ContentType='application/zip') as writer, \
+            ZipStreamWriter(writer, compress_type, level, independent_blocks=index) as zip_file:
+        zip_file.writestr('summary.json', json.dumps(summary, indent=2))
+
+        # JSON Lines chunks are appended byte-for-byte into one entry,
+        # JSON arrays and columnar files each get their own entry
+        records_name = None
+        if output_format == 'jsonl':
+            records_name = f'records{extension}'
+        _, spans = write_chunk_entries(s3_client, zip_file, bucket, chunks, extension, records_name, index)
+
+        # Record spans become index.json, written last so it can point
+        # at the entries before it
+        if any(spans.values()):
+            records = with_spans([entry.record() for entry in zip_file.entries], spans)
+            zip_file.writestr(INDEX_NAME, index_entry(records), compress_type=ZIP_DEFLATED, level=6)
+
+    print(f"Saved final ZIP ({format_size(writer.bytes_written)})")
+    record_output(s3_client, settings, summary, [('_processed.zip', 'application/zip')])
+
+    return {
+        'statusCode': 200,
+        'message': 'Processing complete',
+        'output': f's3://{bucket}/{zip_key}'
+    }
@@ -0,0 +1,95 @@
+"""
+Chunk sizing for split_file and recipe_processor.
+
+A fixed chunk size leaves most of the Map idle for small files and turns
+huge files into thousands of short invocations.  plan_chunk_size picks the
+size from:
+
+- the file size and how many chunks run at once, so every concurrent slot
+  gets work and the chunks come in even waves;
+- the memory of the function holding a chunk's data, which caps the size;
+- how long a chunk takes at the throughput expected for the record density
+  sampled from the file, which caps the size well inside the timeout;
+- a floor, so start-up costs do not dominate an invocation.
+
+Throughput is modelled as a fixed parse cost per MB plus a cost per record,
+both measured on one vCPU with iter_stream_objects and write_records, and
+scaled down for functions with less memory (Lambda gives a full vCPU at
+1769MB).
+"""
+import math
+import os
+from json_scan import decode_utf8, iter_json_objects
+
+MB = 1024 * 1024
+
+MAP_MAX_CONCURRENCY = int(os.environ.get('MAP_MAX_CONCURRENCY', 100))
+CHUNK_MEMORY_MB = int(os.environ.get('CHUNK_MEMORY_MB', 1024))
+CHUNK_TIMEOUT_SECONDS = int(os.environ.get('CHUNK_TIMEOUT_SECONDS', 300))
+MIN_CHUNK_SIZE = int(os.environ.get('MIN_CHUNK_BYTES', 8 * MB))
+MAX_CHUNK_SIZE = int(os.environ.get('MAX_CHUNK_BYTES', 1024 * MB))
+SAMPLE_SIZE = int(os.environ.get('PLANNER_SAMPLE_BYTES', MB))
+
+# Parse throughput on one vCPU
+SCAN_MB_PER_SECOND = float(os.environ.get('SCAN_MB_PER_SECOND', 60))
+RECORDS_PER_SECOND = float(os.environ.get('RECORDS_PER_SECOND', 45000))
+FULL_VCPU_MEMORY_MB = 1769
+
+# Share of the timeout a chunk is planned to take, and of the memory that
+# the copies of its data may fill
+TIMEOUT_SHARE = 0.5
+MEMORY_SHARE = 0.5
+
+def sample_records_per_mb(s3_client, bucket, key, file_size, sample_size=SAMPLE_SIZE):
+    """Records per MB in a window from the middle of the file.
+
+    The window may start and end inside a record; the objects it holds in
+    full are counted, which is close enough to size chunks by.
+    """
+    size = min(sample_size, file_size)
+    if size <= 0:
+        return 0.0
+    start = (file_size - size) // 2
+    response = s3_client.get_object(
+        Bucket=bucket,
+        Key=key,
+        Range=f'bytes={start}-{start + size - 1}'
+    )
+    window = response['Body'].read()
+    records = sum(1 for _ in iter_json_objects(decode_utf8(window, 'replace')))
+    return records * MB / max(len(window), 1)
+
+def seconds_per_mb(records_per_mb, memory_mb):
+    """Expected time to parse and write one MB of input"""
+    cpu_share = min(1.0, memory_mb / FULL_VCPU_MEMORY_MB)
+    return (1 / SCAN_MB_PER_SECOND + records_per_mb / RECORDS_PER_SECOND) / cpu_share
+
+def plan_chunk_size(file_size, records_per_mb, concurrency=MAP_MAX_CONCURRENCY,
+                    memory_mb=CHUNK_MEMORY_MB, timeout_seconds=CHUNK_TIMEOUT_SECONDS,
+                    copies_in_memory=1):
+    """Pick a chunk size for file_size; returns a dict describing the plan.
+
+    copies_in_memory is how many chunks' worth of data the function holding
+    them keeps at once (parsed objects count several times over).
+    """
+    memory_limit = memory_mb * MB * MEMORY_SHARE / max(1, copies_in_memory)
+    time_limit = timeout_seconds * TIMEOUT_SHARE / seconds_per_mb(records_per_mb, memory_mb) * MB
+    limit = max(MIN_CHUNK_SIZE, min(memory_limit, time_limit, MAX_CHUNK_SIZE))
+
+    concurrency = max(1, concurrency)
+    count = max(1, math.ceil(file_size / limit))
+    if count < concurrency:
+        # Give every slot a chunk, unless that takes chunks below the floor
+        count = max(count, min(concurrency, file_size // MIN_CHUNK_SIZE))
+    else:
+        # Whole waves, so the last one is not a few stragglers
+        count = math.ceil(count / concurrency) * concurrency
+    chunk_size = max(1, math.ceil(file_size / count))
+
+    return {
+        'chunk_size': chunk_size,
+        'chunk_count': math.ceil(file_size / chunk_size) if file_size else 0,
+        'records_per_mb': round(records_per_mb, 1),
+        'memory_limit': int(memory_limit),
+        'time_limit': int(time_limit),
+    }
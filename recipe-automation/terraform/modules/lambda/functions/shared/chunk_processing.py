@@ -0,0 +1,86 @@
+"""
+Parsing of one chunk of an upload into a chunk data file.
+
+process_chunk runs this for each item of the state machine's Map;
+split_file runs it directly for uploads small enough to process inline.
+"""
+import json
+from json_scan import iter_stream_objects
+from record_formats import DEFAULT_MERGE_MODE, DEFAULT_OUTPUT_FORMAT, file_extension, write_records
+from result_cache import CHUNK_CACHE_ENABLED, chunk_key_for, lookup_chunk, record_chunk
+from s3_io import MultipartUploadWriter, ParallelRangeReader
+
+def parse_chunk(s3_client, chunk_info, output_format, merge_mode):
+    """Download and parse chunk_info's byte range into its data file; returns where it went"""
+    bucket = chunk_info['bucket']
+    key = chunk_info['key']
+    chunk_number = chunk_info['chunk_number']
+    data_key = key.replace('uploads/', 'processed/data/').replace(
+        '.json', f'_chunk_{chunk_number}_data{file_extension(output_format)}'
+    )
+
+    # Download the chunk as concurrent sub-ranges, parse records as the
+    # parts arrive in order and stream them straight into the data file
+    spans = [] if chunk_info.get('record_index') else None
+    with ParallelRangeReader(s3_client, bucket, key, chunk_info['start_byte'], chunk_info['end_byte']) as body, \
+            MultipartUploadWriter(s3_client, bucket, data_key) as writer:
+        objects_found = write_records(writer, iter_stream_objects(body), output_format, spans)
+    print(f"Found {objects_found} JSON objects in chunk")
+
+    # Where each record sits in the data file, for the merged
+    # archive's random-access index
+    spans_key = None
+    if spans is not None:
+        spans_key = data_key.rsplit('.', 1)[0] + '_spans.json'
+        s3_client.put_object(Bucket=bucket, Key=spans_key, Body=json.dumps(spans))
+
+    return {
+        'data_key': data_key,
+        'data_size': writer.bytes_written,
+        'spans_key': spans_key,
+        'objects_found': objects_found
+    }
+
+def process_chunk(s3_client, chunk_info):
+    """Parse chunk_info's byte range and write its records; returns the chunk result"""
+    bucket = chunk_info['bucket']
+    key = chunk_info['key']
+    chunk_number = chunk_info['chunk_number']
+    start_byte = chunk_info['start_byte']
+    end_byte = chunk_info['end_byte']
+
+    output_format = chunk_info.get('output_format', DEFAULT_OUTPUT_FORMAT)
+    merge_mode = chunk_info.get('merge_mode', DEFAULT_MERGE_MODE)
+
+    # A retry or rerun for the same range of the same upload version
+    # reuses the data file the earlier run wrote
+    memo_key = chunk_key_for(chunk_info) if CHUNK_CACHE_ENABLED else None
+    parsed = lookup_chunk(s3_client, bucket, memo_key) if memo_key else None
+    if parsed:
+        print(f"Reusing chunk {chunk_number} from {bucket}/{parsed['data_key']}")
+    else:
+        print(f"Processing chunk {chunk_number} from {bucket}/{key} as {output_format}")
+        parsed = parse_chunk(s3_client, chunk_info, output_format, merge_mode)
+        if memo_key:
+            record_chunk(s3_client, bucket, memo_key, parsed)
+
+    # Return only metadata (no large data)
+    return {
+        'statusCode': 200,
+        'chunk_number': chunk_number,
+        'bucket': bucket,
+        'data_key': parsed['data_key'],
+        'data_size': parsed['data_size'],
+        'spans_key': parsed['spans_key'],
+        'output_format': output_format,
+        'merge_mode': merge_mode,
+        'compression': chunk_info.get('compression'),
+        'record_index': bool(chunk_info.get('record_index')),
+        'cache_key': chunk_info.get('cache_key'),
+        'original_key': key,
+        'objects_found': parsed['objects_found'],
+        'byte_range': {
+            'start': start_byte,
+            'end': end_byte
+        }
+    }
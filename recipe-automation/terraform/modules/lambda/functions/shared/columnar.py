@@ -0,0 +1,444 @@
+"""
+Columnar binary encoding for parsed recipe records.
+
+Records are split into one column per key.  Numbers go into typed arrays,
+strings into a dictionary shared by the whole file, and lists of objects
+(such as ingredients and instructions) into child tables with one list
+length per parent row.  A value that does not match the kind of its column
+is kept as JSON text in the dictionary, so any record round-trips.
+
+File layout:
+    MAGIC
+    header length (4 bytes, little-endian)
+    header (JSON: tables, columns and where their blobs are)
+    blobs (little-endian typed arrays and UTF-8 string data, optionally
+           zlib-compressed)
+
+Integer arrays, including dictionary ids and list lengths, are stored with
+the narrowest width that holds their values.  Version 1 files, which have
+no compression field, can still be read.
+
+What it is for: reading one column (all ingredient amounts, say) without
+building any records, which is orders of magnitude faster than loading the
+JSON.  It is not a much smaller or faster format for whole records: recipe
+records are mostly free text, which takes as many bytes here as in JSON,
+and a full load rebuilds the same dicts json.loads does.  On generator
+output a full load is about twice as fast as json.loads at about the same
+size; compressing the strings makes files about 4x smaller than JSON but
+full loads about 2.5x slower, so it is off unless asked for (the output ZIP
+compresses chunk files anyway).  See benchmarks/bench_columnar.py.
+"""
+import io
+import json
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+MAGIC = b'RCOL1\n'
+VERSION = 2
+_READABLE_VERSIONS = (1, 2)
+
+# zlib level for compressed string data; text compresses well even at the
+# fastest level
+STRING_COMPRESSION_LEVEL = 1
+
+# How each column kind stores its values
+_TYPECODES = {
+    'int': 'q',
+    'float': 'd',
+    'bool': 'b',
+    'str': 'I',
+    'json': 'I',
+    'table': 'I',
+}
+
+# Per-row states, only stored for columns that are not present in every row
+_MISSING = 0
+_PRESENT = 1
+_NULL = 2
+_OVERFLOW = 3
+
+# Placeholder for a key that a row does not have
+_MISSING_VALUE = object()
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+def _kind_of(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int' if _INT64_MIN <= value <= _INT64_MAX else 'json'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+        return 'table'
+    return 'json'
+
+# Integer typecodes from narrowest to widest
+_SIGNED = ('b', 'h', 'i', 'q')
+_UNSIGNED = ('B', 'H', 'I', 'Q')
+
+def _narrow(values):
+    """Copy of an integer array in the smallest typecode that fits it"""
+    if not values:
+        return values
+    low, high = min(values), max(values)
+    for typecode in (_UNSIGNED if low >= 0 else _SIGNED):
+        bits = array(typecode).itemsize * 8
+        if typecode in _UNSIGNED:
+            fits = high < 2 ** bits
+        else:
+            fits = -2 ** (bits - 1) <= low and high < 2 ** (bits - 1)
+        if fits:
+            return values if typecode == values.typecode else array(typecode, values)
+    return values
+
+def _to_le_bytes(values):
+    if sys.byteorder == 'big' and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_le_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big' and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+class _StringDictionary:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def id(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+class _Column:
+    def __init__(self, strings, rows_before):
+        self.strings = strings
+        self.rows = rows_before
+        self.kind = None
+        self.values = None
+        self.table = None
+        self.overflow = array('I')
+        self.presence = array('B', [_MISSING]) * rows_before if rows_before else None
+
+    def _mark(self, state):
+        if self.presence is None and state != _PRESENT:
+            self.presence = array('B', [_PRESENT]) * self.rows
+        if self.presence is not None:
+            self.presence.append(state)
+        self.rows += 1
+
+    def add_missing(self):
+        self._mark(_MISSING)
+
+    def add(self, value):
+        if value is None:
+            self._mark(_NULL)
+            return
+
+        kind = _kind_of(value)
+        if self.kind is None:
+            self.kind = kind
+            self.values = array(_TYPECODES[kind])
+            if kind == 'table':
+                self.table = _Table(self.strings)
+
+        if kind != self.kind:
+            self.overflow.append(self.strings.id(json.dumps(value)))
+            self._mark(_OVERFLOW)
+            return
+
+        if kind == 'table':
+            self.values.append(len(value))
+            for item in value:
+                self.table.add(item)
+        elif kind == 'str':
+            self.values.append(self.strings.id(value))
+        elif kind == 'json':
+            self.values.append(self.strings.id(json.dumps(value)))
+        else:
+            self.values.append(value)
+        self._mark(_PRESENT)
+
+class _Table:
+    def __init__(self, strings):
+        self.strings = strings
+        self.rows = 0
+        self.columns = {}
+
+    def add(self, record):
+        for name, value in record.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = _Column(self.strings, self.rows)
+            column.add(value)
+        self.rows += 1
+        for column in self.columns.values():
+            if column.rows < self.rows:
+                column.add_missing()
+
+class ColumnarWriter:
+    """Accumulates records column by column and serializes them at the end.
+
+    With compress, the string data is zlib-compressed: much smaller files
+    for slower full loads.
+    """
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.strings = _StringDictionary()
+        self.table = _Table(self.strings)
+
+    def add(self, record):
+        self.table.add(record)
+
+    def __len__(self):
+        return self.table.rows
+
+    def write_to(self, writer):
+        """Write the encoded records to a file-like writer one blob at a time; returns the byte count"""
+        blobs = []
+        offset = [0]
+
+        def blob(data, typecode=None):
+            # Arrays are only turned into bytes as they are written, and
+            # lists of parts are written part by part
+            blobs.append(data)
+            if isinstance(data, array):
+                length = len(data) * data.itemsize
+            elif isinstance(data, list):
+                length = sum(map(len, data))
+            else:
+                length = len(data)
+            ref = [offset[0], length]
+            offset[0] += length
+            if typecode is not None:
+                ref.append(typecode)
+            return ref
+
+        def array_blob(values):
+            if values.typecode != 'd':
+                values = _narrow(values)
+            return blob(values, values.typecode)
+
+        def table_meta(table):
+            columns = []
+            for name, column in table.columns.items():
+                meta = {'name': name, 'kind': column.kind}
+                if column.presence is not None:
+                    meta['presence'] = blob(column.presence)
+                if column.values is not None:
+                    meta['values'] = array_blob(column.values)
+                if column.overflow:
+                    meta['overflow'] = array_blob(column.overflow)
+                if column.table is not None:
+                    meta['table'] = table_meta(column.table)
+                columns.append(meta)
+            return {'rows': table.rows, 'columns': columns}
+
+        root = table_meta(self.table)
+
+        # The header needs the string data's length, so it is encoded (and
+        # compressed) up front, a string at a time
+        encoded = [string.encode('utf-8') for string in self.strings.strings]
+        lengths = array('Q', map(len, encoded))
+        strings = {'count': len(encoded), 'lengths': array_blob(lengths)}
+        if self.compress:
+            compressor = zlib.compressobj(STRING_COMPRESSION_LEVEL)
+            encoded = [compressor.compress(part) for part in encoded] + [compressor.flush()]
+            strings['compression'] = 'zlib'
+        strings['data'] = blob(encoded)
+
+        header = {
+            'version': VERSION,
+            'strings': strings,
+            'table': root,
+        }
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        writer.write(MAGIC)
+        writer.write(struct.pack('<I', len(header_bytes)))
+        writer.write(header_bytes)
+        for data in blobs:
+            if isinstance(data, array):
+                writer.write(_to_le_bytes(data))
+            elif isinstance(data, list):
+                for part in data:
+                    if part:
+                        writer.write(part)
+            else:
+                writer.write(data)
+        return len(MAGIC) + 4 + len(header_bytes) + offset[0]
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        self.write_to(buffer)
+        return buffer.getvalue()
+
+def encode_records(records, compress=False):
+    """Encode an iterable of records into columnar bytes"""
+    writer = ColumnarWriter(compress)
+    for record in records:
+        writer.add(record)
+    return writer.to_bytes()
+
+class _Strings:
+    """The string dictionary, decoding each string the first time it is used"""
+
+    def __init__(self, data, lengths):
+        self.data = data
+        self.offsets = array('Q', [0])
+        self.offsets.extend(accumulate(lengths))
+        self.decoded = [None] * len(lengths)
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __getitem__(self, index):
+        string = self.decoded[index]
+        if string is None:
+            string = self.decoded[index] = str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+        return string
+
+class ColumnarFile:
+    """Read access to a columnar file.
+
+    Iterating yields the records as dicts.  column() returns the values of a
+    single (possibly nested) column without building any records, e.g.
+    column('ingredients.amount') is one array of every ingredient amount.
+    """
+
+    def __init__(self, data):
+        if not data.startswith(MAGIC):
+            raise ValueError("Not a columnar recipe file")
+        start = len(MAGIC)
+        (header_length,) = struct.unpack_from('<I', data, start)
+        start += 4
+        self.header = json.loads(bytes(data[start:start + header_length]).decode('utf-8'))
+        if self.header['version'] not in _READABLE_VERSIONS:
+            raise ValueError(f"Unsupported columnar version {self.header['version']}")
+        self._blobs = memoryview(data)[start + header_length:]
+        self._strings = None
+
+    def __len__(self):
+        return self.header['table']['rows']
+
+    def _blob(self, ref):
+        offset, length = ref[:2]
+        return self._blobs[offset:offset + length]
+
+    def _array(self, ref):
+        return _from_le_bytes(ref[2], self._blob(ref))
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            meta = self.header['strings']
+            data = self._blob(meta['data'])
+            if meta.get('compression') == 'zlib':
+                data = zlib.decompress(data)
+            self._strings = _Strings(data, self._array(meta['lengths']))
+        return self._strings
+
+    def _find_column(self, path):
+        table = self.header['table']
+        names = path.split('.')
+        for depth, name in enumerate(names):
+            meta = next((c for c in table['columns'] if c['name'] == name), None)
+            if meta is None:
+                raise KeyError(path)
+            if depth == len(names) - 1:
+                return meta
+            if meta['kind'] != 'table':
+                raise KeyError(path)
+            table = meta['table']
+
+    def column(self, path):
+        """Values of the column at path, for the rows where it has its main kind"""
+        meta = self._find_column(path)
+        if 'values' not in meta:
+            return []
+        values = self._array(meta['values'])
+        if meta['kind'] == 'str':
+            strings = self.strings
+            return [strings[i] for i in values]
+        if meta['kind'] == 'json':
+            strings = self.strings
+            return [json.loads(strings[i]) for i in values]
+        if meta['kind'] == 'bool':
+            return [bool(v) for v in values]
+        return values
+
+    def _decode_column(self, meta):
+        kind = meta['kind']
+        values = []
+        if 'values' in meta:
+            values = self._array(meta['values'])
+        if kind == 'table':
+            children = self._decode_table(meta['table'])
+            lists = []
+            pos = 0
+            for length in values:
+                lists.append(children[pos:pos + length])
+                pos += length
+            values = lists
+        elif kind == 'str':
+            values = list(map(self.strings.__getitem__, values))
+        elif kind == 'json':
+            strings = self.strings
+            values = [json.loads(strings[i]) for i in values]
+        elif kind == 'bool':
+            values = [bool(v) for v in values]
+        elif kind is not None:
+            values = values.tolist()
+
+        if 'presence' not in meta:
+            return values
+
+        overflow = iter(())
+        if 'overflow' in meta:
+            strings = self.strings
+            overflow = (json.loads(strings[i]) for i in self._array(meta['overflow']))
+        present = iter(values)
+        column = []
+        for state in self._blob(meta['presence']):
+            if state == _PRESENT:
+                column.append(next(present))
+            elif state == _NULL:
+                column.append(None)
+            elif state == _OVERFLOW:
+                column.append(next(overflow))
+            else:
+                column.append(_MISSING_VALUE)
+        return column
+
+    def _decode_table(self, table):
+        if not table['columns']:
+            return [{} for _ in range(table['rows'])]
+        names = [meta['name'] for meta in table['columns']]
+        rows = zip(*[self._decode_column(meta) for meta in table['columns']])
+        if not any('presence' in meta for meta in table['columns']):
+            # Every row has every key, so each dict is built in one call
+            return [dict(zip(names, row)) for row in rows]
+        return [
+            {name: value for name, value in zip(names, row) if value is not _MISSING_VALUE}
+            for row in rows
+        ]
+
+    def records(self):
+        """All records as a list of dicts"""
+        return self._decode_table(self.header['table'])
+
+    def __iter__(self):
+        return iter(self.records())
@@ -0,0 +1,288 @@
+"""
+JSON record scanning shared by the Lambda functions.
+
+build.sh copies this file next to each function's index.py, so handlers
+import it as a top-level module.
+"""
+import codecs
+import json
+import os
+import re
+
+# Characters that change nesting or string state
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_STRUCTURAL_BYTES = re.compile(rb'[{}\[\]"]')
+# Characters that end a string, escape the next one, or may start an object
+_STRING_SPECIAL = re.compile(r'["\\{]')
+# What invalid UTF-8 bytes decode to with errors='surrogateescape'
+_ESCAPED_BYTES = re.compile('[\udc80-\udcff]')
+_DECODER = json.JSONDecoder()
+
+# Bytes requested from a stream per read
+READ_BUFFER_SIZE = int(os.environ.get('READ_BUFFER_BYTES', 1024 * 1024))
+
+def decode_utf8(data, errors='strict'):
+    """Decode UTF-8, leaving out a code point cut off at the end of data"""
+    return codecs.utf_8_decode(data, errors, False)[0]
+
+def _recovery_points(text, start, end):
+    """Where a failed decode's region text[start:end] may still hold objects.
+
+    The region is the valid JSON read before the error, so string state
+    can be trusted in it.  Returns (position, in_string) pairs in order:
+    the start of each outermost object that closes in the region, and each
+    '{' inside a string of it, which can begin an object when read outside
+    the string (a truncated string closes on the next record's first
+    quote).  Arrays are only walked through.
+
+    A nested object is handed to the decoder first, which skips a complete
+    one in a single step.  One still open at the error fails only there, so
+    the text re-read by such failed attempts is capped at the region's
+    length, after which the region is walked character by character.
+    """
+    # (opener, position, candidates directly inside) for each open container
+    open_containers = []
+    pos = start
+    retry_budget = end - start
+
+    while True:
+        match = _STRUCTURAL.search(text, pos, end)
+        if match is None:
+            break
+        char = match.group()
+        pos = match.end()
+
+        if char == '"':
+            while True:
+                special = _STRING_SPECIAL.search(text, pos, end)
+                if special is None:
+                    pos = end
+                    break
+                pos = special.end()
+                if special.group() == '"':
+                    break
+                if special.group() == '\\':
+                    pos += 1
+                elif open_containers:
+                    open_containers[-1][2].append((special.start(), True))
+        elif char == '{' and open_containers and retry_budget > 0:
+            try:
+                _, pos = _DECODER.raw_decode(text, match.start())
+            except json.JSONDecodeError:
+                retry_budget -= end - match.start()
+                open_containers.append((char, match.start(), []))
+            else:
+                open_containers[-1][2].append((match.start(), False))
+        elif char in '{[':
+            open_containers.append((char, match.start(), []))
+        elif open_containers:
+            opener, begin, candidates = open_containers.pop()
+            if not open_containers:
+                continue
+            if opener == '{':
+                open_containers[-1][2].append((begin, False))
+            else:
+                open_containers[-1][2].extend(candidates)
+
+    return [candidate for _, _, candidates in open_containers for candidate in candidates]
+
+def iter_json_objects(text):
+    """Yield the outermost complete JSON objects in text, in order.
+
+    Every '{' not inside a yielded object is tried as the start of one, as
+    the original raw_decode loop did, but without decoding the same text
+    over and over.  Each start is decoded in place by index; when that fails
+    (the object is truncated or malformed), the objects that closed before
+    the error are taken from the region it read, and scanning resumes at
+    the error, since every object still open there fails at the same point.
+    """
+    pos = 0
+
+    while True:
+        start = text.find('{', pos)
+        if start == -1:
+            return
+        try:
+            obj, pos = _DECODER.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            pos = max(e.pos, start + 1)
+            for begin, in_string in _recovery_points(text, start, e.pos):
+                try:
+                    obj, end = _DECODER.raw_decode(text, begin)
+                except json.JSONDecodeError:
+                    continue
+                yield obj
+                if in_string:
+                    # Read outside its string, this object may run past
+                    # the error; carry on from its end
+                    pos = end
+                    break
+        else:
+            yield obj
+
+def extract_json_objects(text):
+    """Extract valid JSON objects from text"""
+    return list(iter_json_objects(text))
+
+def _truncated(error, text):
+    """Whether a decode error only shows that text stops before the value does"""
+    # A cut string is reported at its opening quote; any other cut token
+    # (at most a \\uXXXX escape or 'false') ends within a few characters
+    return error.msg.startswith('Unterminated string') or error.pos > len(text) - 6
+
+def _recover(data, open_record=False):
+    """Salvage a record, held as UTF-8 bytes, that does not decode.
+
+    Returns the objects iter_json_objects would keep from it and the byte
+    offset to carry on scanning from: the decode error, or a '{' in one of
+    its strings that may begin an object running past data.  With
+    open_record, data is a record that has not closed yet, and (None, None)
+    means it is valid as far as data goes.  Objects that are not valid
+    UTF-8 are left out, like a whole record with invalid bytes in a string.
+    """
+    # Invalid bytes become lone surrogates, so offsets map back exactly
+    text = codecs.utf_8_decode(bytes(data), 'surrogateescape', False)[0]
+    try:
+        obj, resume = _DECODER.raw_decode(text, 0)
+    except json.JSONDecodeError as e:
+        error = e
+    else:
+        # Well formed, but with invalid bytes in its strings
+        print(f"Record of {len(data)} bytes is not valid UTF-8, skipping it")
+        return [], len(text[:resume].encode('utf-8', 'surrogateescape'))
+    if open_record and _truncated(error, text):
+        return None, None
+
+    objects = []
+    resume = max(error.pos, 1)
+    for begin, in_string in _recovery_points(text, 0, error.pos):
+        try:
+            obj, end = _DECODER.raw_decode(text, begin)
+        except json.JSONDecodeError as e:
+            if in_string and _truncated(e, text):
+                resume = begin
+                break
+            continue
+        if _ESCAPED_BYTES.search(text, begin, end):
+            print(f"Object at byte {begin} of a malformed record is not valid UTF-8, skipping it")
+        else:
+            objects.append(obj)
+        if in_string:
+            resume = end
+            break
+    return objects, len(text[:resume].encode('utf-8', 'surrogateescape'))
+
+def iter_stream_objects(stream, buffer_size=READ_BUFFER_SIZE):
+    """Yield JSON objects from a binary stream as soon as each one closes.
+
+    Record boundaries are found on the raw bytes; every byte that matters
+    to JSON structure is ASCII and never part of a multi-byte sequence, so
+    no decoding happens until a record is complete.  A code point split
+    across two reads simply stays in the buffer with its record.
+
+    Every '{' that is not in a record starts one, as in iter_json_objects,
+    so stray quotes or brackets between records cannot hide the records
+    after them; callers pass the bytes of the records, not of a wrapper
+    around them.  Only the record being read is kept in the buffer, so
+    memory follows the largest record rather than the size of the stream.
+
+    A record that does not decode once it closes is salvaged as
+    iter_json_objects would, and scanning resumes at its error.  A broken
+    record can also look as if it never closes (a stray quote flips string
+    state), so a record that keeps growing is decoded as far as it goes
+    each time it doubles past buffer_size, and salvaged the same way once
+    that shows an error.
+    """
+    buf = bytearray()
+    pos = 0
+    start = None
+    depth = 0
+    in_string = False
+    check_size = buffer_size
+
+    while True:
+        # Drop everything before the open record (or the scan position)
+        keep = pos if start is None else start
+        del buf[:keep]
+        pos -= keep
+        resumed = False
+        if start is not None:
+            start = 0
+
+            if len(buf) > check_size:
+                objects, resume = _recover(buf, open_record=True)
+                if resume is None:
+                    check_size *= 2
+                else:
+                    print(f"Record still open after {len(buf)} bytes is malformed, resuming at byte {resume}")
+                    yield from objects
+                    pos = resume
+                    start = None
+                    in_string = False
+                    resumed = True
+
+        if not resumed:
+            data = stream.read(buffer_size)
+            if not data:
+                break
+            buf += data
+
+        while True:
+            if start is None:
+                brace = buf.find(b'{', pos)
+                if brace == -1:
+                    pos = len(buf)
+                    break
+                start = brace
+                pos = brace + 1
+                depth = 1
+                check_size = buffer_size
+                continue
+
+            if in_string:
+                quote = buf.find(b'"', pos)
+                if quote == -1:
+                    # Keep a trailing run of backslashes: it decides
+                    # whether the next quote is escaped
+                    pos = len(buf)
+                    while pos > 0 and buf[pos - 1] == 0x5c:
+                        pos -= 1
+                    break
+                escape = quote
+                while escape > 0 and buf[escape - 1] == 0x5c:
+                    escape -= 1
+                pos = quote + 1
+                in_string = (quote - escape) % 2 == 1
+                continue
+
+            match = _STRUCTURAL_BYTES.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char = buf[match.start()]
+            pos = match.end()
+
+            if char == 0x22:  # "
+                in_string = True
+                continue
+            if char in b'{[':
+                depth += 1
+                continue
+            depth -= 1
+            if depth:
+                continue
+            record = buf[start:pos]
+            try:
+                objects = [_DECODER.decode(record.decode('utf-8'))]
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                objects, resume = _recover(record)
+                if resume < len(record):
+                    print(f"Malformed record of {len(record)} bytes, keeping {len(objects)} objects from it")
+                    pos = start + resume
+                    in_string = False
+            yield from objects
+            start = None
+
+    if start is not None:
+        # The range ended inside a record; keep its complete inner objects
+        yield from iter_json_objects(decode_utf8(bytes(buf[start:]), 'replace'))
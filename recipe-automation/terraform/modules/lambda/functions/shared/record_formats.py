@@ -0,0 +1,139 @@
+"""
+Serialization of parsed records for chunk data files and merged output.
+
+json  - one JSON array per file (the original layout)
+jsonl - JSON Lines: one record per line, so files can be streamed, split
+        and concatenated without parsing
+columnar - the compact binary encoding in columnar.py; read it back with
+        iter_records or columnar.ColumnarFile
+
+The JSON writers can also note where each record lands in the file (see
+write_records); merge_results turns those spans into the archive's
+random-access index when the upload asks for one.
+
+The reader and columnar modules are imported on first use, so handlers that
+only validate or write JSON do not load them during a cold start.
+"""
+import json
+import os
+
+OUTPUT_FORMATS = {
+    'json': '.json',
+    'jsonl': '.jsonl',
+    'columnar': '.rcol',
+}
+DEFAULT_OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'json')
+
+# How merge_results assembles the chunk data files: a ZIP archive, or one
+# data file concatenated server-side (JSON Lines only, since only JSON Lines
+# files stay valid when joined byte for byte)
+MERGE_MODES = ('zip', 'concat')
+DEFAULT_MERGE_MODE = os.environ.get('MERGE_MODE', 'zip')
+
+# Field that identifies a record in the random-access index
+RECORD_ID_FIELD = os.environ.get('RECORD_ID_FIELD', 'id')
+
+# Whether merged ZIPs get the random-access index.  It deflates entries in
+# independent blocks (a worse ratio), writes a spans file per chunk and
+# holds every record's span in merge_results, so it is off unless asked for
+DEFAULT_RECORD_INDEX = os.environ.get('RECORD_INDEX', 'false')
+
+def validate_format(output_format):
+    """Return output_format, or raise ValueError if it is not supported"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format '{output_format}', expected one of {sorted(OUTPUT_FORMATS)}"
+        )
+    return output_format
+
+def validate_merge_mode(merge_mode, output_format):
+    """Return merge_mode, or raise ValueError if it does not fit output_format"""
+    if merge_mode not in MERGE_MODES:
+        raise ValueError(
+            f"Unsupported merge mode '{merge_mode}', expected one of {list(MERGE_MODES)}"
+        )
+    if merge_mode == 'concat' and output_format != 'jsonl':
+        raise ValueError(f"Merge mode 'concat' needs the jsonl output format, not '{output_format}'")
+    return merge_mode
+
+def validate_record_index(record_index, output_format, merge_mode):
+    """Whether to build the record index for a 'true'/'false' setting; raises ValueError for others.
+
+    Only JSON and JSON Lines entries of a ZIP have byte spans to index.
+    """
+    if str(record_index).lower() not in ('true', 'false'):
+        raise ValueError(f"Unsupported record index setting '{record_index}', expected 'true' or 'false'")
+    return str(record_index).lower() == 'true' and merge_mode == 'zip' and output_format != 'columnar'
+
+def file_extension(output_format):
+    return OUTPUT_FORMATS[validate_format(output_format)]
+
+def record_id(obj):
+    """The record's RECORD_ID_FIELD value, or None"""
+    if isinstance(obj, dict):
+        return obj.get(RECORD_ID_FIELD)
+    return None
+
+def write_json_array(writer, objects, spans=None):
+    """Serialize objects one at a time as a JSON array; returns the count"""
+    count = 0
+    offset = 1
+    writer.write(b'[')
+    for obj in objects:
+        if count:
+            writer.write(b', ')
+            offset += 2
+        data = json.dumps(obj).encode('utf-8')
+        writer.write(data)
+        if spans is not None:
+            spans.append([offset, len(data), record_id(obj)])
+        offset += len(data)
+        count += 1
+    writer.write(b']')
+    return count
+
+def write_json_lines(writer, objects, spans=None):
+    """Serialize objects one per line; returns the count"""
+    count = 0
+    offset = 0
+    for obj in objects:
+        data = json.dumps(obj).encode('utf-8')
+        writer.write(data + b'\n')
+        if spans is not None:
+            spans.append([offset, len(data), record_id(obj)])
+        offset += len(data) + 1
+        count += 1
+    return count
+
+def write_columnar(writer, objects):
+    """Encode objects column by column and write the result; returns the count"""
+    from columnar import ColumnarWriter
+    columns = ColumnarWriter()
+    for obj in objects:
+        columns.add(obj)
+    columns.write_to(writer)
+    return len(columns)
+
+def write_records(writer, objects, output_format, spans=None):
+    """Write objects to a file-like writer in output_format; returns the count.
+
+    If spans is a list, the JSON formats append [offset, length, record id]
+    for each record written.  Columnar rows have no byte span of their own,
+    so spans is left empty for them.
+    """
+    output_format = validate_format(output_format)
+    if output_format == 'jsonl':
+        return write_json_lines(writer, objects, spans)
+    if output_format == 'columnar':
+        return write_columnar(writer, objects)
+    return write_json_array(writer, objects, spans)
+
+def iter_records(stream, output_format):
+    """Yield the records of a data file written by write_records"""
+    if validate_format(output_format) == 'columnar':
+        from columnar import ColumnarFile
+        return iter(ColumnarFile(stream.read()))
+    # Array elements and JSON Lines records are both top-level objects
+    # to the streaming scanner
+    from json_scan import iter_stream_objects
+    return iter_stream_objects(stream)
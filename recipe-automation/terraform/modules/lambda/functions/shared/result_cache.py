@@ -0,0 +1,223 @@
+"""
+Cache of finished outputs, keyed by the content of the upload.
+
+split_file looks every upload up before planning chunks: bytes that were
+processed before with the same output settings get a server-side copy of
+the earlier output instead of a new execution.  The merge records each
+output it writes.
+
+An upload's content hash is, in order of preference:
+
+- a full-object SHA-256 checksum S3 keeps for it;
+- its ETag, when that is the MD5 of the content (a single-part upload not
+  encrypted with KMS);
+- a SHA-256 of the object computed as it streams, for objects up to
+  RESULT_CACHE_HASH_MAX_BYTES.
+
+The cache key hashes that together with the size, the output settings and
+RESULT_VERSION.  Entries are small JSON objects under RESULT_CACHE_PREFIX
+in the upload's bucket, next to the chunk manifests; locally, LocalS3
+holds them like any other object.  An entry names the outputs and their
+ETags, and is ignored once one of them has changed or gone.  A copied
+archive keeps the summary of the upload it was made from.
+
+Chunks are memoized the same way, under RESULT_CACHE_PREFIX + 'chunks/':
+the key is the upload's bucket, key and version (its VersionId, or its
+ETag in an unversioned bucket), the chunk's byte range and the parsing
+settings, and the entry is the chunk's data file metadata.  A Map retry
+or a rerun of the execution then skips downloading and parsing chunks
+whose data files are still in place.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+from record_formats import DEFAULT_MERGE_MODE, DEFAULT_OUTPUT_FORMAT, RECORD_ID_FIELD
+from s3_io import ParallelRangeReader, concatenate_objects
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_PREFIX = os.environ.get('RESULT_CACHE_PREFIX', 'processed/cache/')
+CHUNK_CACHE_ENABLED = os.environ.get('CHUNK_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_HASH_MAX_BYTES = int(os.environ.get('RESULT_CACHE_HASH_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Bump when a change to parsing or merging alters the outputs, so results
+# made by the earlier code are not reused
+RESULT_VERSION = 3
+
+HASH_READ_SIZE = 1024 * 1024
+
+def output_key(original_key, suffix):
+    """Key of an upload's output, e.g. suffix '_processed.zip'.
+
+    Only the leading uploads/ and the trailing .json are replaced, so
+    directories named like either keep their names.
+    """
+    key = original_key[:-len('.json')] if original_key.endswith('.json') else original_key
+    if key.startswith('uploads/'):
+        key = 'processed/' + key[len('uploads/'):]
+    return key + suffix
+
+def content_hash(s3_client, bucket, key, head):
+    """Hash of the object's bytes, from head_object's response or by reading it; None if too large"""
+    checksum = head.get('ChecksumSHA256')
+    if checksum and head.get('ChecksumType', 'FULL_OBJECT') == 'FULL_OBJECT' and '-' not in checksum:
+        return f'sha256:{checksum}'
+
+    etag = head.get('ETag', '').strip('"')
+    if etag and '-' not in etag and head.get('ServerSideEncryption') not in ('aws:kms', 'aws:kms:dsse'):
+        return f'md5:{etag}'
+
+    size = head['ContentLength']
+    if size > RESULT_CACHE_HASH_MAX_BYTES:
+        return None
+    digest = hashlib.sha256()
+    if size:
+        with ParallelRangeReader(s3_client, bucket, key, 0, size - 1) as body:
+            for data in iter(lambda: body.read(HASH_READ_SIZE), b''):
+                digest.update(data)
+    return f'sha256-stream:{digest.hexdigest()}'
+
+def cache_key_for(hash_value, size, settings):
+    """Cache key for content with this hash and size, processed with settings"""
+    material = json.dumps([
+        RESULT_VERSION,
+        hash_value,
+        size,
+        settings['output_format'],
+        settings['merge_mode'],
+        settings['compression'],
+        settings['wrapper_keys'],
+        settings['record_index'],
+        RECORD_ID_FIELD,
+    ])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def source_version(head):
+    """What identifies this version of an object: its VersionId, or its ETag if unversioned"""
+    return head.get('VersionId') or head.get('ETag')
+
+def chunk_key_for(chunk_info):
+    """Memo key for a chunk item, or None if it does not say which version of the upload it reads"""
+    version = chunk_info.get('source_version')
+    if not version:
+        return None
+    material = json.dumps([
+        RESULT_VERSION,
+        chunk_info['bucket'],
+        chunk_info['key'],
+        version,
+        chunk_info['chunk_number'],
+        chunk_info['start_byte'],
+        chunk_info['end_byte'],
+        chunk_info.get('output_format', DEFAULT_OUTPUT_FORMAT),
+        chunk_info.get('merge_mode', DEFAULT_MERGE_MODE),
+        bool(chunk_info.get('record_index')),
+        RECORD_ID_FIELD,
+    ])
+    return 'chunks/' + hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _entry_key(key):
+    return f'{RESULT_CACHE_PREFIX}{key}.json'
+
+def _etag(s3_client, bucket, key):
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key).get('ETag')
+    except Exception:
+        return None
+
+def lookup_chunk(s3_client, bucket, key):
+    """The parsed chunk recorded under key if its files are still as written, else None"""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=_entry_key(key))
+        entry = json.loads(response['Body'].read())
+        files = entry.pop('etags')
+    except Exception:
+        return None
+
+    for file_key, etag in files.items():
+        if _etag(s3_client, bucket, file_key) != etag:
+            print(f"Chunk file {file_key} has changed or gone")
+            return None
+    return entry
+
+def record_chunk(s3_client, bucket, key, parsed):
+    """Save a parsed chunk (its data_key, data_size, spans_key and objects_found) under key"""
+    try:
+        files = [parsed['data_key']] + ([parsed['spans_key']] if parsed['spans_key'] else [])
+        etags = {file_key: _etag(s3_client, bucket, file_key) for file_key in files}
+        if None in etags.values():
+            # Without an ETag a later change to the file could not be seen
+            return
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=_entry_key(key),
+            Body=json.dumps(dict(parsed, etags=etags)),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Error recording chunk cache entry: {str(e)}")
+
+def lookup(s3_client, bucket, key):
+    """The entry for key if every output it names is still as written, else None"""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=_entry_key(key))
+        entry = json.loads(response['Body'].read())
+        outputs = entry['outputs']
+    except Exception:
+        # No entry is the usual miss; any other failure is treated as one
+        return None
+
+    for output in outputs:
+        if _etag(s3_client, bucket, output['key']) != output['etag']:
+            print(f"Cached output {output['key']} has changed or gone")
+            return None
+    return entry
+
+def reuse(s3_client, bucket, entry, original_key):
+    """Copy a cached entry's outputs to original_key's output keys; returns the first output's location"""
+    locations = []
+    for output in entry['outputs']:
+        target = output_key(original_key, output['suffix'])
+        if target != output['key']:
+            put_args = {'ContentType': output['content_type']} if output.get('content_type') else {}
+            concatenate_objects(s3_client, bucket, [(output['key'], output['size'])], target, **put_args)
+        locations.append(f's3://{bucket}/{target}')
+    return locations[0]
+
+def record(s3_client, settings, outputs, totals):
+    """Save the entry for settings['cache_key'].
+
+    outputs are (suffix, content_type) of the files just written for the
+    upload, main output first; totals are its chunk and record counts.
+    Failures are logged, since the output itself is already complete.
+    """
+    key = settings.get('cache_key')
+    if not key:
+        return
+    bucket = settings['bucket']
+    try:
+        entry_outputs = []
+        for suffix, content_type in outputs:
+            target = output_key(settings['original_key'], suffix)
+            head = s3_client.head_object(Bucket=bucket, Key=target)
+            entry_outputs.append({
+                'suffix': suffix,
+                'key': target,
+                'etag': head.get('ETag'),
+                'size': head['ContentLength'],
+                'content_type': content_type,
+            })
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=_entry_key(key),
+            Body=json.dumps({
+                'source': settings['original_key'],
+                'created': datetime.utcnow().isoformat(),
+                'outputs': entry_outputs,
+                **totals
+            }),
+            ContentType='application/json'
+        )
+        print(f"Recorded result cache entry {key}")
+    except Exception as e:
+        print(f"Error recording result cache entry: {str(e)}")
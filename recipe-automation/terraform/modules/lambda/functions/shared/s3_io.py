@@ -0,0 +1,325 @@
+"""
+S3 transfer helpers shared by the Lambda functions.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Sub-range size and number of concurrent GETs for ranged downloads
+DOWNLOAD_PART_SIZE = int(os.environ.get('DOWNLOAD_PART_BYTES', 8 * 1024 * 1024))
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', 8))
+
+# Part size and number of parts in flight for multipart uploads; S3 needs
+# every part but the last to be at least 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_BYTES', 8 * 1024 * 1024))
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 2))
+
+# UploadPartCopy limits a copied part to 5GB; copies run server-side, so
+# many can be in flight at once
+MAX_COPY_PART_SIZE = 5 * 1024 * 1024 * 1024
+COPY_CONCURRENCY = int(os.environ.get('COPY_CONCURRENCY', 8))
+
+def iter_prefetched(func, items, concurrency):
+    """Yield (item, future of func(item)) for items, strictly in order.
+
+    Up to `concurrency` calls run ahead on a thread pool while the caller
+    works on the current item, so network and CPU overlap without results
+    arriving out of order.  Reading a future's result raises whatever the
+    call raised.
+    """
+    items = iter(items)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    def schedule():
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            return
+
+    try:
+        for _ in range(max(1, concurrency)):
+            schedule()
+        while pending:
+            item, future = pending.popleft()
+            schedule()
+            yield item, future
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+class ParallelRangeReader:
+    """File-like reader over bytes start-end of an S3 object.
+
+    The range is fetched as sub-range GETs on a bounded thread pool and
+    handed out strictly in order, so a streaming parser can consume it like
+    a single StreamingBody.  At most `concurrency` parts are downloaded or
+    waiting at any time, which caps memory at concurrency * part_size.
+    """
+
+    def __init__(self, s3_client, bucket, key, start, end,
+                 part_size=DOWNLOAD_PART_SIZE, concurrency=DOWNLOAD_CONCURRENCY):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.end = end
+        self.part_size = max(1, part_size)
+        self._next_start = start
+        self._pending = deque()
+        self._current = b''
+        self._offset = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        for _ in range(max(1, concurrency)):
+            self._schedule()
+
+    def _fetch(self, start, end):
+        response = self.s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f'bytes={start}-{end}'
+        )
+        return response['Body'].read()
+
+    def _schedule(self):
+        if self._next_start > self.end:
+            return
+        part_end = min(self._next_start + self.part_size - 1, self.end)
+        self._pending.append(self._executor.submit(self._fetch, self._next_start, part_end))
+        self._next_start = part_end + 1
+
+    def read(self, size=-1):
+        while self._offset >= len(self._current):
+            if not self._pending:
+                return b''
+            self._current = self._pending.popleft().result()
+            self._offset = 0
+            self._schedule()
+
+        if size is None or size < 0:
+            size = len(self._current) - self._offset
+        data = self._current[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MultipartUploadWriter:
+    """File-like writer that streams bytes into an S3 object.
+
+    Writes collect in a single part buffer; each full buffer is sent as a
+    multipart part on a background thread while the caller keeps producing
+    the next one.  Output that never fills a part is sent with a plain
+    put_object instead.  Leaving the context with an exception, or a part
+    or completion failing in close(), aborts the upload so no orphaned
+    parts are kept.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=UPLOAD_PART_SIZE,
+                 concurrency=UPLOAD_CONCURRENCY, **put_args):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = max(1, concurrency)
+        self.put_args = put_args
+        self.bytes_written = 0
+        self.upload_id = None
+        self._buffer = bytearray()
+        self._parts = []
+        self._executor = None
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._flush_part()
+        return len(data)
+
+    def flush(self):
+        # Parts are sent as they fill; close() sends the remainder
+        pass
+
+    def _upload_part(self, part_number, body):
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _flush_part(self):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                **self.put_args
+            )
+            self.upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # Wait for the oldest part rather than queue more than we upload
+        in_flight = [part for part in self._parts if not part.done()]
+        if len(in_flight) >= self.concurrency:
+            in_flight[0].result()
+
+        body = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._parts.append(self._executor.submit(self._upload_part, len(self._parts) + 1, body))
+
+    def close(self):
+        """Finish the object; returns the number of bytes written"""
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self._buffer),
+                **self.put_args
+            )
+            self._buffer = bytearray()
+            return self.bytes_written
+
+        try:
+            if self._buffer:
+                self._flush_part()
+            parts = [part.result() for part in self._parts]
+            self._executor.shutdown()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            # A part or the completion failed; drop the parts already sent
+            self.abort()
+            raise
+        return self.bytes_written
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+        for part in self._parts:
+            part.cancel()
+        self._executor.shutdown()
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def concatenate_objects(s3_client, bucket, sources, key, tail=b'', concurrency=COPY_CONCURRENCY, **put_args):
+    """Write the concatenation of sources to key; returns the number of bytes.
+
+    sources is a list of (source_key, size) in output order, and tail is
+    data from memory written after the last source.  Every stretch
+    of at least MIN_PART_SIZE is copied server-side with UploadPartCopy, so
+    large sources are never downloaded.  Data that is too small to be a part
+    of its own (a small source, or the head of the next source needed to
+    top up a small one) is downloaded and uploaded as a regular part.
+    """
+    parts = []
+    buffer = bytearray()
+    total = 0
+    upload_id = None
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    def start_upload():
+        nonlocal upload_id
+        if upload_id is None:
+            upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **put_args)['UploadId']
+
+    def upload_part(part_number, body):
+        response = s3_client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def copy_part(part_number, source_key, start, end):
+        response = s3_client.upload_part_copy(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+            CopySource={'Bucket': bucket, 'Key': source_key},
+            CopySourceRange=f'bytes={start}-{end}'
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    def download(source_key, start, end):
+        response = s3_client.get_object(Bucket=bucket, Key=source_key, Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+    def flush_buffer():
+        start_upload()
+        parts.append(executor.submit(upload_part, len(parts) + 1, bytes(buffer)))
+        buffer.clear()
+
+    try:
+        for source_key, size in sources:
+            total += size
+            pos = 0
+            if buffer and size:
+                # Top up the pending small data so it can be a part
+                take = min(MIN_PART_SIZE - len(buffer), size)
+                buffer += download(source_key, 0, take - 1)
+                pos = take
+                if len(buffer) >= MIN_PART_SIZE:
+                    flush_buffer()
+
+            remaining = size - pos
+            if remaining >= MIN_PART_SIZE and not buffer:
+                start_upload()
+                pieces = -(-remaining // MAX_COPY_PART_SIZE)
+                piece_size = -(-remaining // pieces)
+                for start in range(pos, size, piece_size):
+                    end = min(start + piece_size, size) - 1
+                    parts.append(executor.submit(copy_part, len(parts) + 1, source_key, start, end))
+            elif remaining:
+                buffer += download(source_key, pos, size - 1)
+
+        # The tail only ever ends the upload, where a part may be small
+        buffer += tail
+        total += len(tail)
+
+        if upload_id is None:
+            # Nothing was big enough for a multipart upload
+            s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), **put_args)
+            return total
+
+        if buffer:
+            flush_buffer()
+        completed = [part.result() for part in parts]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+        return total
+    except Exception:
+        for part in parts:
+            part.cancel()
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,401 @@
+"""
+Streaming ZIP writer with parallel deflate.
+
+zipfile compresses each entry on the calling thread and cannot take data
+that is already compressed.  This writer splits entry data into blocks and
+deflates them on a thread pool (zlib releases the GIL), then writes the
+blocks in order as one deflate stream:
+
+- every block but the last ends with a sync flush, so blocks concatenate
+  into a single valid stream;
+- each block is primed with the last 32KB of the block before it, so the
+  ratio stays close to compressing the entry in one piece.
+
+The output is a standard ZIP.  The writer never seeks: each entry's CRC and
+sizes follow its data in a ZIP64 data descriptor, as zipfile does for
+unseekable files, and ZIP64 end records are added when the archive needs
+them.
+
+Codecs are named as 'codec' or 'codec:level' (see parse_codec): stored,
+deflate, bzip2, lzma, and zstd when the zstandard package is installed.
+Only deflate is split across threads; the others compress each entry as
+one stream.  zstd entries (method 93) need a reader that supports them.
+
+With independent_blocks, deflate blocks are not primed, so decompression
+can start at any block.  Each entry's record then lists its access points,
+[uncompressed offset, offset into the compressed data], for readers that
+fetch part of an entry with a ranged GET.
+
+An archive can also be built in parts: close_part() finishes a run of
+entries without a central directory and returns their records.  Parts
+written separately can be joined byte-for-byte and closed with
+central_directory() once each part's records are moved by its offset.
+"""
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Uncompressed bytes per deflate block, and threads compressing blocks
+BLOCK_SIZE = int(os.environ.get('DEFLATE_BLOCK_BYTES', 1024 * 1024))
+COMPRESS_WORKERS = int(os.environ.get('COMPRESS_WORKERS', os.cpu_count() or 1))
+DEFAULT_CODEC = os.environ.get('ZIP_CODEC', 'deflate')
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+ZIP_ZSTANDARD = 93
+
+# Codec name: (compression method, default level, lowest and highest level)
+CODECS = {
+    'stored': (ZIP_STORED, 0, 0, 0),
+    'deflate': (ZIP_DEFLATED, 6, 1, 9),
+    'bzip2': (ZIP_BZIP2, 9, 1, 9),
+    'lzma': (ZIP_LZMA, 6, 0, 9),
+    'zstd': (ZIP_ZSTANDARD, 3, 1, 22),
+}
+
+# Version needed to extract, per method
+_METHOD_VERSIONS = {ZIP_BZIP2: 46, ZIP_LZMA: 63, ZIP_ZSTANDARD: 63}
+
+# Deflate window: how much of the previous block primes the next one
+_WINDOW = 32 * 1024
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+_CREATE_SYSTEM_UNIX = 3
+_FLAG_LZMA_EOS = 0x02
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_EXTRA_SIZE = 20
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, COMPRESS_WORKERS))
+    return _executor
+
+def parse_codec(spec):
+    """Turn 'codec' or 'codec:level' into (compression method, level)"""
+    name, _, level = str(spec).strip().lower().partition(':')
+    if name not in CODECS:
+        raise ValueError(f"Unsupported compression '{spec}', expected one of {sorted(CODECS)}")
+    method, default, lowest, highest = CODECS[name]
+    try:
+        level = int(level) if level else default
+    except ValueError:
+        raise ValueError(f"Compression level in '{spec}' is not a number")
+    if not lowest <= level <= highest:
+        raise ValueError(f"Compression level for {name} must be between {lowest} and {highest}")
+    if method == ZIP_ZSTANDARD:
+        _zstandard()
+    return method, level
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package")
+    return zstandard
+
+class _LZMACompressor:
+    """Raw LZMA1 stream behind the small properties header ZIP expects"""
+
+    def __init__(self, level):
+        import lzma
+        props = lzma._encode_filter_properties({'id': lzma.FILTER_LZMA1, 'preset': level})
+        filters = [lzma._decode_filter_properties(lzma.FILTER_LZMA1, props)]
+        self._compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=filters)
+        self._header = struct.pack('<BBH', 9, 4, len(props)) + props
+
+    def compress(self, data):
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+def _stream_compressor(method, level):
+    """compress()/flush() object for the codecs that are not split into blocks"""
+    if method == ZIP_BZIP2:
+        import bz2
+        return bz2.BZ2Compressor(level)
+    if method == ZIP_LZMA:
+        return _LZMACompressor(level)
+    if method == ZIP_ZSTANDARD:
+        return _zstandard().ZstdCompressor(level=level).compressobj()
+    raise ValueError(f"Unsupported compression method {method}")
+
+def _deflate_block(data, level, zdict, last):
+    """Raw-deflate one block; a non-final block ends on a byte boundary"""
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+def _dos_date_time(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return ((year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+class _Entry:
+    """File-like handle for one entry; closing it writes the data descriptor"""
+
+    def __init__(self, archive, name, compress_type, level):
+        self.archive = archive
+        self.name = name
+        self.compress_type = compress_type
+        self.level = level
+        self.header_offset = archive.offset
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.date, self.time = _dos_date_time(time.time())
+        self.flags = _FLAG_DATA_DESCRIPTOR
+        if compress_type == ZIP_LZMA:
+            self.flags |= _FLAG_LZMA_EOS
+        self.version = max(_VERSION_ZIP64, _METHOD_VERSIONS.get(compress_type, 0))
+        self._compressor = None
+        if compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            self._compressor = _stream_compressor(compress_type, level)
+        try:
+            self.encoded_name = name.encode('ascii')
+        except UnicodeEncodeError:
+            self.encoded_name = name.encode('utf-8')
+            self.flags |= _FLAG_UTF8
+        self._buffer = bytearray()
+        self._previous_tail = b''
+        self._submitted = 0
+        self._pending = deque()
+        # Stored data can be read from anywhere; other stream codecs only
+        # from the start of the entry
+        self.access_points = None
+        if compress_type != ZIP_STORED:
+            self.access_points = [] if self._independent() else [[0, 0]]
+        self._closed = False
+        self._write_local_header()
+
+    def _independent(self):
+        return self.compress_type == ZIP_DEFLATED and self.archive.independent_blocks
+
+    def record(self):
+        """What the central directory needs to know about this entry"""
+        return {
+            'name': self.name,
+            'compress_type': self.compress_type,
+            'flags': self.flags,
+            'date': self.date,
+            'time': self.time,
+            'crc': self.crc,
+            'compress_size': self.compress_size,
+            'file_size': self.file_size,
+            'header_offset': self.header_offset,
+            'access_points': self.access_points,
+        }
+
+    def _write_local_header(self):
+        # Sizes are unknown until the data is written, so the local header
+        # carries ZIP64 placeholders and the data descriptor the real values
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self.version, self.flags, self.compress_type,
+            self.time, self.date, 0, _ZIP32_LIMIT, _ZIP32_LIMIT,
+            len(self.encoded_name), len(extra)
+        )
+        self.archive._write(header + self.encoded_name + extra)
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("Entry is closed")
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += len(data)
+        if self.compress_type == ZIP_STORED:
+            self._emit(bytes(data))
+            return len(data)
+        if self._compressor is not None:
+            self._emit(self._compressor.compress(data))
+            return len(data)
+
+        self._buffer += data
+        while len(self._buffer) >= self.archive.block_size:
+            block = bytes(self._buffer[:self.archive.block_size])
+            del self._buffer[:self.archive.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block, last):
+        future = self.archive.executor.submit(_deflate_block, block, self.level, self._previous_tail, last)
+        if not self._independent():
+            self._previous_tail = block[-_WINDOW:]
+        self._pending.append((future, self._submitted))
+        self._submitted += len(block)
+        # Keep a bounded number of blocks in flight; write out finished
+        # ones in order as soon as they are ready
+        while self._pending and (self._pending[0][0].done() or len(self._pending) > self.archive.max_pending):
+            self._emit_block()
+
+    def _emit_block(self):
+        future, start = self._pending.popleft()
+        data = future.result()
+        if self._independent() and data:
+            self.access_points.append([start, self.compress_size])
+        self._emit(data)
+
+    def _emit(self, data):
+        self.compress_size += len(data)
+        self.archive._write(data)
+
+    def close(self):
+        if self._closed:
+            return
+        if self.compress_type == ZIP_DEFLATED:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self._emit_block()
+        elif self._compressor is not None:
+            self._emit(self._compressor.flush())
+        self._closed = True
+        self.archive._write(struct.pack('<IIQQ', 0x08074b50, self.crc, self.compress_size, self.file_size))
+        self.archive._finish_entry(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ZipStreamWriter:
+    """Write a ZIP archive to any object with a write() method.
+
+    Use open() for streamed entries and writestr() for data already in
+    memory; entries are written one at a time.  close() (or leaving the
+    context) writes the central directory but leaves fileobj open.
+    """
+
+    def __init__(self, fileobj, compress_type=ZIP_DEFLATED, level=6,
+                 block_size=BLOCK_SIZE, executor=None, independent_blocks=False):
+        self.fileobj = fileobj
+        self.compress_type = compress_type
+        self.level = level
+        self.independent_blocks = independent_blocks
+        self.block_size = max(1, block_size)
+        self.executor = executor or _get_executor()
+        self.max_pending = 2 * getattr(self.executor, '_max_workers', COMPRESS_WORKERS)
+        self.offset = 0
+        self.entries = []
+        self._open_entry = None
+        self._closed = False
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def open(self, name, compress_type=None, level=None):
+        """Start an entry and return a writable handle for it"""
+        if self._open_entry is not None:
+            raise ValueError(f"Entry {self._open_entry.name} is still open")
+        self._open_entry = _Entry(
+            self, name,
+            self.compress_type if compress_type is None else compress_type,
+            self.level if level is None else level
+        )
+        return self._open_entry
+
+    def writestr(self, name, data, compress_type=None, level=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.open(name, compress_type, level) as entry:
+            entry.write(data)
+
+    def _finish_entry(self, entry):
+        self.entries.append(entry)
+        self._open_entry = None
+
+    def close_part(self):
+        """Finish the entries written so far without a central directory.
+
+        Returns the entries' records, with header offsets relative to the
+        start of this writer's output.
+        """
+        if self._open_entry is not None:
+            self._open_entry.close()
+        self._closed = True
+        return [entry.record() for entry in self.entries]
+
+    def close(self):
+        if self._closed:
+            return
+        records = self.close_part()
+        self._write(central_directory(records, self.offset))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def data_offset(record):
+    """Where the entry's data starts, after the local header this module writes"""
+    name_size = len(record['name'].encode('utf-8' if record['flags'] & _FLAG_UTF8 else 'ascii'))
+    return record['header_offset'] + _LOCAL_HEADER_SIZE + name_size + _LOCAL_EXTRA_SIZE
+
+def _central_directory_record(record):
+    zip64 = []
+    file_size, compress_size, header_offset = record['file_size'], record['compress_size'], record['header_offset']
+    if file_size >= _ZIP32_LIMIT:
+        zip64.append(file_size)
+        file_size = _ZIP32_LIMIT
+    if compress_size >= _ZIP32_LIMIT:
+        zip64.append(compress_size)
+        compress_size = _ZIP32_LIMIT
+    if header_offset >= _ZIP32_LIMIT:
+        zip64.append(header_offset)
+        header_offset = _ZIP32_LIMIT
+    extra = b''
+    if zip64:
+        extra = struct.pack(f'<HH{len(zip64)}Q', 0x0001, 8 * len(zip64), *zip64)
+    version = max(_VERSION_ZIP64 if zip64 else _VERSION_DEFAULT,
+                  _METHOD_VERSIONS.get(record['compress_type'], 0))
+    encoded_name = record['name'].encode('utf-8' if record['flags'] & _FLAG_UTF8 else 'ascii')
+    header = struct.pack(
+        '<IBBHHHHHIIIHHHHHII', 0x02014b50, _VERSION_ZIP64, _CREATE_SYSTEM_UNIX,
+        version, record['flags'], record['compress_type'], record['time'], record['date'],
+        record['crc'], compress_size, file_size, len(encoded_name), len(extra),
+        0, 0, 0, 0o644 << 16, header_offset
+    )
+    return header + encoded_name + extra
+
+def central_directory(records, directory_offset):
+    """Central directory and end records for entries ending at directory_offset"""
+    directory = b''.join(_central_directory_record(record) for record in records)
+    directory_size = len(directory)
+    count = len(records)
+    end = b''
+
+    if count >= _ZIP16_LIMIT or directory_offset >= _ZIP32_LIMIT or directory_size >= _ZIP32_LIMIT:
+        zip64_end_offset = directory_offset + directory_size
+        end += struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, _VERSION_ZIP64, _VERSION_ZIP64, 0, 0,
+            count, count, directory_size, directory_offset
+        )
+        end += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        count = min(count, _ZIP16_LIMIT)
+        directory_size = min(directory_size, _ZIP32_LIMIT)
+        directory_offset = min(directory_offset, _ZIP32_LIMIT)
+
+    end += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                       directory_size, directory_offset, 0)
+    return directory + end
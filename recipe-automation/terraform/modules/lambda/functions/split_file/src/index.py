@@ -1,12 +1,395 @@
 import json
-import boto3
 import os
+import re
 from datetime import datetime
+from aws_clients import get_client
+from chunk_merging import merge_chunk_results
+from chunk_planner import plan_chunk_size, sample_records_per_mb
+from chunk_processing import process_chunk
+from json_scan import decode_utf8
+from record_formats import (DEFAULT_MERGE_MODE, DEFAULT_OUTPUT_FORMAT, DEFAULT_RECORD_INDEX, validate_format,
+                            validate_merge_mode, validate_record_index)
+from result_cache import RESULT_CACHE_ENABLED, cache_key_for, content_hash, lookup, reuse, source_version
+from zip_stream import DEFAULT_CODEC, parse_codec
+
+# Nominal chunk size when none is planned; actual chunk edges are snapped
+# to record boundaries
+CHUNK_SIZE = 50 * 1024 * 1024  # 50MB in bytes
+
+# Chunk data files merge_results holds in memory at once (the one being
+# written plus those prefetched), which caps the planned chunk size
+CHUNKS_IN_MEMORY = int(os.environ.get('CHUNKS_IN_MEMORY', 4))
+
+# Uploads smaller than this are parsed and merged inside split_file instead
+# of going through the state machine
+DIRECT_PROCESSING_MAX_BYTES = int(os.environ.get('DIRECT_PROCESSING_MAX_BYTES', 5 * 1024 * 1024))
+
+# Window read around each nominal boundary when looking for a record start
+PROBE_SIZE = int(os.environ.get('BOUNDARY_PROBE_BYTES', 1024 * 1024))
+MAX_PROBE_SIZE = int(os.environ.get('BOUNDARY_PROBE_MAX_BYTES', 8 * 1024 * 1024))
+
+# Top-level keys whose array holds the records when the upload is a single
+# wrapper object such as {"name": ..., "variations": [...]}; an upload can
+# name its own with x-amz-meta-record-key.  Any other top-level object is a
+# record itself
+WRAPPER_KEYS = [
+    name.strip() for name in os.environ.get('RECORD_WRAPPER_KEYS', 'recipes,variations').split(',')
+    if name.strip()
+]
+
+# A closing brace followed by an optional comma and the next opening brace,
+# i.e. the gap between two sibling objects in an array or NDJSON stream
+_RECORD_GAP = re.compile(rb'\}\s*,?\s*\{')
+_STRUCTURAL = re.compile(rb'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+# Everything JSON allows between structural characters outside a string
+_BARE_VALUES = re.compile(rb'[\s:,]*(?:(?:-?[\d.eE+\-]+|true|false|null)[\s:,]*)*')
+# An object's first key, with its quotes, or the closing brace of {}
+_FIRST_KEY = re.compile(rb'\{\s*("(?:[^"\\]|\\.)*"|\})')
+
+# A key and its colon, ending where the value starts
+_KEY = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*$')
+
+# Patterns for the head of the file, which is read as text so whole values
+# can be skipped with the JSON decoder
+_TEXT_FIRST_KEY = re.compile(r'\{\s*("(?:[^"\\]|\\.)*"|\})')
+_TEXT_KEY = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"\s*:\s*')
+_TEXT_GAP_AFTER = re.compile(r'\s*,?\s*\{')
+_TEXT_SPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+def _scan_gaps(window, start, candidates):
+    """Walk the window from a sibling gap, tracking depth relative to it.
+
+    Returns (offset, desync) where offset is the shallowest candidate seen
+    and desync is True when the bytes stopped looking like JSON outside a
+    string, meaning the scan started inside a string after all.
+    """
+    best_offset = None
+    best_depth = None
+    depth = 0
+    pos = start + 1
+
+    while True:
+        match = _STRUCTURAL.search(window, pos)
+        if match is None:
+            return best_offset, False
+        if _BARE_VALUES.fullmatch(window, pos, match.start()) is None:
+            return None, True
+        char = match.group()
+        pos = match.end()
+
+        if char == b'"':
+            # Skip over the string body, honouring escapes
+            while True:
+                special = _STRING_SPECIAL.search(window, pos)
+                if special is None:
+                    return best_offset, False
+                pos = special.end()
+                if special.group() == b'"':
+                    break
+                pos += 1
+        elif char in b'{[':
+            if char == b'{' and match.start() in candidates:
+                if best_depth is None or depth < best_depth:
+                    best_depth = depth
+                    best_offset = match.start()
+            depth += 1
+        else:
+            depth -= 1
+
+
+def _first_key(window, offset):
+    match = _FIRST_KEY.match(window, offset)
+    return match.group(1) if match else None
+
+
+def find_record_boundary(window, record_keys=None):
+    """Return the offset of the shallowest record start in window, or None.
+
+    Scanning starts at the first gap between two sibling objects, so the
+    string state is known from there on; if that gap turns out to be inside
+    a string the scan resumes from the next gap.  Depth is tracked relative
+    to the starting gap and the candidate with the lowest depth wins.
+
+    A window from the middle of the file cannot tell whether that depth is
+    the record level or just the shallowest level it happens to contain,
+    such as the ingredients of a record larger than the window, so with
+    record_keys only objects starting with one of those keys (as learned by
+    find_record_layout) are candidates.
+    """
+    gaps = [m.start() for m in _RECORD_GAP.finditer(window)]
+    candidates = set(_RECORD_GAP.match(window, gap).end() - 1 for gap in gaps)
+    if record_keys is not None:
+        candidates = set(
+            offset for offset in candidates
+            if _first_key(window, offset) in record_keys
+        )
+
+    for gap in gaps:
+        offset, desync = _scan_gaps(window, gap, candidates)
+        if not desync:
+            return offset
+
+    return None
+
+
+def probe_record_boundary(s3_client, bucket, key, offset, file_size, record_keys=None):
+    """Find the first record start at or after offset using ranged GETs.
+
+    The window doubles up to MAX_PROBE_SIZE until it holds a record start,
+    so records larger than PROBE_SIZE are found rather than guessed at.
+    """
+    window = b''
+    probe_size = PROBE_SIZE
+    while offset + len(window) < file_size:
+        range_start = offset + len(window)
+        range_end = min(offset + probe_size, file_size) - 1
+        response = s3_client.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f'bytes={range_start}-{range_end}'
+        )
+        window += response['Body'].read()
+
+        boundary = find_record_boundary(window, record_keys)
+        if boundary is not None:
+            return offset + boundary
+
+        if probe_size >= MAX_PROBE_SIZE:
+            break
+        probe_size = min(probe_size * 2, MAX_PROBE_SIZE)
+
+    return None
+
+
+def _element_keys(text, pos):
+    """First keys of the whole objects in the sequence of values starting at pos"""
+    keys = set()
+    while True:
+        element = _TEXT_GAP_AFTER.match(text, pos)
+        if element is None:
+            return keys
+        start = element.end() - 1
+        key = _TEXT_FIRST_KEY.match(text, start)
+        if key:
+            keys.add(key.group(1))
+        try:
+            _, pos = _DECODER.raw_decode(text, start)
+        except ValueError:
+            return keys
+
+
+def record_layout(text, complete, wrapper_keys):
+    """Where the records start in text read from byte 0, and their first keys.
+
+    Records are the top-level objects (NDJSON and concatenated objects), the
+    elements of a top-level array, or the elements of the array under one of
+    wrapper_keys when the upload is a single object holding one.  A lone
+    object without such a key is one record however many lists it holds.
+
+    Returns (start, keys, wrapper_key) with start an offset in text, keys
+    the set of first keys seen on records (None if there is nothing to
+    split on) and wrapper_key the key the records were found under, or None
+    when text is not complete (the whole file, or all that will be read of
+    it) and more of it is needed.
+    """
+    top = _TEXT_SPACE.match(text).end()
+    if top == len(text):
+        return None if not complete else (0, None, None)
+
+    if text[top] == '[':
+        keys = _element_keys(text, top + 1)
+    elif text[top] != '{':
+        return 0, None, None
+    else:
+        try:
+            _, end = _DECODER.raw_decode(text, top)
+        except ValueError:
+            end = None
+        if end is not None and _TEXT_GAP_AFTER.match(text, end):
+            # Another object follows, so objects are the records
+            keys = _element_keys(text, 0)
+        else:
+            pos = top + 1
+            while True:
+                key = _TEXT_KEY.match(text, pos)
+                if key is None:
+                    break
+                pos = key.end()
+                try:
+                    name = _DECODER.decode(f'"{key.group(1)}"')
+                except ValueError:
+                    break
+                if name in wrapper_keys and text.startswith('[', pos):
+                    keys = _element_keys(text, pos + 1)
+                    if not keys and not complete:
+                        return None
+                    return pos + 1, keys or None, name
+                try:
+                    _, pos = _DECODER.raw_decode(text, pos)
+                except ValueError:
+                    # A value running past the window may hide the key
+                    # after it
+                    if not complete:
+                        return None
+                    break
+            if end is None and not complete:
+                return None
+            return 0, None, None
+
+    if not keys and not complete:
+        return None
+    return 0, keys or None, None
+
+
+def records_end(window, wrapper_key, record_keys):
+    """Offset in window, a tail of the file, of the bracket closing the records' array, or None.
+
+    The wrapper's last values are walked back over until the array under
+    wrapper_key.  An array that opens before the window is taken for it if
+    its elements start with one of record_keys.  Scanning backwards is
+    exact: whether a quote is escaped only depends on the backslashes
+    before it.
+    """
+    # Walk the reversed bytes forwards; offsets are turned back as needed
+    reverse = window[::-1]
+    last = len(window) - 1
+    depth = 0
+    candidate = None
+    holds_records = False
+    pos = 0
+    while True:
+        match = _STRUCTURAL.search(reverse, pos)
+        if match is None:
+            return candidate if holds_records else None
+        char = match.group()
+        pos = match.end()
+
+        if char == b'"':
+            # On to the quote opening this string
+            while True:
+                quote = reverse.find(b'"', pos)
+                if quote == -1:
+                    return candidate if holds_records else None
+                pos = quote + 1
+                escape = pos
+                while escape < len(reverse) and reverse[escape] == 0x5c:
+                    escape += 1
+                if (escape - pos) % 2 == 0:
+                    break
+        elif char in b'}]':
+            depth += 1
+            if char == b']' and depth == 2:
+                candidate = last - match.start()
+                holds_records = False
+        else:
+            offset = last - match.start()
+            if candidate is not None and char == b'{' and depth == 3:
+                holds_records = holds_records or _first_key(window, offset) in record_keys
+            depth -= 1
+            if candidate is not None and depth == 1:
+                key = _KEY.search(window, max(0, offset - 1024), offset)
+                if key and key.group(1) == json.dumps(wrapper_key)[1:-1].encode('utf-8'):
+                    return candidate
+                candidate = None
+                holds_records = False
+            elif depth <= 0:
+                return None
+
+
+def find_record_layout(s3_client, bucket, key, file_size, wrapper_keys=WRAPPER_KEYS):
+    """Learn which bytes of the file hold the records.
+
+    Returns (start, end, keys): chunks only cover [start, end), so a
+    wrapper's other values are never read as records, and boundary probes
+    in the middle of the file only accept objects starting with one of keys.
+    keys is None when the head does not show records to split on, within
+    MAX_PROBE_SIZE, and the file should not be split.
+    """
+    window = b''
+    probe_size = PROBE_SIZE
+    while True:
+        range_end = min(probe_size, file_size) - 1
+        if range_end >= len(window):
+            response = s3_client.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range=f'bytes={len(window)}-{range_end}'
+            )
+            window += response['Body'].read()
+
+        complete = len(window) >= file_size or probe_size >= MAX_PROBE_SIZE
+        # Invalid bytes become lone surrogates, so offsets map back exactly
+        text = decode_utf8(window, 'surrogateescape')
+        layout = record_layout(text, complete, wrapper_keys)
+        if layout is not None:
+            break
+        probe_size = min(probe_size * 2, MAX_PROBE_SIZE)
+
+    start, keys, wrapper_key = layout
+    start = len(text[:start].encode('utf-8', 'surrogateescape'))
+    if keys is not None:
+        keys = set(k.encode('utf-8', 'surrogateescape') for k in keys)
+    if wrapper_key is None:
+        return start, file_size, keys
+
+    print(f"Records are the elements of {wrapper_key!r}, starting at byte {start}")
+    tail = b''
+    probe_size = PROBE_SIZE
+    while True:
+        range_start = max(start, file_size - probe_size)
+        if range_start < file_size - len(tail):
+            response = s3_client.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range=f'bytes={range_start}-{file_size - len(tail) - 1}'
+            )
+            tail = response['Body'].read() + tail
+
+        end = records_end(tail, wrapper_key, keys or set())
+        if end is not None:
+            return start, file_size - len(tail) + end, keys
+        if range_start == start or probe_size >= MAX_PROBE_SIZE:
+            print(f"End of {wrapper_key!r} not found, reading records to the end of the file")
+            return start, file_size, keys
+        probe_size = min(probe_size * 2, MAX_PROBE_SIZE)
+
+
+def plan_chunks(s3_client, bucket, key, file_size, chunk_size=CHUNK_SIZE, record_keys=None,
+                start=0, end=None):
+    """Split bytes [start, end) of the file into ranges whose edges fall on record boundaries"""
+    end = file_size if end is None else end
+    boundaries = [start]
+    nominal_chunks = (end - start + chunk_size - 1) // chunk_size
+
+    for i in range(1, nominal_chunks):
+        nominal = start + i * chunk_size
+        if nominal <= boundaries[-1]:
+            continue
+        if nominal + PROBE_SIZE >= end:
+            # A probe this close to the end cannot see past the last record,
+            # so keep the tail in the current chunk
+            break
+
+        boundary = probe_record_boundary(s3_client, bucket, key, nominal, end, record_keys)
+        if boundary is None:
+            # Splitting here would cut a record in half, so let the
+            # previous chunk absorb this range instead
+            print(f"No record boundary found near byte {nominal}, merging with previous chunk")
+            continue
+        boundaries.append(boundary)
+
+    return [
+        (chunk_start, chunk_end - 1)
+        for chunk_start, chunk_end in zip(boundaries, boundaries[1:] + [end])
+    ]
+
 
 def lambda_handler(event, context):
     print("Starting split_file Lambda")
-    s3_client = boto3.client('s3')
-    sfn_client = boto3.client('stepfunctions')
+    s3_client = get_client('s3')
     
     try:
         # Get bucket and key from event
@@ -14,35 +397,137 @@ def lambda_handler(event, context):
         key = event['Records'][0]['s3']['object']['key']
         print(f"Processing file: {bucket}/{key}")
         
-        # Get file size
-        response = s3_client.head_object(Bucket=bucket, Key=key)
+        # Get file size, and the checksum S3 keeps for it if there is one
+        response = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
         file_size = response['ContentLength']
         
-        # Calculate chunk sizes (50MB per chunk)
-        chunk_size = 50 * 1024 * 1024  # 50MB in bytes
-        total_chunks = (file_size + chunk_size - 1) // chunk_size
+        # Uploads can pick their output format with x-amz-meta-output-format,
+        # how the results are merged with x-amz-meta-merge-mode, the ZIP
+        # codec with x-amz-meta-compression (e.g. deflate:1 or lzma), the
+        # wrapper key holding their records with x-amz-meta-record-key and
+        # whether the ZIP gets a record index with x-amz-meta-record-index
+        metadata = response.get('Metadata', {})
+        output_format = validate_format(metadata.get('output-format', DEFAULT_OUTPUT_FORMAT))
+        merge_mode = validate_merge_mode(metadata.get('merge-mode', DEFAULT_MERGE_MODE), output_format)
+        compression = metadata.get('compression', DEFAULT_CODEC)
+        parse_codec(compression)
+        wrapper_keys = [metadata['record-key']] if metadata.get('record-key') else WRAPPER_KEYS
+        record_index = validate_record_index(metadata.get('record-index', DEFAULT_RECORD_INDEX), output_format, merge_mode)
+        
+        # Content processed before with the same settings gets a copy of
+        # the earlier output instead of a new execution
+        cache_key = None
+        if RESULT_CACHE_ENABLED:
+            hash_value = content_hash(s3_client, bucket, key, response)
+            if hash_value:
+                cache_key = cache_key_for(hash_value, file_size, {
+                    'output_format': output_format,
+                    'merge_mode': merge_mode,
+                    'compression': compression,
+                    'wrapper_keys': wrapper_keys,
+                    'record_index': record_index
+                })
+                entry = lookup(s3_client, bucket, cache_key)
+                if entry:
+                    output = reuse(s3_client, bucket, entry, key)
+                    print(f"Reused the result of {entry['source']} for identical content: {output}")
+                    return {
+                        'statusCode': 200,
+                        'body': json.dumps({
+                            'message': 'Reused cached result',
+                            'output': output,
+                            'source': entry['source'],
+                            'chunks': 0,
+                            'objects_found': entry['objects_found']
+                        })
+                    }
+        
+        # Chunks only cover the records, not the rest of a wrapper such as
+        # {"recipes": [...]}, however many chunks there are
+        start, end, record_keys = find_record_layout(s3_client, bucket, key, file_size, wrapper_keys)
+        
+        direct = file_size < DIRECT_PROCESSING_MAX_BYTES
+        if direct:
+            ranges = [(start, end - 1)]
+        elif record_keys is None:
+            # Without knowing what a record looks like any split could land
+            # inside one
+            print("No records to split on at the head of the file, not splitting it")
+            ranges = [(start, end - 1)]
+        else:
+            # Size chunks from a sample of the file's records, the Map's
+            # concurrency and the memory and timeout of the chunk functions,
+            # then align them to records
+            records_per_mb = sample_records_per_mb(s3_client, bucket, key, file_size)
+            plan = plan_chunk_size(file_size, records_per_mb, copies_in_memory=CHUNKS_IN_MEMORY)
+            print(f"Chunk plan: {json.dumps(plan)}")
+            ranges = plan_chunks(s3_client, bucket, key, file_size, plan['chunk_size'], record_keys, start, end)
+        total_chunks = len(ranges)
         print(f"File size: {file_size} bytes, splitting into {total_chunks} chunks")
         
-        # Create chunks info
+        # Create chunks info; the upload's version keys each chunk's memo
+        version = source_version(response)
         chunks = []
-        for i in range(total_chunks):
-            start_byte = i * chunk_size
-            end_byte = min((i + 1) * chunk_size - 1, file_size - 1)
+        for i, (start_byte, end_byte) in enumerate(ranges):
             chunks.append({
                 'bucket': bucket,
                 'key': key,
                 'chunk_number': i,
                 'start_byte': start_byte,
                 'end_byte': end_byte,
+                'source_version': version,
+                'output_format': output_format,
+                'merge_mode': merge_mode,
+                'compression': compression,
+                'record_index': record_index,
+                'cache_key': cache_key,
                 'total_chunks': total_chunks
             })
         
+        if direct:
+            # Small uploads skip the state machine: the one chunk is parsed
+            # and merged here by the code process_chunk and merge_results
+            # run, so the output is the same
+            print(f"Processing {file_size} bytes directly")
+            result = process_chunk(s3_client, chunks[0])
+            merged = merge_chunk_results(s3_client, [result], datetime.utcnow())
+            
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'File processed directly',
+                    'output': merged['output'],
+                    'chunks': 1,
+                    'objects_found': result['objects_found']
+                })
+            }
+        
+        # The chunk plan goes to S3 rather than into the execution input,
+        # which is capped at 256KB; the workflow's distributed Map reads
+        # its items from there
+        manifest_key = key.replace('uploads/', 'processed/manifests/').replace('.json', '_chunks.json')
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps(chunks),
+            ContentType='application/json'
+        )
+        print(f"Wrote chunk manifest to {bucket}/{manifest_key}")
+        
         # Start Step Function execution
         step_function_arn = os.environ['STEP_FUNCTION_ARN']
         print(f"Starting Step Function: {step_function_arn}")
         
         execution_input = {
-            'chunks': chunks,
+            'manifest': {
+                'bucket': bucket,
+                'key': manifest_key
+            },
+            'total_chunks': total_chunks,
+            'output_format': output_format,
+            'merge_mode': merge_mode,
+            'compression': compression,
+            'record_index': record_index,
             'original_file': {
                 'bucket': bucket,
                 'key': key,
@@ -51,6 +536,7 @@ def lambda_handler(event, context):
         }
         
         print(f"Step Function input: {json.dumps(execution_input)}")
+        sfn_client = get_client('stepfunctions')
         sfn_response = sfn_client.start_execution(
             stateMachineArn=step_function_arn,
             input=json.dumps(execution_input)
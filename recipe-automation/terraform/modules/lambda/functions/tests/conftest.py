@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+import sys
+import pytest
+from unittest.mock import MagicMock
+
+# Handlers import the shared modules as top-level modules, the way they are
+# packaged into each function zip by build.sh; the tests also use the
+# generator at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', '..', '..')))
+
+from aws_clients import reset_clients
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    """Drop cached AWS clients so each test's patched boto3.client is used"""
+    reset_clients()
+    yield
+    reset_clients()
+
+@pytest.fixture
+def ranged_s3():
+    """Build a mock S3 client whose get_object serves byte ranges of data"""
+    def factory(data):
+        s3 = MagicMock()
+
+        def get_object(Bucket, Key, Range=None):
+            if Range is None:
+                return {'Body': io.BytesIO(data)}
+            start, end = Range.replace('bytes=', '').split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        s3.get_object.side_effect = get_object
+        return s3
+    return factory
+
+class MemoryS3:
+    """In-memory S3 for running handlers end to end"""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.uploads = {}
+        self.copied = []
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            return {'ContentLength': 1024}
+        data = self.objects[Key]
+        return {'ContentLength': len(data), 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        if Range:
+            start, end = (int(x) for x in Range.replace('bytes=', '').split('-'))
+            data = data[start:end + 1]
+        return {'Body': io.BytesIO(data)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange):
+        start, end = (int(x) for x in CopySourceRange.replace('bytes=', '').split('-'))
+        self.copied.append(CopySource['Key'])
+        self.uploads[UploadId][PartNumber] = self.objects[CopySource['Key']][start:end + 1]
+        return {'CopyPartResult': {'ETag': f'etag-{PartNumber}'}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads[UploadId]
+        self.objects[Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+@pytest.fixture
+def memory_s3():
+    """The MemoryS3 class, to build a store from a dict of objects"""
+    return MemoryS3
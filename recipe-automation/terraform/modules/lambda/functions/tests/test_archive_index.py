@@ -0,0 +1,60 @@
+import io
+import json
+import zipfile
+import pytest
+from archive_index import ArchiveRecordReader, build_index
+from zip_stream import ZIP_DEFLATED, ZipStreamWriter, data_offset
+
+def indexed_archive(records, compress_type=ZIP_DEFLATED):
+    """Archive with one JSON Lines entry of records and its index"""
+    data = b''.join(json.dumps(record).encode() + b'\n' for record in records)
+    spans = []
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        spans.append([offset, len(line) - 1, json.loads(line)['id']])
+        offset += len(line)
+
+    output = io.BytesIO()
+    with ZipStreamWriter(output, compress_type, 6, block_size=4096, independent_blocks=True) as zip_file:
+        zip_file.writestr('records.jsonl', data)
+        entries = [entry.record() for entry in zip_file.entries]
+        entries[0]['spans'] = spans
+        entries[0]['data_offset'] = data_offset(entries[0])
+        zip_file.writestr('index.json', json.dumps(build_index(entries, 'id')))
+    return output.getvalue()
+
+def test_blocks_are_independent_access_points():
+    records = [{'id': i, 'text': f'{i} ' * (i % 50)} for i in range(2000)]
+    data = indexed_archive(records)
+    assert zipfile.ZipFile(io.BytesIO(data)).testzip() is None
+
+    index = json.loads(zipfile.ZipFile(io.BytesIO(data)).read('index.json'))
+    points = index['entries'][0]['access_points']
+    assert len(points) > 10
+    assert [p[0] for p in points] == [4096 * n for n in range(len(points))]
+
+def test_records_are_read_with_small_ranged_gets(ranged_s3):
+    records = [{'id': f'recipe-{i}', 'text': f'{i} ' * (i % 50)} for i in range(2000)]
+    data = indexed_archive(records)
+    s3 = ranged_s3(data)
+    s3.head_object.return_value = {'ContentLength': len(data)}
+    reader = ArchiveRecordReader(s3, 'test-bucket', 'processed/test-recipe_processed.zip')
+    s3.get_object.reset_mock()
+
+    assert reader.get(record_id='recipe-1234') == records[1234]
+    fetched = s3.get_object.call_args.kwargs['Range'].replace('bytes=', '').split('-')
+    assert int(fetched[1]) - int(fetched[0]) < 3 * 4096
+    assert [reader.get(ordinal=n) for n in range(0, 2000, 97)] == records[::97]
+
+@pytest.mark.parametrize('compress_type', [0, 12])
+def test_stored_and_whole_stream_entries(ranged_s3, compress_type):
+    records = [{'id': i} for i in range(100)]
+    data = indexed_archive(records, compress_type)
+    s3 = ranged_s3(data)
+    s3.head_object.return_value = {'ContentLength': len(data)}
+
+    reader = ArchiveRecordReader(s3, 'test-bucket', 'archive.zip')
+
+    assert reader.get(record_id=42) == {'id': 42}
+    with pytest.raises(KeyError):
+        reader.ordinal(100)
@@ -0,0 +1,16 @@
+from unittest.mock import patch
+from aws_clients import CLIENT_CONFIG, get_client
+
+def test_client_is_created_once_per_service():
+    with patch('boto3.client', side_effect=lambda service, config: object()) as mock_client:
+        s3 = get_client('s3')
+
+        assert get_client('s3') is s3
+        assert get_client('stepfunctions') is not s3
+        assert mock_client.call_count == 2
+        assert mock_client.call_args.kwargs['config'] is CLIENT_CONFIG
+
+def test_config_uses_adaptive_retries_and_keepalive():
+    assert CLIENT_CONFIG.retries['mode'] == 'adaptive'
+    assert CLIENT_CONFIG.tcp_keepalive is True
+    assert CLIENT_CONFIG.max_pool_connections >= 10
@@ -0,0 +1,40 @@
+import json
+from chunk_planner import MB, MIN_CHUNK_SIZE, plan_chunk_size, sample_records_per_mb
+
+def test_small_files_fill_every_slot():
+    plan = plan_chunk_size(60 * MB, records_per_mb=10, concurrency=5, memory_mb=1024, copies_in_memory=4)
+
+    assert plan['chunk_count'] == 5
+    assert plan['chunk_size'] == 12 * MB
+
+def test_tiny_files_stay_above_the_floor():
+    plan = plan_chunk_size(10 * MB, records_per_mb=10, concurrency=5)
+
+    assert plan['chunk_count'] == 1
+    assert plan['chunk_size'] >= MIN_CHUNK_SIZE
+
+def test_huge_files_use_the_largest_chunk_memory_allows():
+    plan = plan_chunk_size(60 * 1024 * MB, records_per_mb=10, concurrency=5, memory_mb=1024, copies_in_memory=4)
+
+    assert plan['chunk_size'] <= 128 * MB
+    assert plan['chunk_size'] > 120 * MB
+    assert plan['chunk_count'] % 5 == 0
+
+def test_dense_records_give_smaller_chunks():
+    sparse = plan_chunk_size(60 * 1024 * MB, records_per_mb=10, memory_mb=1024, timeout_seconds=60,
+                             copies_in_memory=4)
+    dense = plan_chunk_size(60 * 1024 * MB, records_per_mb=20000, memory_mb=1024, timeout_seconds=60,
+                            copies_in_memory=4)
+
+    assert dense['chunk_size'] < sparse['chunk_size']
+    assert dense['time_limit'] < dense['memory_limit']
+
+def test_sample_counts_records_in_the_middle_of_the_file(ranged_s3):
+    records = [{'id': i, 'name': f'Recipe {i}', 'tags': ['a', 'b']} for i in range(20000)]
+    data = json.dumps({'name': 'Large Test Recipe', 'variations': records}).encode()
+    s3 = ranged_s3(data)
+
+    records_per_mb = sample_records_per_mb(s3, 'test-bucket', 'uploads/test.json', len(data), sample_size=64 * 1024)
+
+    expected = len(records) * MB / len(data)
+    assert abs(records_per_mb - expected) / expected < 0.05
@@ -0,0 +1,83 @@
+import json
+import struct
+import pytest
+from columnar import MAGIC, ColumnarFile, ColumnarWriter, encode_records
+
+def recipe(n):
+    return {
+        'variation_id': n,
+        'name': f'Recipe Variation {n}',
+        'ingredients': [
+            {'item': f'Ingredient {i}', 'amount': i * 1.5, 'unit': 'grams', 'notes': 'x' * 200}
+            for i in range(5)
+        ],
+        'instructions': [
+            {'step': i, 'description': 'Stir well', 'timing': 10 * i, 'temperature': 180}
+            for i in range(3)
+        ],
+    }
+
+RECIPES = [recipe(n) for n in range(20)]
+
+def test_recipes_round_trip():
+    assert ColumnarFile(encode_records(RECIPES)).records() == RECIPES
+
+def test_encoding_is_much_smaller_than_json():
+    assert len(encode_records(RECIPES)) * 10 < len(json.dumps(RECIPES))
+
+def test_nested_column_is_read_without_building_records():
+    columns = ColumnarFile(encode_records(RECIPES))
+
+    amounts = columns.column('ingredients.amount')
+    assert len(columns) == 20
+    assert len(amounts) == 100
+    assert list(amounts[:5]) == [0.0, 1.5, 3.0, 4.5, 6.0]
+    assert columns.column('name')[3] == 'Recipe Variation 3'
+
+def test_irregular_records_round_trip():
+    records = [
+        {'id': 1, 'value': 2.5, 'tags': ['a', 'b'], 'extra': {'deep': [1, {'x': None}]}},
+        {'value': 'not a number', 'id': 2 ** 70, 'flag': True},
+        {'id': None, 'items': [], 'text': 'café \U0001f373'},
+        {'items': [{'a': 1}, {'b': 'two'}], 'tags': 'plain'},
+        {},
+    ]
+
+    assert ColumnarFile(encode_records(records)).records() == records
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError, match='Not a columnar'):
+        ColumnarFile(b'[{"id": 1}]')
+
+def test_all_null_column_round_trips():
+    records = [{'a': 1, 't': None}, {'a': 2, 't': None}]
+
+    columns = ColumnarFile(encode_records(records))
+    assert columns.records() == records
+    assert columns.column('t') == []
+
+def test_blobs_are_written_one_at_a_time():
+    writer = ColumnarWriter()
+    for record in RECIPES:
+        writer.add(record)
+    writes = []
+
+    class Recorder:
+        def write(self, data):
+            writes.append(bytes(data))
+
+    size = writer.write_to(Recorder())
+
+    assert b''.join(writes) == writer.to_bytes()
+    assert size == sum(map(len, writes))
+    assert len(writes) > 10
+
+def test_reads_uncompressed_version_1_files():
+    header = json.dumps({
+        'version': 1,
+        'strings': {'count': 1, 'lengths': [0, 1, 'B'], 'data': [1, 4]},
+        'table': {'rows': 1, 'columns': [{'name': 'name', 'kind': 'str', 'values': [5, 1, 'B']}]},
+    }).encode()
+    data = MAGIC + struct.pack('<I', len(header)) + header + b'\x04Soup\x00'
+
+    assert ColumnarFile(data).records() == [{'name': 'Soup'}]
@@ -0,0 +1,50 @@
+import io
+import pytest
+from json_scan import iter_stream_objects
+from generate_large_recipe import SHAPES, parse_size, write_recipe_file
+
+# What comes before the records in each shape
+RECORDS_AFTER = {'object': b'"variations": [', 'array': b'', 'ndjson': b'', 'concatenated': b''}
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_writes_exactly_the_size_in_every_shape(tmp_path, shape):
+    path = tmp_path / 'recipe.json'
+
+    written = write_recipe_file(path, 200 * 1024, shape, seed=1, record_size=4096, non_ascii=0.5)
+
+    data = path.read_bytes()
+    assert len(data) == written['size'] == 200 * 1024
+    start = data.index(RECORDS_AFTER[shape]) + len(RECORDS_AFTER[shape])
+    records = list(iter_stream_objects(io.BytesIO(data[start:])))
+    assert [record['id'] for record in records] == list(range(written['records']))
+    assert len(data.decode('utf-8')) < len(data)
+
+def test_same_seed_gives_the_same_bytes(tmp_path):
+    paths = [tmp_path / name for name in ('a.json', 'b.json', 'c.json')]
+    for path, seed in zip(paths, (7, 7, 8)):
+        write_recipe_file(path, 64 * 1024, 'ndjson', seed=seed, record_size=2048, malformed=0.2)
+
+    assert paths[0].read_bytes() == paths[1].read_bytes()
+    assert paths[0].read_bytes() != paths[2].read_bytes()
+
+def test_malformed_regions_are_reported(tmp_path):
+    path = tmp_path / 'recipe.json'
+
+    written = write_recipe_file(path, 256 * 1024, 'array', seed=3, record_size=2048, malformed=0.3)
+
+    data = path.read_bytes()
+    assert written['malformed']
+    # Cutting the regions out leaves a valid file with every record
+    clean = bytearray(data)
+    for offset, length in reversed(written['malformed']):
+        del clean[offset - 2:offset + length]
+    records = list(iter_stream_objects(io.BytesIO(bytes(clean))))
+    assert [record['id'] for record in records] == list(range(written['records']))
+
+def test_parse_size():
+    assert parse_size('5000') == 5000
+    assert parse_size('64KB') == 64 * 1024
+    assert parse_size('1.5GB') == 1536 * 1024 * 1024
+    assert parse_size('2gib') == 2 * 1024 ** 3
+    with pytest.raises(ValueError):
+        parse_size('lots')
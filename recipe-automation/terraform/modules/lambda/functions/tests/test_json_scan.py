@@ -0,0 +1,116 @@
+import io
+import json
+import pytest
+from json_scan import extract_json_objects, iter_stream_objects
+from benchmarks.bench_extract_json_objects import legacy_extract_json_objects
+from generate_large_recipe import SHAPES, write_recipe_file
+
+@pytest.fixture
+def malformed_file(tmp_path):
+    """Generated records with broken regions between them, of a given shape and seed"""
+    def factory(shape, seed):
+        path = tmp_path / f'{shape}-{seed}.json'
+        write_recipe_file(path, 256 * 1024, shape, seed, record_size=2048, non_ascii=0.5, malformed=0.2)
+        return path.read_bytes()
+    return factory
+
+@pytest.fixture
+def wrapped_records():
+    records = [
+        {'id': i, 'notes': 'caf\u00e9 "quoted" \\ {braces}', 'ingredients': [{'item': f'ingredient_{j}'} for j in range(3)]}
+        for i in range(20)
+    ]
+    return records, json.dumps({'name': 'Large Test Recipe', 'variations': records}, ensure_ascii=False).encode()
+
+def test_whole_document_is_one_object():
+    text = json.dumps({'recipes': [{'name': 'Test Recipe'}, {'name': 'Other'}]})
+
+    assert extract_json_objects(text) == [json.loads(text)]
+
+def test_truncated_wrapper_yields_complete_records():
+    records = [{'id': i, 'ingredients': [{'item': f'ingredient_{j}'} for j in range(3)]} for i in range(5)]
+    text = json.dumps({'name': 'Large Test Recipe', 'variations': records})
+    # Cut inside the last record, as a byte range would
+    text = text[:text.index('{"id": 4') + 55]
+
+    assert extract_json_objects(text) == records[:4] + [{'item': 'ingredient_0'}]
+
+def test_braces_inside_strings_are_ignored():
+    text = '{"notes": "a } b { c"} {"notes": "\\"}{\\""}'
+
+    assert extract_json_objects(text) == [{'notes': 'a } b { c'}, {'notes': '"}{"'}]
+
+def test_malformed_region_is_skipped():
+    text = '{"id": 1} {"id": [2} {"id": 3}'
+
+    assert extract_json_objects(text) == [{'id': 1}, {'id': 3}]
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('seed', range(4))
+def test_malformed_input_recovers_what_the_original_scan_did(malformed_file, shape, seed):
+    text = malformed_file(shape, seed).decode('utf-8', 'replace')
+
+    # Whole files and ranges cut anywhere, as chunks are
+    for start, end in [(0, len(text)), (len(text) // 3, len(text) // 2), (1000 * seed + 7, len(text) - 5)]:
+        assert extract_json_objects(text[start:end]) == legacy_extract_json_objects(text[start:end])
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 64, 4096])
+def test_stream_matches_in_memory_scan(wrapped_records, buffer_size):
+    records, data = wrapped_records
+
+    streamed = list(iter_stream_objects(io.BytesIO(data), buffer_size=buffer_size))
+
+    assert streamed == extract_json_objects(data.decode('utf-8'))
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('buffer_size', [1, 100, 4096])
+def test_stream_matches_in_memory_scan_on_malformed_input(malformed_file, shape, buffer_size):
+    data = malformed_file(shape, 5)
+
+    streamed = list(iter_stream_objects(io.BytesIO(data), buffer_size=buffer_size))
+
+    assert streamed == extract_json_objects(data.decode('utf-8', 'replace'))
+
+def test_stream_resyncs_after_a_record_that_never_closes():
+    records = [{'id': i, 'notes': 'x' * 50} for i in range(1, 200)]
+    # The cut string closes on the next record's first quote, so string
+    # state stays flipped from there on
+    data = b'{"id": 0, "notes": "cut\n' + b'\n'.join(json.dumps(record).encode() for record in records)
+    stream = io.BytesIO(data)
+
+    objects = iter_stream_objects(stream, buffer_size=64)
+
+    assert next(objects) == records[0]
+    # The broken record was given up on well before the end of the stream
+    assert stream.tell() < 1024
+    assert list(objects) == records[1:]
+
+def test_stray_quote_between_records_hides_nothing():
+    data = b'{"id": 1} "}[ {"id": 2} ]" {"id": 3}'
+
+    assert list(iter_stream_objects(io.BytesIO(data), buffer_size=4)) == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 64, 4096])
+def test_stream_yields_records_of_a_wrapper_array(wrapped_records, buffer_size):
+    records, data = wrapped_records
+    # A first chunk from the start of the array to inside record 10
+    data = data[data.index(b'[') + 1:data.index(b'{"id": 10') + 30]
+
+    streamed = list(iter_stream_objects(io.BytesIO(data), buffer_size=buffer_size))
+
+    assert streamed == records[:10]
+
+@pytest.mark.parametrize('buffer_size', [1, 3, 4096])
+def test_range_ending_inside_a_character(buffer_size):
+    data = '{"name": "crème brûlée"} {"name": "crêpe"}'.encode('utf-8')
+    # Stop between the two bytes of the final "ê"
+    data = data[:data.rindex('ê'.encode('utf-8')) + 1]
+
+    streamed = list(iter_stream_objects(io.BytesIO(data), buffer_size=buffer_size))
+
+    assert streamed == [{'name': 'crème brûlée'}]
+
+def test_invalid_utf8_only_drops_its_record():
+    data = b'{"id": 1} {"id": "\xff"} {"id": 3}'
+
+    assert list(iter_stream_objects(io.BytesIO(data))) == [{'id': 1}, {'id': 3}]
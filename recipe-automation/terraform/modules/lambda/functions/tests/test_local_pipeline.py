@@ -0,0 +1,99 @@
+import hashlib
+import json
+import zipfile
+import pytest
+from archive_index import ArchiveRecordReader
+from local_pipeline import LocalS3, run_pipeline
+from merge_results.src import index as merge_results
+from split_file.src import index as split_file
+
+def write_upload(tmp_path, records=60):
+    data = json.dumps({
+        'name': 'Local Recipe',
+        'variations': [{'id': i, 'notes': 'x' * 200} for i in range(records)]
+    }).encode()
+    source = tmp_path / 'recipe.json'
+    source.write_bytes(data)
+    root = tmp_path / 's3'
+    # The tests read records back through the archive's index
+    LocalS3(root).upload_file(str(source), 'recipes', 'uploads/recipe.json',
+                              ExtraArgs={'Metadata': {'record-index': 'true'}})
+    return root, data
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Split uploads into several chunks and merge them two at a time"""
+    monkeypatch.setattr(split_file, 'DIRECT_PROCESSING_MAX_BYTES', 0)
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 512)
+    monkeypatch.setattr(split_file, 'plan_chunk_size', lambda *args, **kwargs: {'chunk_size': 2048})
+    monkeypatch.setattr(merge_results, 'MERGE_FAN_IN', 2)
+
+def test_runs_chunks_and_tree_merge_across_processes(tmp_path, small_chunks):
+    root, data = write_upload(tmp_path)
+
+    result = run_pipeline(root, 'recipes', 'uploads/recipe.json', workers=2, quiet=True)
+
+    assert result['output'] == 's3://recipes/processed/recipe_processed.zip'
+    assert result['chunks'] > 2
+    assert result['records'] == 60
+    assert set(result['stages']) == {'split', 'process', 'merge'}
+    assert all(stage['peak_rss'] > 0 for stage in result['stages'].values())
+    with zipfile.ZipFile(LocalS3(root).path('recipes', 'processed/recipe_processed.zip')) as archive:
+        summary = json.loads(archive.read('summary.json'))
+    assert summary['processing']['total_chunks'] == result['chunks']
+    reader = ArchiveRecordReader(LocalS3(root), 'recipes', 'processed/recipe_processed.zip')
+    assert [reader.get(i)['id'] for i in range(len(reader))] == list(range(60))
+
+def test_small_uploads_finish_in_split_file(tmp_path):
+    root, _ = write_upload(tmp_path, records=5)
+
+    result = run_pipeline(root, 'recipes', 'uploads/recipe.json', workers=1, quiet=True)
+
+    assert result['chunks'] == 1
+    assert result['records'] == 5
+    assert list(result['stages']) == ['split']
+    assert (tmp_path / 's3' / 'recipes' / 'processed' / 'recipe_processed.zip').exists()
+
+def read_records(root):
+    reader = ArchiveRecordReader(LocalS3(root), 'recipes', 'processed/recipe_processed.zip')
+    return [reader.get(i) for i in range(len(reader))]
+
+def test_direct_and_split_uploads_give_the_same_records(tmp_path, monkeypatch):
+    (tmp_path / 'direct').mkdir()
+    (tmp_path / 'split').mkdir()
+    direct_root, data = write_upload(tmp_path / 'direct')
+    direct = run_pipeline(direct_root, 'recipes', 'uploads/recipe.json', workers=1, quiet=True)
+
+    monkeypatch.setattr(split_file, 'DIRECT_PROCESSING_MAX_BYTES', 0)
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 512)
+    monkeypatch.setattr(split_file, 'plan_chunk_size', lambda *args, **kwargs: {'chunk_size': 2048})
+    split_root, _ = write_upload(tmp_path / 'split')
+    split = run_pipeline(split_root, 'recipes', 'uploads/recipe.json', workers=1, quiet=True)
+
+    assert direct['chunks'] == 1
+    assert split['chunks'] > 1
+    # The records of the wrapper, not the wrapper as one record
+    assert read_records(direct_root) == json.loads(data)['variations']
+    assert read_records(split_root) == read_records(direct_root)
+
+def test_local_s3_multipart_copy_and_etags(tmp_path):
+    s3 = LocalS3(tmp_path)
+    s3.put_object(Bucket='b', Key='a.bin', Body=b'0123456789', Metadata={'compression': 'lzma'})
+    upload_id = s3.create_multipart_upload(Bucket='b', Key='joined.bin', ContentType='application/zip')['UploadId']
+    first = s3.upload_part(Bucket='b', Key='joined.bin', UploadId=upload_id, PartNumber=1, Body=b'head-')
+    second = s3.upload_part_copy(Bucket='b', Key='joined.bin', UploadId=upload_id, PartNumber=2,
+                                 CopySource={'Bucket': 'b', 'Key': 'a.bin'}, CopySourceRange='bytes=2-5')
+    s3.complete_multipart_upload(Bucket='b', Key='joined.bin', UploadId=upload_id, MultipartUpload={'Parts': [
+        {'PartNumber': 1, 'ETag': first['ETag']},
+        {'PartNumber': 2, 'ETag': second['CopyPartResult']['ETag']},
+    ]})
+
+    assert s3.get_object(Bucket='b', Key='joined.bin')['Body'].read() == b'head-2345'
+    assert s3.get_object(Bucket='b', Key='a.bin', Range='bytes=8-9')['Body'].read() == b'89'
+    assert s3.head_object(Bucket='b', Key='a.bin')['ETag'] == f'"{hashlib.md5(b"0123456789").hexdigest()}"'
+    assert s3.head_object(Bucket='b', Key='a.bin')['Metadata'] == {'compression': 'lzma'}
+    head = s3.head_object(Bucket='b', Key='joined.bin')
+    assert head['ContentLength'] == 9
+    assert head['ContentType'] == 'application/zip'
+    assert head['ETag'].endswith('-2"')
+    assert not (tmp_path / '.multipart' / upload_id).exists()
@@ -0,0 +1,269 @@
+import functools
+import io
+import json
+import zipfile
+import pytest
+from unittest.mock import MagicMock, patch
+import chunk_merging
+import s3_io
+from archive_index import ArchiveRecordReader
+from columnar import ColumnarFile, encode_records
+from record_formats import write_records
+from zip_stream import ZipStreamWriter
+from merge_results.src.index import lambda_handler
+
+@pytest.fixture
+def mock_s3():
+    with patch('boto3.client') as mock_client:
+        s3 = MagicMock()
+        mock_client.return_value = s3
+        yield s3
+
+def chunk_results(output_format, extension):
+    return [
+        {
+            'chunk_number': n,
+            'bucket': 'test-bucket',
+            'data_key': f'processed/data/test-recipe_chunk_{n}_data{extension}',
+            'output_format': output_format,
+            'original_key': 'uploads/test-recipe.json',
+            'objects_found': 2
+        }
+        for n in (1, 0)
+    ]
+
+def serve(mock_s3, files):
+    mock_s3.head_object.return_value = {'ContentLength': 1024}
+    mock_s3.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(files[Key])}
+
+def written_zip(mock_s3):
+    return zipfile.ZipFile(io.BytesIO(mock_s3.put_object.call_args.kwargs['Body']))
+
+def test_json_chunks_get_their_own_entries(mock_s3):
+    serve(mock_s3, {
+        'processed/data/test-recipe_chunk_0_data.json': b'[{"id": 0}, {"id": 1}]',
+        'processed/data/test-recipe_chunk_1_data.json': b'[{"id": 2}, {"id": 3}]',
+    })
+
+    response = lambda_handler(chunk_results('json', '.json'), None)
+
+    assert response['output'] == 's3://test-bucket/processed/test-recipe_processed.zip'
+    archive = written_zip(mock_s3)
+    assert archive.namelist() == ['summary.json', 'chunk_000.json', 'chunk_001.json']
+    assert json.loads(archive.read('chunk_001.json')) == [{'id': 2}, {'id': 3}]
+
+def test_jsonl_chunks_are_concatenated_in_order(mock_s3):
+    serve(mock_s3, {
+        'processed/data/test-recipe_chunk_0_data.jsonl': b'{"id": 0}\n{"id": 1}\n',
+        'processed/data/test-recipe_chunk_1_data.jsonl': b'{"id": 2}\n{"id": 3}\n',
+    })
+
+    lambda_handler(chunk_results('jsonl', '.jsonl'), None)
+
+    archive = written_zip(mock_s3)
+    assert archive.namelist() == ['summary.json', 'records.jsonl']
+    assert archive.read('records.jsonl') == b'{"id": 0}\n{"id": 1}\n{"id": 2}\n{"id": 3}\n'
+    assert json.loads(archive.read('summary.json'))['processing']['output_format'] == 'jsonl'
+
+def test_columnar_chunks_get_their_own_entries(mock_s3):
+    serve(mock_s3, {
+        'processed/data/test-recipe_chunk_0_data.rcol': encode_records([{'id': 0}, {'id': 1}]),
+        'processed/data/test-recipe_chunk_1_data.rcol': encode_records([{'id': 2}, {'id': 3}]),
+    })
+
+    lambda_handler(chunk_results('columnar', '.rcol'), None)
+
+    archive = written_zip(mock_s3)
+    assert archive.namelist() == ['summary.json', 'chunk_000.rcol', 'chunk_001.rcol']
+    assert ColumnarFile(archive.read('chunk_001.rcol')).records() == [{'id': 2}, {'id': 3}]
+
+def test_large_archive_is_streamed_in_parts(mock_s3, monkeypatch):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 1)
+    monkeypatch.setattr(chunk_merging, 'MultipartUploadWriter',
+                        functools.partial(s3_io.MultipartUploadWriter, part_size=64))
+    mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    mock_s3.upload_part.side_effect = lambda **kwargs: {'ETag': f'etag-{kwargs["PartNumber"]}'}
+    chunk_data = {
+        f'processed/data/test-recipe_chunk_{n}_data.jsonl': b''.join(
+            b'{"id": %d}\n' % i for i in range(n * 100, n * 100 + 100))
+        for n in (0, 1)
+    }
+    serve(mock_s3, chunk_data)
+
+    lambda_handler(chunk_results('jsonl', '.jsonl'), None)
+
+    mock_s3.put_object.assert_not_called()
+    bodies = {c.kwargs['PartNumber']: c.kwargs['Body'] for c in mock_s3.upload_part.call_args_list}
+    assert len(bodies) > 1
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(bodies[n] for n in sorted(bodies))))
+    assert archive.testzip() is None
+    assert archive.read('records.jsonl') == b''.join(chunk_data[k] for k in sorted(chunk_data))
+    mock_s3.complete_multipart_upload.assert_called_once()
+
+# Only the trailing extension is replaced, not one in a directory name
+@pytest.mark.parametrize('directory', ['', 'a.jsonl/'])
+def test_concat_mode_assembles_jsonl_without_a_zip(mock_s3, directory):
+    serve(mock_s3, {})
+    results = chunk_results('jsonl', '.jsonl')
+    for chunk in results:
+        chunk['merge_mode'] = 'concat'
+        chunk['data_size'] = 20
+        chunk['original_key'] = f'uploads/{directory}test-recipe.json'
+
+    with patch.object(chunk_merging, 'concatenate_objects', return_value=40) as concatenate:
+        response = lambda_handler(results, None)
+
+    assert response['output'] == f's3://test-bucket/processed/{directory}test-recipe_processed.jsonl'
+    assert concatenate.call_args.args[2] == [
+        ('processed/data/test-recipe_chunk_0_data.jsonl', 20),
+        ('processed/data/test-recipe_chunk_1_data.jsonl', 20),
+    ]
+    summary = mock_s3.put_object.call_args.kwargs
+    assert summary['Key'] == f'processed/{directory}test-recipe_processed_summary.json'
+    assert json.loads(summary['Body'])['processing']['merge_mode'] == 'concat'
+
+def test_concat_mode_needs_jsonl(mock_s3):
+    results = chunk_results('json', '.json')
+    for chunk in results:
+        chunk['merge_mode'] = 'concat'
+
+    with pytest.raises(ValueError, match="needs the jsonl output format"):
+        lambda_handler(results, None)
+
+def test_compression_comes_from_the_chunk_results(mock_s3):
+    serve(mock_s3, {
+        'processed/data/test-recipe_chunk_0_data.json': b'[{"id": 0}]',
+        'processed/data/test-recipe_chunk_1_data.json': b'[{"id": 1}]',
+    })
+    results = chunk_results('json', '.json')
+    for chunk in results:
+        chunk['compression'] = 'bzip2:9'
+
+    lambda_handler(results, None)
+
+    archive = written_zip(mock_s3)
+    assert archive.getinfo('chunk_001.json').compress_type == zipfile.ZIP_BZIP2
+    assert json.loads(archive.read('summary.json'))['processing']['compression'] == 'bzip2:9'
+
+def run_tree_merge(results, fan_in):
+    """Drive the merge steps the way the state machine does"""
+    items = results
+    plans = []
+    while True:
+        plan = lambda_handler({'action': 'plan', 'items': items, 'fan_in': fan_in}, None)
+        plans.append(plan)
+        if plan['final']:
+            return dict(lambda_handler({'action': 'finalize', 'items': plan['items']}, None), plans=plans)
+        items = [lambda_handler({'action': 'merge_group', 'items': group}, None) for group in plan['groups']]
+
+@pytest.mark.parametrize('output_format, extension', [('json', '.json'), ('jsonl', '.jsonl')])
+def test_tree_merge_matches_a_one_step_merge(monkeypatch, memory_s3, output_format, extension):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 64)
+    chunk_data = {
+        f'processed/data/test-recipe_chunk_{n}_data{extension}':
+            (json.dumps([{'id': n}]) if output_format == 'json' else '{"id": %d}\n' % n).encode() * 20
+        for n in range(7)
+    }
+    store = memory_s3(chunk_data)
+    results = [
+        dict(chunk_results(output_format, extension)[0], chunk_number=n,
+             data_key=f'processed/data/test-recipe_chunk_{n}_data{extension}')
+        for n in range(7)
+    ]
+
+    with patch('boto3.client', return_value=store):
+        response = run_tree_merge(results, fan_in=2)
+
+    assert response['output'] == 's3://test-bucket/processed/test-recipe_processed.zip'
+    # Levels above the first are joined by S3, and every part is cleaned up
+    assert store.copied
+    assert sorted(store.objects) == sorted(chunk_data) + ['processed/test-recipe_processed.zip']
+
+    archive = zipfile.ZipFile(io.BytesIO(store.objects['processed/test-recipe_processed.zip']))
+    assert archive.testzip() is None
+    summary = json.loads(archive.read('summary.json'))
+    assert [c['chunk_number'] for c in summary['chunks']] == list(range(7))
+    assert summary['processing']['total_objects'] == 14
+    names = archive.namelist()
+    assert names[0] == 'summary.json'
+    assert b''.join(archive.read(name) for name in names[1:]) == b''.join(
+        chunk_data[f'processed/data/test-recipe_chunk_{n}_data{extension}'] for n in range(7))
+    if output_format == 'json':
+        assert names[1:] == [f'chunk_{n:03d}.json' for n in range(7)]
+
+def test_few_chunks_are_merged_in_one_step(mock_s3):
+    results = chunk_results('json', '.json')
+
+    plan = lambda_handler({'action': 'plan', 'items': results, 'fan_in': 2}, None)
+
+    assert plan == {'final': True, 'items': sorted(results, key=lambda c: c['chunk_number'])}
+
+@pytest.mark.parametrize('output_format, extension', [('json', '.json'), ('jsonl', '.jsonl')])
+@pytest.mark.parametrize('fan_in', [32, 2])
+def test_index_fetches_single_records(monkeypatch, memory_s3, output_format, extension, fan_in):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 64)
+    monkeypatch.setattr(chunk_merging, 'ZipStreamWriter', functools.partial(ZipStreamWriter, block_size=256))
+    objects = {}
+    results = []
+    for n in range(5):
+        data_key = f'processed/data/test-recipe_chunk_{n}_data{extension}'
+        spans_key = f'processed/data/test-recipe_chunk_{n}_data_spans.json'
+        data = io.BytesIO()
+        spans = []
+        write_records(data, [{'id': f'r{n}-{i}', 'name': f'Recipe {i}' * 5} for i in range(10)], output_format, spans)
+        objects[data_key] = data.getvalue()
+        objects[spans_key] = json.dumps(spans).encode()
+        results.append(dict(chunk_results(output_format, extension)[0], chunk_number=n,
+                            data_key=data_key, spans_key=spans_key, record_index=True))
+    store = memory_s3(objects)
+
+    with patch('boto3.client', return_value=store):
+        run_tree_merge(results, fan_in)
+
+    zip_key = 'processed/test-recipe_processed.zip'
+    archive = zipfile.ZipFile(io.BytesIO(store.objects[zip_key]))
+    assert archive.testzip() is None
+    assert archive.namelist()[0] == 'summary.json'
+    assert archive.namelist()[-1] == 'index.json'
+
+    reader = ArchiveRecordReader(store, 'test-bucket', zip_key)
+    assert len(reader) == 50
+    assert reader.get(record_id='r3-7') == {'id': 'r3-7', 'name': 'Recipe 7' * 5}
+    assert reader.get(ordinal=49)['id'] == 'r4-9'
+    assert [reader.get(ordinal=n)['id'] for n in range(50)] == [f'r{n}-{i}' for n in range(5) for i in range(10)]
+
+def test_tree_merge_reads_distributed_map_results(monkeypatch, memory_s3):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 64)
+    chunk_data = {
+        f'processed/data/test-recipe_chunk_{n}_data.json': json.dumps([{'id': n}] * 20).encode()
+        for n in range(7)
+    }
+    results = [
+        dict(chunk_results('json', '.json')[0], chunk_number=n,
+             data_key=f'processed/data/test-recipe_chunk_{n}_data.json')
+        for n in range(7)
+    ]
+    # What a distributed Map's ResultWriter leaves behind, in no particular order
+    objects = dict(chunk_data)
+    objects['processed/map-results/run/manifest.json'] = json.dumps({'ResultFiles': {'SUCCEEDED': [
+        {'Key': 'processed/map-results/run/SUCCEEDED_0.json'},
+        {'Key': 'processed/map-results/run/SUCCEEDED_1.json'},
+    ]}}).encode()
+    for i, part in enumerate((results[4:], results[:4])):
+        objects[f'processed/map-results/run/SUCCEEDED_{i}.json'] = json.dumps([
+            {'Input': '{}', 'Output': json.dumps(result), 'Status': 'SUCCEEDED'} for result in part
+        ]).encode()
+    store = memory_s3(objects)
+    reference = {'bucket': 'test-bucket', 'map_results_key': 'processed/map-results/run/manifest.json'}
+
+    with patch('boto3.client', return_value=store):
+        response = run_tree_merge(reference, fan_in=2)
+
+    # Chunk results stay in S3: the first plan only holds slices of them
+    first_plan = response['plans'][0]
+    assert first_plan['groups'][0] == {
+        'bucket': 'test-bucket', 'key': 'processed/manifests/test-recipe_chunk_results.json', 'start': 0, 'stop': 2
+    }
+    archive = zipfile.ZipFile(io.BytesIO(store.objects['processed/test-recipe_processed.zip']))
+    assert archive.namelist() == ['summary.json'] + [f'chunk_{n:03d}.json' for n in range(7)]
+    assert json.loads(archive.read('chunk_006.json')) == [{'id': 6}] * 20
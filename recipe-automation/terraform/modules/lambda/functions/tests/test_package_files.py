@@ -0,0 +1,19 @@
+import os
+from package_files import shared_modules
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def names(func):
+    handler = os.path.join(FUNCTIONS_DIR, func, 'src', 'index.py')
+    return [os.path.basename(path) for path in shared_modules(handler)]
+
+def test_follows_shared_imports_transitively():
+    modules = names('process_chunk')
+
+    assert 's3_io.py' in modules
+    # Imported lazily by record_formats, still needed in the zip
+    assert 'columnar.py' in modules
+    assert 'json_scan.py' in modules
+
+def test_leaves_out_unused_shared_modules():
+    assert names('archive_creator') == ['aws_clients.py']
@@ -0,0 +1,51 @@
+import json
+from unittest.mock import patch
+from process_chunk.src.index import lambda_handler
+
+def test_chunk_records_written_to_data_file(ranged_s3):
+    records = [{'id': i, 'name': f'Recipe {i}'} for i in range(5)]
+    data = json.dumps({'name': 'Large Test Recipe', 'variations': records}).encode()
+    s3 = ranged_s3(data)
+    event = {
+        'bucket': 'test-bucket',
+        'key': 'uploads/test-recipe.json',
+        'chunk_number': 0,
+        'start_byte': data.index(b'['),
+        'end_byte': data.rindex(b']'),
+        'record_index': True,
+        'total_chunks': 1
+    }
+
+    with patch('boto3.client', return_value=s3):
+        response = lambda_handler(event, None)
+
+    assert response['objects_found'] == 5
+    assert response['data_key'] == 'processed/data/test-recipe_chunk_0_data.json'
+    puts = {c.kwargs['Key']: c.kwargs['Body'] for c in s3.put_object.call_args_list}
+    body = puts['processed/data/test-recipe_chunk_0_data.json']
+    assert json.loads(body) == records
+
+    # Each record's span in the data file, for the archive index
+    assert response['spans_key'] == 'processed/data/test-recipe_chunk_0_data_spans.json'
+    spans = json.loads(puts[response['spans_key']])
+    assert [record_id for _, _, record_id in spans] == list(range(5))
+    assert [json.loads(body[o:o + n]) for o, n, _ in spans] == records
+
+def test_spans_are_only_written_for_a_record_index(ranged_s3):
+    data = json.dumps([{'id': i} for i in range(5)]).encode()
+    s3 = ranged_s3(data)
+    event = {
+        'bucket': 'test-bucket',
+        'key': 'uploads/test-recipe.json',
+        'chunk_number': 0,
+        'start_byte': 0,
+        'end_byte': len(data) - 1,
+        'total_chunks': 1
+    }
+
+    with patch('boto3.client', return_value=s3):
+        response = lambda_handler(event, None)
+
+    assert response['objects_found'] == 5
+    assert response['spans_key'] is None
+    assert [c.kwargs['Key'] for c in s3.put_object.call_args_list] == ['processed/data/test-recipe_chunk_0_data.json']
@@ -0,0 +1,39 @@
+import io
+import json
+import pytest
+from record_formats import file_extension, iter_records, validate_record_index, write_records
+
+RECORDS = [{'id': i, 'name': f'Recipe {i}', 'notes': 'line one\nline two'} for i in range(3)]
+
+def test_json_matches_dumps():
+    out = io.BytesIO()
+
+    assert write_records(out, iter(RECORDS), 'json') == 3
+    assert out.getvalue() == json.dumps(RECORDS).encode()
+
+def test_jsonl_writes_one_record_per_line():
+    out = io.BytesIO()
+
+    assert write_records(out, iter(RECORDS), 'jsonl') == 3
+    lines = out.getvalue().splitlines()
+    assert [json.loads(line) for line in lines] == RECORDS
+
+@pytest.mark.parametrize('output_format', ['json', 'jsonl', 'columnar'])
+def test_records_round_trip(output_format):
+    out = io.BytesIO()
+    write_records(out, iter(RECORDS), output_format)
+
+    assert list(iter_records(io.BytesIO(out.getvalue()), output_format)) == RECORDS
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError, match='Unsupported output format'):
+        file_extension('xml')
+
+def test_record_index_is_only_built_for_json_zips():
+    assert validate_record_index('true', 'jsonl', 'zip') is True
+    assert validate_record_index('TRUE', 'json', 'zip') is True
+    assert validate_record_index('false', 'json', 'zip') is False
+    assert validate_record_index('true', 'columnar', 'zip') is False
+    assert validate_record_index('true', 'jsonl', 'concat') is False
+    with pytest.raises(ValueError, match='Unsupported record index setting'):
+        validate_record_index('yes', 'json', 'zip')
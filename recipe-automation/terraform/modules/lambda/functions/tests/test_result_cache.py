@@ -0,0 +1,95 @@
+import hashlib
+import json
+from unittest.mock import MagicMock, patch
+import result_cache
+from chunk_processing import process_chunk
+from result_cache import content_hash, output_key
+from split_file.src import index as split_file
+
+def upload_event(key):
+    return {'Records': [{'s3': {'bucket': {'name': 'test-bucket'}, 'object': {'key': key}}}]}
+
+def make_recipe():
+    return json.dumps({'name': 'Cached', 'variations': [{'id': i} for i in range(10)]}).encode()
+
+def test_content_hash_prefers_what_s3_already_knows(monkeypatch, ranged_s3):
+    data = b'{"id": 1}'
+    s3 = ranged_s3(data)
+
+    full = {'ContentLength': 9, 'ChecksumSHA256': 'abc=', 'ChecksumType': 'FULL_OBJECT', 'ETag': '"e"'}
+    assert content_hash(s3, 'b', 'k', full) == 'sha256:abc='
+    assert content_hash(s3, 'b', 'k', {'ContentLength': 9, 'ETag': '"0123abcd"'}) == 'md5:0123abcd'
+    s3.get_object.assert_not_called()
+
+    # Multipart and KMS ETags are not the content's MD5, so the bytes are hashed
+    streamed = f'sha256-stream:{hashlib.sha256(data).hexdigest()}'
+    assert content_hash(s3, 'b', 'k', {'ContentLength': 9, 'ETag': '"0123abcd-4"'}) == streamed
+    assert content_hash(s3, 'b', 'k', {'ContentLength': 9, 'ETag': '"0123abcd"',
+                                       'ServerSideEncryption': 'aws:kms'}) == streamed
+
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_HASH_MAX_BYTES', 8)
+    assert content_hash(s3, 'b', 'k', {'ContentLength': 9, 'ETag': '"0123abcd-4"'}) is None
+
+def test_reupload_under_another_key_copies_the_earlier_output(memory_s3):
+    data = make_recipe()
+    s3 = memory_s3({'uploads/first.json': data, 'uploads/again.json': data})
+    s3.start_execution = MagicMock()
+
+    with patch('boto3.client', return_value=s3):
+        first = json.loads(split_file.lambda_handler(upload_event('uploads/first.json'), None)['body'])
+        again = json.loads(split_file.lambda_handler(upload_event('uploads/again.json'), None)['body'])
+
+    assert first['message'] == 'File processed directly'
+    assert again['message'] == 'Reused cached result'
+    assert again['source'] == 'uploads/first.json'
+    assert again['output'] == 's3://test-bucket/processed/again_processed.zip'
+    assert again['objects_found'] == first['objects_found']
+    assert s3.objects['processed/again_processed.zip'] == s3.objects['processed/first_processed.zip']
+    # Nothing was parsed for the second upload
+    assert not any(key.startswith('processed/data/again') for key in s3.objects)
+    s3.start_execution.assert_not_called()
+
+def test_changed_settings_or_missing_output_miss_the_cache(memory_s3):
+    data = make_recipe()
+    s3 = memory_s3({'uploads/first.json': data, 'uploads/again.json': data})
+
+    with patch('boto3.client', return_value=s3):
+        split_file.lambda_handler(upload_event('uploads/first.json'), None)
+        del s3.objects['processed/first_processed.zip']
+        again = json.loads(split_file.lambda_handler(upload_event('uploads/again.json'), None)['body'])
+
+    assert again['message'] == 'File processed directly'
+    assert 'processed/again_processed.zip' in s3.objects
+
+def chunk_item(version):
+    data = make_recipe()
+    return {'bucket': 'test-bucket', 'key': 'uploads/recipe.json', 'chunk_number': 0,
+            'start_byte': data.index(b'['), 'end_byte': data.rindex(b']'), 'source_version': version}
+
+def test_chunk_retry_reuses_the_data_file_without_reading_the_upload(memory_s3):
+    s3 = memory_s3({'uploads/recipe.json': make_recipe()})
+    first = process_chunk(s3, chunk_item('"v1"'))
+
+    # Reading the upload again would fail
+    del s3.objects['uploads/recipe.json']
+    again = process_chunk(s3, chunk_item('"v1"'))
+
+    assert again == first
+    assert first['objects_found'] == 10
+
+def test_chunk_memo_misses_for_a_new_version_or_changed_data_file(memory_s3):
+    s3 = memory_s3({'uploads/recipe.json': make_recipe()})
+    first = process_chunk(s3, chunk_item('"v1"'))
+
+    s3.objects[first['data_key']] = b'overwritten'
+    assert process_chunk(s3, chunk_item('"v1"')) == first
+    assert s3.objects[first['data_key']] != b'overwritten'
+
+    s3.objects['uploads/recipe.json'] = json.dumps({'variations': [{'id': 1}]}).encode()
+    newer = process_chunk(s3, dict(chunk_item('"v2"'), start_byte=0, end_byte=len(s3.objects['uploads/recipe.json']) - 1))
+    assert newer['objects_found'] == 1
+
+def test_output_key_only_replaces_the_prefix_and_extension():
+    assert output_key('uploads/recipe.json', '_processed.zip') == 'processed/recipe_processed.zip'
+    assert output_key('uploads/uploads/a.json/recipe.json', '_processed.jsonl') == \
+        'processed/uploads/a.json/recipe_processed.jsonl'
@@ -0,0 +1,192 @@
+import io
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock
+import s3_io
+from s3_io import MultipartUploadWriter, ParallelRangeReader, concatenate_objects, iter_prefetched
+
+def read_all(reader, size):
+    parts = []
+    while True:
+        data = reader.read(size)
+        if not data:
+            return b''.join(parts)
+        parts.append(data)
+
+@pytest.mark.parametrize('part_size,concurrency', [(1, 1), (7, 3), (64, 8), (10000, 4)])
+def test_sub_ranges_are_returned_in_order(ranged_s3, part_size, concurrency):
+    data = bytes(range(256)) * 4
+    s3 = ranged_s3(data)
+
+    with ParallelRangeReader(s3, 'test-bucket', 'uploads/test.json', 100, 899,
+                             part_size=part_size, concurrency=concurrency) as reader:
+        assert read_all(reader, 13) == data[100:900]
+
+    assert s3.get_object.call_count == -(-800 // part_size)
+
+def test_download_errors_reach_the_reader(ranged_s3):
+    s3 = ranged_s3(b'x' * 100)
+    s3.get_object.side_effect = Exception('Test error')
+
+    with ParallelRangeReader(s3, 'test-bucket', 'uploads/test.json', 0, 99, part_size=10) as reader:
+        with pytest.raises(Exception, match='Test error'):
+            reader.read(10)
+
+@pytest.fixture
+def upload_s3(monkeypatch):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 1)
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    s3.upload_part.side_effect = lambda **kwargs: {'ETag': f'etag-{kwargs["PartNumber"]}'}
+    return s3
+
+def test_small_output_uses_put_object(upload_s3):
+    with MultipartUploadWriter(upload_s3, 'test-bucket', 'processed/out.json', part_size=100) as writer:
+        writer.write(b'[1, 2]')
+
+    upload_s3.put_object.assert_called_once_with(Bucket='test-bucket', Key='processed/out.json', Body=b'[1, 2]')
+    upload_s3.create_multipart_upload.assert_not_called()
+
+def test_parts_are_uploaded_in_order(upload_s3):
+    with MultipartUploadWriter(upload_s3, 'test-bucket', 'processed/out.json', part_size=4) as writer:
+        for i in range(10):
+            writer.write(b'%d,' % i)
+
+    bodies = {c.kwargs['PartNumber']: c.kwargs['Body'] for c in upload_s3.upload_part.call_args_list}
+    assert b''.join(bodies[n] for n in sorted(bodies)) == b'0,1,2,3,4,5,6,7,8,9,'
+    parts = upload_s3.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+    assert parts == [{'PartNumber': n, 'ETag': f'etag-{n}'} for n in range(1, len(bodies) + 1)]
+
+def test_failure_aborts_upload(upload_s3):
+    with pytest.raises(ValueError):
+        with MultipartUploadWriter(upload_s3, 'test-bucket', 'processed/out.json', part_size=4) as writer:
+            writer.write(b'0123456789')
+            raise ValueError('parse failed')
+
+    upload_s3.abort_multipart_upload.assert_called_once_with(
+        Bucket='test-bucket', Key='processed/out.json', UploadId='upload-1')
+    upload_s3.complete_multipart_upload.assert_not_called()
+
+def fail_last_part(**kwargs):
+    if kwargs['PartNumber'] == 2:
+        raise ConnectionError('part failed')
+    return {'ETag': 'etag-1'}
+
+@pytest.mark.parametrize('failing', ['upload_part', 'complete_multipart_upload'])
+def test_failure_in_close_aborts_upload(upload_s3, failing):
+    if failing == 'upload_part':
+        upload_s3.upload_part.side_effect = fail_last_part
+    else:
+        upload_s3.complete_multipart_upload.side_effect = ConnectionError('complete failed')
+    writer = MultipartUploadWriter(upload_s3, 'test-bucket', 'processed/out.json', part_size=4)
+    writer.write(b'0123')
+    # The remainder is only sent by close()
+    writer.write(b'45')
+
+    with pytest.raises(ConnectionError):
+        writer.close()
+
+    upload_s3.abort_multipart_upload.assert_called_once_with(
+        Bucket='test-bucket', Key='processed/out.json', UploadId='upload-1')
+
+def test_prefetch_keeps_order_and_bounds_work_in_flight():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.01 * (5 - n % 5))
+        with lock:
+            running.remove(n)
+        if n == 3:
+            raise ValueError('bad item')
+        return n * 10
+
+    results = []
+    for item, future in iter_prefetched(work, range(10), 3):
+        try:
+            results.append((item, future.result()))
+        except ValueError:
+            results.append((item, None))
+
+    assert results == [(n, None if n == 3 else n * 10) for n in range(10)]
+    assert max(peak) <= 3
+
+class ObjectStore:
+    """Just enough of S3 to assemble multipart uploads in memory"""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.uploads = {}
+        self.copied = []
+        self.downloaded = []
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = (int(x) for x in Range.replace('bytes=', '').split('-'))
+        self.downloaded.append((Key, start, end))
+        return {'Body': io.BytesIO(self.objects[Key][start:end + 1])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.uploads['upload-1'] = {}
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange):
+        start, end = (int(x) for x in CopySourceRange.replace('bytes=', '').split('-'))
+        self.copied.append((CopySource['Key'], start, end))
+        self.uploads[UploadId][PartNumber] = self.objects[CopySource['Key']][start:end + 1]
+        return {'CopyPartResult': {'ETag': f'etag-{PartNumber}'}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+        # Every part but the last must meet the minimum part size
+        assert all(len(parts[n]) >= s3_io.MIN_PART_SIZE for n in numbers[:-1])
+        self.objects[Key] = b''.join(parts[n] for n in numbers)
+
+def test_concatenation_copies_large_sources_server_side(monkeypatch):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 10)
+    sources = {
+        'a': b'A' * 25,   # copied
+        'b': b'B' * 4,    # too small: downloaded
+        'c': b'C' * 30,   # head tops up b, rest copied
+        'd': b'D' * 3,    # small tail: downloaded into the last part
+    }
+    store = ObjectStore(sources)
+
+    total = concatenate_objects(store, 'test-bucket', [(k, len(v)) for k, v in sources.items()], 'out.jsonl')
+
+    assert total == 62
+    assert store.objects['out.jsonl'] == b'A' * 25 + b'B' * 4 + b'C' * 30 + b'D' * 3
+    assert store.copied == [('a', 0, 24), ('c', 6, 29)]
+    assert ('a', 0, 24) not in store.downloaded
+
+def test_small_concatenation_uses_put_object(monkeypatch):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 100)
+    store = ObjectStore({'a': b'{"id": 1}\n', 'b': b'{"id": 2}\n'})
+
+    concatenate_objects(store, 'test-bucket', [('a', 10), ('b', 10)], 'out.jsonl')
+
+    assert store.objects['out.jsonl'] == b'{"id": 1}\n{"id": 2}\n'
+    assert store.copied == []
+
+def test_tail_is_written_after_the_sources(monkeypatch):
+    monkeypatch.setattr(s3_io, 'MIN_PART_SIZE', 10)
+    store = ObjectStore({'a': b'A' * 25})
+
+    total = concatenate_objects(store, 'test-bucket', [('a', 25)], 'out.zip', tail=b'directory')
+
+    assert total == 34
+    assert store.objects['out.zip'] == b'A' * 25 + b'directory'
+    assert store.copied == [('a', 0, 24)]
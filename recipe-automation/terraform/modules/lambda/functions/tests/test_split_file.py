@@ -0,0 +1,189 @@
+import io
+import json
+import zipfile
+import pytest
+from unittest.mock import patch
+from json_scan import iter_stream_objects
+from split_file.src import index as split_file
+from split_file.src.index import find_record_boundary, plan_chunks
+from generate_large_recipe import SHAPES, write_recipe_file
+
+def make_recipe(variations=20):
+    return json.dumps({
+        'name': 'Test Recipe',
+        'variations': [
+            {
+                'id': i,
+                'ingredients': [
+                    {'item': f'ingredient_{j}', 'notes': 'x},{' * 10}
+                    for j in range(5)
+                ]
+            }
+            for i in range(variations)
+        ]
+    }).encode()
+
+def test_boundary_prefers_record_level():
+    data = make_recipe()
+    window = data[len(data) // 2:]
+    offset = find_record_boundary(window)
+
+    # The boundary must open a whole variation, not one of its ingredients
+    assert window[offset:offset + 7] == b'{"id": '
+
+def test_boundary_not_found_without_sibling_objects():
+    assert find_record_boundary(b'"notes": "xxxxxxxxxxxx"') is None
+
+def test_planned_chunks_parse_independently(ranged_s3, monkeypatch):
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 2048)
+    data = make_recipe()
+    s3 = ranged_s3(data)
+
+    ranges = plan_chunks(s3, 'test-bucket', 'uploads/test.json', len(data), chunk_size=1024)
+
+    assert len(ranges) > 1
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data) - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end + 1 == start
+        assert data[start:start + 7] == b'{"id": '
+
+def test_records_span_the_wrapper_array(ranged_s3):
+    data = make_recipe()
+
+    layout = split_file.find_record_layout(ranged_s3(data), 'test-bucket', 'uploads/test.json', len(data))
+    assert layout == (data.index(b'[') + 1, data.rindex(b']'), {b'"id"'})
+
+def test_records_of_concatenated_objects_span_the_file(ranged_s3):
+    data = b'{"id": 1}\n{"id": 2}\n{"id": 3}\n'
+
+    layout = split_file.find_record_layout(ranged_s3(data), 'test-bucket', 'uploads/test.json', len(data))
+    assert layout == (0, len(data), {b'"id"'})
+
+def test_records_end_skips_the_values_after_the_array(ranged_s3, monkeypatch):
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 64)
+    records = [{'id': i, 'notes': 'x' * 100} for i in range(5)]
+    data = json.dumps({
+        'meta': {'author': {'name': 'x'}},
+        'variations': records,
+        'nutrition': [{'cal': 1}],
+        'tail': ['"]', {'id': 9}],
+    }).encode()
+
+    start, end, keys = split_file.find_record_layout(ranged_s3(data), 'test-bucket', 'uploads/test.json', len(data))
+
+    assert list(iter_stream_objects(io.BytesIO(data[start:end]))) == records
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_records_larger_than_the_probe_window(tmp_path, ranged_s3, monkeypatch, shape):
+    # Each probe window only sees the ingredients of one record
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 4096)
+    path = tmp_path / f'{shape}.json'
+    written = write_recipe_file(path, 512 * 1024, shape, seed=3, record_size=40 * 1024)
+    data = path.read_bytes()
+    s3 = ranged_s3(data)
+
+    start, end, keys = split_file.find_record_layout(s3, 'test-bucket', 'uploads/test.json', len(data))
+    ranges = plan_chunks(s3, 'test-bucket', 'uploads/test.json', len(data), 64 * 1024, keys, start, end)
+
+    ids = []
+    for start, end in ranges:
+        records = iter_stream_objects(io.BytesIO(data[start:end + 1]))
+        ids.extend(record['id'] for record in records)
+    assert len(ranges) > 1
+    assert ids == list(range(written['records']))
+
+def test_unknown_record_level_is_not_split(ranged_s3, monkeypatch):
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 64)
+    monkeypatch.setattr(split_file, 'MAX_PROBE_SIZE', 256)
+    # Nothing in the largest probe shows two records side by side
+    data = json.dumps({'id': 0, 'notes': 'x' * 1000}).encode() + b'\n' + json.dumps({'id': 1}).encode()
+
+    layout = split_file.find_record_layout(ranged_s3(data), 'test-bucket', 'uploads/test.json', len(data))
+    assert layout == (0, len(data), None)
+
+def test_chunk_plan_is_written_to_a_manifest(ranged_s3, monkeypatch):
+    monkeypatch.setenv('STEP_FUNCTION_ARN', 'arn:aws:states:us-west-2:123456789012:stateMachine:test')
+    monkeypatch.setattr(split_file, 'PROBE_SIZE', 2048)
+    monkeypatch.setattr(split_file, 'DIRECT_PROCESSING_MAX_BYTES', 0)
+    monkeypatch.setattr(split_file, 'plan_chunk_size', lambda *args, **kwargs: {'chunk_size': 1024})
+    data = make_recipe(200)
+    s3 = ranged_s3(data)
+    s3.head_object.return_value = {'ContentLength': len(data), 'Metadata': {}}
+    s3.start_execution.return_value = {'executionArn': 'arn:execution'}
+    event = {'Records': [{'s3': {'bucket': {'name': 'test-bucket'}, 'object': {'key': 'uploads/test.json'}}}]}
+
+    with patch('boto3.client', return_value=s3):
+        split_file.lambda_handler(event, None)
+
+    manifest = s3.put_object.call_args.kwargs
+    assert manifest['Key'] == 'processed/manifests/test_chunks.json'
+    chunks = json.loads(manifest['Body'])
+    assert len(chunks) > 10
+    assert [chunk['chunk_number'] for chunk in chunks] == list(range(len(chunks)))
+
+    execution_input = json.loads(s3.start_execution.call_args.kwargs['input'])
+    assert 'chunks' not in execution_input
+    assert execution_input['manifest'] == {'bucket': 'test-bucket', 'key': 'processed/manifests/test_chunks.json'}
+    assert execution_input['total_chunks'] == len(chunks)
+
+def test_small_uploads_are_processed_without_the_state_machine(memory_s3):
+    data = make_recipe()
+    s3 = memory_s3({'uploads/test.json': data})
+    event = {'Records': [{'s3': {'bucket': {'name': 'test-bucket'}, 'object': {'key': 'uploads/test.json'}}}]}
+
+    # The store has no start_execution, so starting one would fail
+    with patch('boto3.client', return_value=s3):
+        response = split_file.lambda_handler(event, None)
+
+    body = json.loads(response['body'])
+    assert body['output'] == 's3://test-bucket/processed/test_processed.zip'
+    archive = zipfile.ZipFile(io.BytesIO(s3.objects['processed/test_processed.zip']))
+    assert archive.namelist() == ['summary.json', 'chunk_000.json']
+    # The single chunk still walks through the wrapper to its records
+    assert json.loads(archive.read('chunk_000.json')) == json.loads(data)['variations']
+    # Without a record index no spans are written for it
+    assert not [key for key in s3.objects if key.endswith('_spans.json')]
+
+def test_record_index_metadata_adds_the_index(memory_s3):
+    data = make_recipe()
+    s3 = memory_s3({'uploads/test.json': data})
+    head_object = s3.head_object
+    s3.head_object = lambda **kwargs: dict(head_object(**kwargs), Metadata={'record-index': 'true'})
+    event = {'Records': [{'s3': {'bucket': {'name': 'test-bucket'}, 'object': {'key': 'uploads/test.json'}}}]}
+
+    with patch('boto3.client', return_value=s3):
+        split_file.lambda_handler(event, None)
+
+    archive = zipfile.ZipFile(io.BytesIO(s3.objects['processed/test_processed.zip']))
+    assert archive.namelist() == ['summary.json', 'chunk_000.json', 'index.json']
+
+def process_directly(s3, metadata=None):
+    if metadata:
+        head_object = s3.head_object
+        s3.head_object = lambda **kwargs: dict(head_object(**kwargs), Metadata=metadata)
+    event = {'Records': [{'s3': {'bucket': {'name': 'test-bucket'}, 'object': {'key': 'uploads/test.json'}}}]}
+    with patch('boto3.client', return_value=s3):
+        split_file.lambda_handler(event, None)
+    archive = zipfile.ZipFile(io.BytesIO(s3.objects['processed/test_processed.zip']))
+    return json.loads(archive.read('chunk_000.json'))
+
+def test_a_bare_recipe_is_one_record(memory_s3):
+    recipe = {'name': 'Pancakes', 'ingredients': [{'item': 'flour'}, {'item': 'egg'}], 'instructions': ['mix']}
+    s3 = memory_s3({'uploads/test.json': json.dumps(recipe).encode()})
+
+    assert process_directly(s3) == [recipe]
+
+@pytest.mark.parametrize('count', [1, 2])
+def test_wrapped_recipes_are_the_records_however_many(memory_s3, count):
+    recipes = [{'name': f'Recipe {i}', 'ingredients': [{'item': 'flour'}]} for i in range(count)]
+    s3 = memory_s3({'uploads/test.json': json.dumps({'recipes': recipes}).encode()})
+
+    assert process_directly(s3) == recipes
+
+def test_record_key_metadata_names_the_wrapper_array(memory_s3):
+    # Without the hint "dishes" is not a wrapper key and this is one record
+    dishes = [{'name': 'Soup'}, {'name': 'Bread'}]
+    data = json.dumps({'menu': 'Lunch', 'dishes': dishes}).encode()
+
+    assert process_directly(memory_s3({'uploads/test.json': data}), {'record-key': 'dishes'}) == dishes
@@ -0,0 +1,87 @@
+import io
+import random
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import zip_stream
+from zip_stream import ZIP_STORED, ZipStreamWriter, parse_codec
+
+def sample_data(size):
+    rng = random.Random(7)
+    words = [b'flour', b'sugar', b'"notes": "', b'\xc3\xa9', b'{"id": ', b'123.5']
+    return b' '.join(rng.choice(words) for _ in range(size // 5))
+
+def test_blocks_deflated_in_parallel_form_one_stream():
+    data = sample_data(500_000)
+    out = io.BytesIO()
+
+    with ZipStreamWriter(out, block_size=16 * 1024, executor=ThreadPoolExecutor(4)) as archive:
+        with archive.open('records.json') as entry:
+            for i in range(0, len(data), 10_000):
+                entry.write(data[i:i + 10_000])
+        archive.writestr('summary.json', '{"chunks": 1}')
+
+    zip_file = zipfile.ZipFile(io.BytesIO(out.getvalue()))
+    assert zip_file.testzip() is None
+    assert zip_file.read('records.json') == data
+    assert zip_file.read('summary.json') == b'{"chunks": 1}'
+    # Priming each block with the previous window keeps the ratio close to
+    # deflating the whole entry at once
+    whole = len(zlib.compress(data, 6))
+    assert zip_file.getinfo('records.json').compress_size < whole * 1.05
+
+def test_stored_empty_and_unicode_entries():
+    out = io.BytesIO()
+
+    with ZipStreamWriter(out) as archive:
+        archive.writestr('stored.bin', b'abc' * 10, compress_type=ZIP_STORED)
+        archive.writestr('empty.json', b'')
+        archive.writestr('recettes/crème.json', '[]')
+
+    zip_file = zipfile.ZipFile(io.BytesIO(out.getvalue()))
+    assert zip_file.namelist() == ['stored.bin', 'empty.json', 'recettes/crème.json']
+    assert zip_file.getinfo('stored.bin').compress_type == zipfile.ZIP_STORED
+    assert zip_file.read('stored.bin') == b'abc' * 10
+    assert zip_file.read('empty.json') == b''
+    assert zip_file.read('recettes/crème.json') == b'[]'
+
+def test_zip64_end_records_when_entry_count_overflows(monkeypatch):
+    monkeypatch.setattr(zip_stream, '_ZIP16_LIMIT', 3)
+    out = io.BytesIO()
+
+    with ZipStreamWriter(out) as archive:
+        for n in range(5):
+            archive.writestr(f'chunk_{n:03d}.json', f'[{n}]')
+
+    data = out.getvalue()
+    assert b'\x50\x4b\x06\x06' in data
+    zip_file = zipfile.ZipFile(io.BytesIO(data))
+    assert [zip_file.read(f'chunk_{n:03d}.json') for n in range(5)] == [b'[%d]' % n for n in range(5)]
+
+@pytest.mark.parametrize('codec, method', [
+    ('stored', zipfile.ZIP_STORED),
+    ('deflate:1', zipfile.ZIP_DEFLATED),
+    ('bzip2', zipfile.ZIP_BZIP2),
+    ('lzma:9', zipfile.ZIP_LZMA),
+])
+def test_codecs_round_trip(codec, method):
+    data = sample_data(100_000)
+    out = io.BytesIO()
+
+    with ZipStreamWriter(out, *parse_codec(codec)) as archive:
+        with archive.open('records.jsonl') as entry:
+            for i in range(0, len(data), 7_000):
+                entry.write(data[i:i + 7_000])
+
+    zip_file = zipfile.ZipFile(io.BytesIO(out.getvalue()))
+    assert zip_file.getinfo('records.jsonl').compress_type == method
+    assert zip_file.read('records.jsonl') == data
+
+def test_codec_levels_are_checked():
+    assert parse_codec('deflate') == (zipfile.ZIP_DEFLATED, 6)
+    assert parse_codec('BZIP2:1') == (zipfile.ZIP_BZIP2, 1)
+    with pytest.raises(ValueError, match='between 1 and 9'):
+        parse_codec('deflate:0')
+    with pytest.raises(ValueError, match='Unsupported compression'):
+        parse_codec('gzip')
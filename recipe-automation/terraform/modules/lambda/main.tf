@@ -22,6 +22,7 @@ resource "aws_lambda_function" "recipe_processor" {
       RECIPE_BUCKET  = var.recipe_bucket_name
       ARCHIVE_BUCKET = var.archive_bucket_name
       ENVIRONMENT    = var.environment
+      ZIP_CODEC      = var.zip_codec
     }
   }
 
@@ -100,8 +101,25 @@ resource "aws_lambda_function" "split_file" {
 
   environment {
     variables = {
-      ENVIRONMENT       = var.environment
-      STEP_FUNCTION_ARN = aws_sfn_state_machine.recipe_processor.arn
+      ENVIRONMENT           = var.environment
+      STEP_FUNCTION_ARN     = aws_sfn_state_machine.recipe_processor.arn
+      OUTPUT_FORMAT         = var.output_format
+      MERGE_MODE            = var.merge_mode
+      ZIP_CODEC             = var.zip_codec
+      # Chunk planner inputs: what runs each chunk and how many at once
+      MAP_MAX_CONCURRENCY   = var.map_max_concurrency
+      CHUNK_MEMORY_MB       = min(aws_lambda_function.process_chunk.memory_size, aws_lambda_function.merge_results.memory_size)
+      CHUNK_TIMEOUT_SECONDS = aws_lambda_function.process_chunk.timeout
+      CHUNKS_IN_MEMORY      = var.merge_prefetch_chunks + 1
+      # Smaller uploads are processed and merged inside split_file
+      DIRECT_PROCESSING_MAX_BYTES = var.direct_processing_threshold
+      # Keys of a wrapper object whose array holds the records
+      RECORD_WRAPPER_KEYS         = var.record_wrapper_keys
+      # Random-access record index in merged ZIPs
+      RECORD_INDEX                = var.record_index
+      # Re-uploaded content gets a copy of its earlier output
+      RESULT_CACHE_ENABLED        = var.result_cache_enabled
+      RESULT_CACHE_HASH_MAX_BYTES = var.result_cache_hash_max_bytes
     }
   }
 
@@ -130,7 +148,12 @@ resource "aws_lambda_function" "process_chunk" {
 
   environment {
     variables = {
-      ENVIRONMENT = var.environment
+      ENVIRONMENT          = var.environment
+      DOWNLOAD_PART_BYTES  = var.download_part_size
+      DOWNLOAD_CONCURRENCY = var.download_concurrency
+      UPLOAD_PART_BYTES    = var.upload_part_size
+      # Retries and reruns reuse chunks already parsed from the same upload version
+      CHUNK_CACHE_ENABLED  = var.chunk_cache_enabled
     }
   }
 
@@ -154,7 +177,11 @@ resource "aws_lambda_function" "merge_results" {
 
   environment {
     variables = {
-      ENVIRONMENT = var.environment
+      ENVIRONMENT       = var.environment
+      PREFETCH_CHUNKS   = var.merge_prefetch_chunks
+      UPLOAD_PART_BYTES = var.upload_part_size
+      ZIP_CODEC         = var.zip_codec
+      MERGE_FAN_IN      = var.merge_fan_in
     }
   }
 
@@ -170,11 +197,26 @@ resource "aws_sfn_state_machine" "recipe_processor" {
     Comment = "Recipe processing workflow"
     StartAt = "ProcessChunks"
     States = {
+      # A distributed Map: items come from the chunk manifest split_file
+      # wrote, and the results go back to S3 instead of the state payload
       ProcessChunks = {
         Type = "Map"
-        ItemsPath = "$.chunks"
-        MaxConcurrency = 5
-        Iterator = {
+        MaxConcurrency = var.map_max_concurrency
+        ItemReader = {
+          Resource = "arn:aws:states:::s3:getObject"
+          ReaderConfig = {
+            InputType = "JSON"
+          }
+          Parameters = {
+            "Bucket.$" = "$.manifest.bucket"
+            "Key.$" = "$.manifest.key"
+          }
+        }
+        ItemProcessor = {
+          ProcessorConfig = {
+            Mode = "DISTRIBUTED"
+            ExecutionType = "STANDARD"
+          }
           StartAt = "ProcessChunk"
           States = {
             ProcessChunk = {
@@ -192,11 +234,78 @@ resource "aws_sfn_state_machine" "recipe_processor" {
             }
           }
         }
-        Next = "MergeResults"
+        ResultWriter = {
+          Resource = "arn:aws:states:::s3:putObject"
+          Parameters = {
+            "Bucket.$" = "$.manifest.bucket"
+            Prefix = "processed/map-results"
+          }
+        }
+        # merge_results loads the chunk results from the run's manifest
+        ResultSelector = {
+          "bucket.$" = "$.ResultWriterDetails.Bucket"
+          "map_results_key.$" = "$.ResultWriterDetails.Key"
+        }
+        Next = "PlanMerge"
+      }
+      # Chunk results are merged in groups of at most MERGE_FAN_IN, in
+      # parallel, until one step can stitch what is left together
+      PlanMerge = {
+        Type = "Task"
+        Resource = aws_lambda_function.merge_results.arn
+        Parameters = {
+          action = "plan"
+          "items.$" = "$"
+        }
+        Next = "CheckMergePlan"
+      }
+      CheckMergePlan = {
+        Type = "Choice"
+        Choices = [
+          {
+            Variable = "$.final"
+            BooleanEquals = true
+            Next = "MergeResults"
+          }
+        ]
+        Default = "MergeGroups"
+      }
+      MergeGroups = {
+        Type = "Map"
+        ItemsPath = "$.groups"
+        # Inline Maps run at most 40 iterations at once
+        MaxConcurrency = min(var.map_max_concurrency, 40)
+        Parameters = {
+          action = "merge_group"
+          "items.$" = "$$.Map.Item.Value"
+        }
+        Iterator = {
+          StartAt = "MergeGroup"
+          States = {
+            MergeGroup = {
+              Type = "Task"
+              Resource = aws_lambda_function.merge_results.arn
+              Retry = [
+                {
+                  ErrorEquals = ["Lambda.TooManyRequestsException"],
+                  IntervalSeconds = 1,
+                  BackoffRate = 2,
+                  MaxAttempts = 5
+                }
+              ]
+              End = true
+            }
+          }
+        }
+        Next = "PlanMerge"
       }
       MergeResults = {
         Type = "Task"
         Resource = aws_lambda_function.merge_results.arn
+        Parameters = {
+          action = "finalize"
+          "items.$" = "$.items"
+        }
         End = true
       }
     }
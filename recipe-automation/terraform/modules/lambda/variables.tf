@@ -43,3 +43,93 @@ variable "step_functions_role_arn" {
   description = "ARN of the IAM role for Step Functions state machine"
   type        = string
 }
+
+variable "download_part_size" {
+  description = "Size in bytes of each concurrent sub-range GET made by process_chunk"
+  type        = number
+  default     = 8388608
+}
+
+variable "download_concurrency" {
+  description = "Number of sub-range GETs process_chunk runs at once per chunk"
+  type        = number
+  default     = 8
+}
+
+variable "upload_part_size" {
+  description = "Size in bytes of each multipart upload part written by the Lambda functions (minimum 5MB)"
+  type        = number
+  default     = 8388608
+}
+
+variable "merge_prefetch_chunks" {
+  description = "Number of chunk data files merge_results downloads ahead of the one it is writing; each is held in memory"
+  type        = number
+  default     = 3
+}
+
+variable "map_max_concurrency" {
+  description = "Chunks the distributed Map processes at once (merge groups use up to 40); split_file sizes chunks to fill these slots"
+  type        = number
+  default     = 100
+}
+
+variable "direct_processing_threshold" {
+  description = "Uploads smaller than this many bytes are processed inside split_file without starting the state machine (0 disables)"
+  type        = number
+  default     = 5242880
+}
+
+variable "result_cache_enabled" {
+  description = "Reuse the output of an earlier upload with the same content and output settings instead of processing it again"
+  type        = bool
+  default     = true
+}
+
+variable "record_wrapper_keys" {
+  description = "Comma-separated top-level keys whose array holds the records when an upload is a single wrapper object; uploads can name another with x-amz-meta-record-key"
+  type        = string
+  default     = "recipes,variations"
+}
+
+variable "record_index" {
+  description = "Add index.json to JSON and JSON Lines ZIPs so single records can be fetched by id or ordinal; it costs compression ratio and merge memory, and uploads can ask for it with x-amz-meta-record-index"
+  type        = bool
+  default     = false
+}
+
+variable "result_cache_hash_max_bytes" {
+  description = "Largest upload split_file reads to hash when S3 has no usable checksum or MD5 ETag for it; larger ones skip the result cache"
+  type        = number
+  default     = 1073741824
+}
+
+variable "chunk_cache_enabled" {
+  description = "Let process_chunk return the data file an earlier run wrote for the same byte range of the same upload version"
+  type        = bool
+  default     = true
+}
+
+variable "merge_fan_in" {
+  description = "Most chunk results or intermediate parts one merge step takes; larger executions merge in parallel groups, level by level"
+  type        = number
+  default     = 32
+}
+
+variable "output_format" {
+  description = "Default format for chunk data and merged output (json, jsonl or columnar); uploads can override it with x-amz-meta-output-format"
+  type        = string
+  default     = "json"
+}
+
+variable "merge_mode" {
+  description = "Default way merge_results assembles chunk data: zip, or concat (server-side concatenation, jsonl only); uploads can override it with x-amz-meta-merge-mode"
+  type        = string
+  default     = "zip"
+}
+
+variable "zip_codec" {
+  description = "Default ZIP codec as codec or codec:level (stored, deflate, bzip2, lzma, zstd); uploads can override it with x-amz-meta-compression"
+  type        = string
+  default     = "deflate"
+}
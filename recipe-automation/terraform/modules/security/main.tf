@@ -72,7 +72,8 @@ resource "aws_iam_role_policy" "lambda_s3_policy" {
           "s3:GetObject",
           "s3:PutObject",
           "s3:ListBucket",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ]
         Resource = [
           var.recipe_bucket_arn,
@@ -158,6 +159,33 @@ resource "aws_iam_role_policy" "step_functions" {
           "${var.process_chunk_lambda_arn}",
           "${var.merge_results_lambda_arn}"
         ]
+      },
+      # The distributed Map reads its chunk manifest from S3 and writes the
+      # chunk results back there
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:ListMultipartUploadParts",
+          "s3:AbortMultipartUpload"
+        ]
+        Resource = [
+          "${var.recipe_bucket_arn}/*"
+        ]
+      },
+      # ...and runs each batch of items as a child execution
+      {
+        Effect = "Allow"
+        Action = [
+          "states:StartExecution",
+          "states:DescribeExecution",
+          "states:StopExecution"
+        ]
+        Resource = [
+          "arn:aws:states:us-west-2:202533497212:stateMachine:recipe-automation-${var.environment}-recipe-processor",
+          "arn:aws:states:us-west-2:202533497212:execution:recipe-automation-${var.environment}-recipe-processor/*"
+        ]
       }
     ]
   })